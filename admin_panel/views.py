@@ -7,6 +7,7 @@ from decimal import Decimal
 
 from .models import TokenSupply, TokenOperation
 from trees.models import TonDistribution
+from trees.distribution import invalidate_active_distribution
 from users.models import User
 
 from django.contrib.auth import authenticate, login, logout
@@ -139,6 +140,7 @@ def create_ton_distribution(request):
                 duration_hours=duration_hours,
                 is_active=True
             )
+            invalidate_active_distribution()
             
             # Записываем операцию
             TokenOperation.objects.create(
@@ -39,6 +39,7 @@ from users.models import User as TelegramUser
 from referrals.models import Referral, ReferralBonus
 from trees.models import BurnedToken
 from p2p.models import P2PSettings
+from p2p.stats import get_stats as p2p_get_stats
 
 from db_helpers import (
     check_is_admin,
@@ -58,7 +59,6 @@ from db_helpers import (
     get_all_bot_admins,
 )
 from asgiref.sync import sync_to_async
-from django.db.models import Q, F
 from django.utils import timezone
 
 from trees.models import Tree
@@ -191,32 +191,19 @@ def db_user_exists(telegram_id: int) -> bool:
 @sync_to_async
 def db_get_trees_to_remind(limit: int = 500):
     now = timezone.now()
-    due_time = now - timezone.timedelta(hours=Tree.WATER_DURATION)
 
+    # next_reminder_at — индексированный срок напоминания (конец воды с учётом автополива,
+    # пока напоминание после последнего полива не отправлено)
     qs = (
         Tree.objects.select_related("user")
-        # напоминать только тем, кого вообще можно уведомить
-        .filter(user__telegram_id__isnull=False)
-
-        # напоминать только если полив уже был хотя бы раз
-        .filter(last_watered__isnull=False)
-
-        # автополив НЕ активен
-        .filter(Q(auto_water_until__isnull=True) | Q(auto_water_until__lte=now))
-
-        # вода закончилась
-        .filter(last_watered__lte=due_time)
-
-        # напоминание ещё не отправляли после последнего полива
-        .filter(Q(water_reminder_sent_at__isnull=True) | Q(water_reminder_sent_at__lt=F("last_watered")))
-
-        .order_by("id")
+        .filter(next_reminder_at__lte=now)
+        .order_by("next_reminder_at")
     )
     return list(qs[:limit])
 
 @sync_to_async
 def db_mark_reminded(tree_id, ts):
-    Tree.objects.filter(id=tree_id).update(water_reminder_sent_at=ts)
+    Tree.objects.filter(id=tree_id).update(water_reminder_sent_at=ts, next_reminder_at=None)
 async def notify_water_due_job(context: ContextTypes.DEFAULT_TYPE):
     now = timezone.now()
     trees = await db_get_trees_to_remind()
@@ -405,6 +392,18 @@ async def stata_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🕒 АФК (не поливали {s['days']}д+): <b>{s['afk']}</b>\n"
         f"🥶 Никогда не поливали: <b>{s['never_watered']}</b>"
     )
+
+    p2p = await sync_to_async(p2p_get_stats)()
+    msg += (
+        f"\n\n💱 <b>P2P за 24ч</b>\n"
+        f"🔁 Сделок: <b>{p2p['trades']}</b>\n"
+        f"🌿 Объём: <b>{p2p['volume_cf']:.2f} FL</b> / <b>{p2p['volume_ton']:.4f} TON</b> / <b>{p2p['volume_rub']:.2f} ₽</b>"
+    )
+    if p2p["vwap"] is not None:
+        msg += (
+            f"\n📈 VWAP: <b>{p2p['vwap']:.2f} ₽</b>\n"
+            f"↕️ Мин/макс: <b>{p2p['low']:.2f}</b> – <b>{p2p['high']:.2f} ₽</b>"
+        )
     await update.message.reply_text(msg, parse_mode="HTML")
 
 
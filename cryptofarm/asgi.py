@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Потоковые эндпоинты (SSE, cryptofarm.events — p2p/stream/, rps/api/game/<id>/stream/) — async-views:
+запускайте приложение ASGI-сервером (``uvicorn cryptofarm.asgi:application``),
+тогда открытое соединение не занимает поток. Под WSGI (runserver) они отвечают
+204 — EventSource перестаёт переподключаться, и страница остаётся на опросе.
 """
 
 import os
@@ -12,5 +17,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cryptofarm.settings')
+# Веб-процесс сам обновляет устаревшие курсы P2P в фоне (p2p.fx); отключить — env false
+os.environ.setdefault('P2P_FX_BACKGROUND_REFRESH', 'true')
 
 application = get_asgi_application()
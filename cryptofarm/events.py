@@ -0,0 +1,230 @@
+# cryptofarm/events.py
+"""
+Каналы событий для потоковых эндпоинтов (Server-Sent Events).
+
+Событие канала — {"id", "type", "data", "ts"}; id растёт монотонно внутри канала
+(cache.incr), каждое событие лежит в кэше под своим ключом EVENTS_TTL секунд.
+События живут в отдельном алиасе кэша settings.EVENTS_CACHE: всплеск событий
+не вытесняет ключи других подсистем (версию книги ордеров, очередь подбора RPS).
+Счётчик канала живёт EVENTS_SEQ_TTL секунд с последней публикации, поэтому
+счётчики разовых каналов (rps:game:<id>) не копятся вечно.
+
+Подписчик читает ключи id+1..последний одним get_many, поэтому с общим кэшем
+события видны всем процессам, а клиент, переподключившийся с Last-Event-ID,
+получает пропущенное. Если клиент отстал больше чем на EVENTS_BACKLOG событий
+(или они истекли), он получает событие reset и должен перечитать состояние
+обычным запросом. Подписчики в том же процессе будятся сразу, из других —
+не позже чем через EVENTS_POLL_INTERVAL.
+
+Стримы — async-генераторы и отдаются только через ASGI (cryptofarm/asgi.py):
+под WSGI Django дочитал бы бесконечный поток целиком, поэтому там sse_response
+отвечает 204 — по стандарту SSE клиент больше не переподключается.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+SEQ_KEY = "events:{}:seq"
+EVENT_KEY = "events:{}:{}"
+
+# Сколько ждать событие, id которого уже выдан, но само ещё не записано
+GAP_GRACE = 2.0
+
+_lock = threading.Lock()
+_waiters = {}
+
+
+def cache():
+    """Кэш событий (settings.EVENTS_CACHE, иначе default)."""
+    alias = getattr(settings, "EVENTS_CACHE", "events")
+    return caches[alias if alias in settings.CACHES else "default"]
+
+
+def _ttl():
+    return getattr(settings, "EVENTS_TTL", 300)
+
+
+def _seq_ttl():
+    # Счётчик должен пережить свои события, иначе новые id совпадут со старыми ключами
+    return max(getattr(settings, "EVENTS_SEQ_TTL", 86400), _ttl() * 2)
+
+
+def _backlog():
+    backlog = getattr(settings, "EVENTS_BACKLOG", 1000)
+    events_cache = cache()
+    if hasattr(events_cache, "_cull"):
+        # LocMem/файловый/БД-кэш держат не больше MAX_ENTRIES ключей и вытесняют лишнее:
+        # отставание больше ёмкости всё равно не дочитать
+        backlog = min(backlog, events_cache._max_entries - 1)
+    return backlog
+
+
+def _poll_interval():
+    return getattr(settings, "EVENTS_POLL_INTERVAL", 1.0)
+
+
+def _heartbeat():
+    return getattr(settings, "EVENTS_HEARTBEAT", 15.0)
+
+
+# --- публикация ---
+
+def _next_id(channel):
+    events_cache, key = cache(), SEQ_KEY.format(channel)
+    if events_cache.add(key, 1, _seq_ttl()):
+        return 1
+    try:
+        event_id = events_cache.incr(key)
+    except ValueError:
+        # Счётчик вытеснен или истёк: начинаем заново, подписчики получат reset
+        events_cache.set(key, 1, _seq_ttl())
+        return 1
+    events_cache.touch(key, _seq_ttl())
+    return event_id
+
+
+def last_id(channel):
+    return cache().get(SEQ_KEY.format(channel), 0)
+
+
+def publish(channel, kind, data):
+    """Публикует событие; вызывать после коммита транзакции. Возвращает id события."""
+    event_id = _next_id(channel)
+    cache().set(
+        EVENT_KEY.format(channel, event_id),
+        {"id": event_id, "type": kind, "data": data, "ts": time.time()},
+        _ttl(),
+    )
+    with _lock:
+        waiters = list(_waiters.get(channel, ()))
+    for loop, event in waiters:
+        loop.call_soon_threadsafe(event.set)
+    return event_id
+
+
+# --- чтение ---
+
+def read_since(channel, since_id):
+    """
+    События с id > since_id: (события, новый курсор, reset).
+    reset=True — часть событий потеряна, клиент должен перечитать состояние.
+    """
+    head = last_id(channel)
+    if head < since_id:
+        # Счётчик сброшен (перезапуск кэша)
+        return [], head, True
+    if head == since_id:
+        return [], since_id, False
+    if head - since_id > _backlog():
+        return [], head, True
+
+    keys = [EVENT_KEY.format(channel, i) for i in range(since_id + 1, head + 1)]
+    found = cache().get_many(keys)
+    events = [found.get(key) for key in keys]
+    # Время ближайшего записанного события после каждой позиции
+    next_ts, ts = [None] * len(events), None
+    for index in range(len(events) - 1, -1, -1):
+        next_ts[index] = ts
+        if events[index] is not None:
+            ts = events[index]["ts"]
+
+    result, cursor, reset = [], since_id, False
+    for index, event in enumerate(events):
+        if event is None:
+            if next_ts[index] is None or time.time() - next_ts[index] < GAP_GRACE:
+                # Публикатор между incr и set — дочитаем в следующий раз
+                break
+            # Событие истекло или потеряно
+            reset = True
+        else:
+            result.append(event)
+        cursor = since_id + index + 1
+    return result, cursor, reset
+
+
+def format_event(event):
+    data = json.dumps(event["data"], ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+def _subscribe(channel):
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    with _lock:
+        _waiters.setdefault(channel, set()).add(waiter)
+    return waiter
+
+
+def _unsubscribe(channel, waiter):
+    with _lock:
+        waiters = _waiters.get(channel)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                del _waiters[channel]
+
+
+async def stream(channel, since_id=None, max_events=None):
+    """
+    Async-генератор SSE-сообщений канала. since_id=None — только новые события.
+    max_events ограничивает число событий (для тестов).
+    """
+    # Кэш может быть сетевым (Redis): синхронные вызовы — в пуле потоков, не в цикле событий
+    read = sync_to_async(read_since, thread_sensitive=False)
+    if since_id is None:
+        since_id = await sync_to_async(last_id, thread_sensitive=False)(channel)
+    waiter = _subscribe(channel)
+    sent = 0
+    try:
+        yield f"retry: 3000\nid: {since_id}\n\n"
+        last_write = time.monotonic()
+        while True:
+            waiter[1].clear()
+            events, since_id, reset = await read(channel, since_id)
+            if reset:
+                yield format_event({"id": since_id, "type": "reset", "data": {}})
+                last_write = time.monotonic()
+            for event in events:
+                yield format_event(event)
+                last_write = time.monotonic()
+                sent += 1
+                if max_events is not None and sent >= max_events:
+                    return
+            if time.monotonic() - last_write >= _heartbeat():
+                # Комментарий SSE: держит соединение через прокси и выявляет отвалившихся
+                yield ": ping\n\n"
+                last_write = time.monotonic()
+            try:
+                await asyncio.wait_for(waiter[1].wait(), _poll_interval())
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _unsubscribe(channel, waiter)
+
+
+def last_event_id(request):
+    """Курсор клиента: заголовок Last-Event-ID (переподключение EventSource) или ?last_event_id=."""
+    value = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    try:
+        return max(0, int(value)) if value else None
+    except ValueError:
+        return None
+
+
+def sse_response(request, channel):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(
+        stream(channel, last_event_id(request)), content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
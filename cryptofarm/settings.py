@@ -107,6 +107,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Пишущие транзакции берут блокировку сразу (BEGIN IMMEDIATE) и ждут друг друга
+            # до timeout, а не падают с "database is locked" при повышении блокировки
+            # посреди транзакции (параллельные покупки P2P, см. p2p.settlement)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Тестовая БД в файле (в .gitignore): общая in-memory БД не ждёт блокировок между
+        # потоками, а тесты конкурентных списаний гоняют запросы из нескольких потоков
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -211,15 +221,84 @@ GAME_SETTINGS = {
     'STAKING_DURATION': 7,  # Длительность стейкинга в днях
     'STAKING_BONUS': 0.1,  # +10% к доходу
     'P2P_COMMISSION': 0.03,  # 3% комиссия с P2P сделок
-    'ORDER_EXPIRY': 3,  # Ордера истекают через 3 дня
+    'ORDER_EXPIRY': 3,  # Ордера истекают через 3 дня (снимает `manage.py expire_orders --loop`)
     'MIN_CF_FOR_STAKING': 300,  # Минимальное количество CF для стейкинга
 }
 
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Каналы событий SSE (cryptofarm.events) — отдельно, чтобы всплеск событий
+    # не вытеснял ключи остальных подсистем
+    'events': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'events',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+# Общий кэш для нескольких процессов (gunicorn/uvicorn workers, бот): очередь подбора RPS,
+# версия книги ордеров P2P и каналы событий должны быть видны всем процессам.
+# LocMemCache подходит только для одного процесса (runserver, тесты)
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'events': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'events',
+        },
     }
+
+# Сколько секунд кэшируется снимок активной раздачи TON (trees.distribution)
+TON_DISTRIBUTION_CACHE_TTL = 5
+# На сколько слотов делится бюджет раздачи TON (TonDistributionSlot)
+TON_DISTRIBUTION_SLOTS = 16
+# Отложенная запись начислений (users.balances): начисления копятся в BalanceIncrement
+# и сворачиваются в балансы командой `manage.py flush_balances --loop`
+BALANCE_WRITE_BEHIND = False
+
+# Курсы валют для P2P (p2p.fx): источники и через сколько секунд курс считается устаревшим.
+# Обновляет `manage.py refresh_fx_rates --loop`, при устаревании — фоновый поток в веб-процессе
+P2P_FX_UPSTREAMS = {
+    "TON_USD": "p2p.fx.cryptocompare_ton_usd",
+    "USD_RUB": "p2p.fx.cbr_usd_rub",
 }
+P2P_FX_STALE_AFTER = 300
+# Обновлять устаревший курс фоновым потоком. По умолчанию выключено: бот, celery, тесты и
+# команды не ходят во внешние API сами. Включают переменной окружения; cryptofarm/asgi.py и
+# wsgi.py ставят её по умолчанию, для runserver — `P2P_FX_BACKGROUND_REFRESH=true manage.py runserver`
+P2P_FX_BACKGROUND_REFRESH = os.getenv('P2P_FX_BACKGROUND_REFRESH', 'false').lower() == 'true'
+# Сколько секунд живёт снимок «цена дня + рынок открыт» (p2p.market); бот меняет флаг
+# в своём процессе, поэтому при LocMemCache веб увидит /market_close не позже чем через TTL
+P2P_MARKET_CACHE_TTL = 60
+# Сколько секунд браузер/прокси держат график с незакрытой свечой (p2p price_history_json)
+P2P_CHART_MAX_AGE = 5
+# Сколько последних сделок держит буфер ленты в кэше (p2p.tape)
+P2P_TAPE_SIZE = 50
+# Сколько секунд живёт буфер ленты; после истечения он перечитывается из БД, поэтому
+# процессы без общего кэша видят чужие сделки с этой задержкой
+P2P_TAPE_CACHE_TTL = 5
+# Сколько секунд живёт снимок статистики за 24 часа (p2p.stats); после сделки сбрасывается сразу
+P2P_STATS_CACHE_TTL = 60
+# Каналы событий SSE (cryptofarm.events): алиас кэша, сколько секунд хранится событие
+# и счётчик канала после последней публикации, на сколько событий может отстать
+# переподключившийся клиент (не больше MAX_ENTRIES кэша событий), как часто подписчик
+# проверяет события других процессов и шлёт heartbeat
+EVENTS_CACHE = 'events'
+EVENTS_TTL = 300
+EVENTS_SEQ_TTL = 86400
+EVENTS_BACKLOG = 1000
+EVENTS_POLL_INTERVAL = 1.0
+EVENTS_HEARTBEAT = 15.0
+# Подбор соперника RPS (rps.matchmaking): сколько секунд игрок ждёт в очереди без опроса
+# и сколько хранится id найденной игры для ждущего
+RPS_SEARCH_TTL = 5
+RPS_MATCH_TTL = 60
 
 CSRF_TRUSTED_ORIGINS = [
     "https://flora.diy",
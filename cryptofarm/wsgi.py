@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cryptofarm.settings')
+# Веб-процесс сам обновляет устаревшие курсы P2P в фоне (p2p.fx); отключить — env false
+os.environ.setdefault('P2P_FX_BACKGROUND_REFRESH', 'true')
 
 application = get_wsgi_application()
@@ -1,7 +1,26 @@
 from django.contrib import admin
-from .models import Order, PriceHistory, P2PSettings
+from .models import Candle, Fill, Order, PriceHistory, P2PSettings
 
-admin.site.register(Order)
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    # cf_amount — остаток; исходный размер — original_cf_amount (остаток + filled_cf)
+    list_display = ('id', 'user', 'action', 'original_cf_amount', 'filled_cf', 'cf_amount', 'price_rub',
+                    'is_active', 'created_at', 'fulfilled_at')
+    list_filter = ('action', 'is_active')
+    list_select_related = ('user',)
+    ordering = ('-created_at',)
+
+@admin.register(Fill)
+class FillAdmin(admin.ModelAdmin):
+    list_display = ('order', 'buyer', 'seller', 'cf_amount', 'price_rub', 'ton_amount', 'created_at')
+    list_select_related = ('order', 'buyer', 'seller')
+    ordering = ('-created_at',)
+
+@admin.register(Candle)
+class CandleAdmin(admin.ModelAdmin):
+    list_display = ('resolution', 'bucket', 'open', 'high', 'low', 'close', 'volume_cf', 'trades')
+    list_filter = ('resolution',)
+    ordering = ('-bucket',)
 
 @admin.register(PriceHistory)
 class PriceHistoryAdmin(admin.ModelAdmin):
@@ -0,0 +1,104 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (поле, id) без COUNT(*) и OFFSET.
+
+    Вью задаёт keyset_orderings = {"имя": "поле модели"} и default_keyset_ordering;
+    клиент выбирает ?ordering=имя или -имя (по убыванию). Курсор — последняя
+    выданная пара (значение, id), следующая страница — строки строго после неё,
+    поэтому ордера, добавленные или исполненные между запросами, не дают
+    дублей и пропусков в уже пройденной части.
+    """
+
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = "cursor"
+    page_size_query_param = "limit"
+    ordering_query_param = "ordering"
+
+    def _ordering(self, request, view):
+        value = request.query_params.get(self.ordering_query_param) or view.default_keyset_ordering
+        name = value.lstrip("-")
+        if name not in view.keyset_orderings:
+            raise NotFound("Unknown ordering.")
+        return name, view.keyset_orderings[name], value.startswith("-")
+
+    def _page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _decode(self, request, name):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(raw.encode()).decode())
+            if cursor["o"] != name:
+                raise ValueError("cursor from another ordering")
+            return cursor["v"], int(cursor["id"])
+        except (ValueError, KeyError, TypeError):
+            raise NotFound("Invalid cursor.")
+
+    def _encode(self, name, value, pk):
+        payload = json.dumps({"o": name, "v": value, "id": pk}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        name, field, descending = self._ordering(request, view)
+        size = self._page_size(request)
+        model_field = queryset.model._meta.get_field(field)
+
+        if descending:
+            queryset = queryset.order_by(f"-{field}", "-id")
+        else:
+            queryset = queryset.order_by(field, "id")
+        cursor = self._decode(request, name)
+        if cursor is not None:
+            try:
+                value = model_field.to_python(cursor[0])
+            except ValidationError:
+                raise NotFound("Invalid cursor.")
+            after = "lt" if descending else "gt"
+            queryset = queryset.filter(
+                Q(**{f"{field}__{after}": value}) | Q(**{field: value, f"id__{after}": cursor[1]})
+            )
+
+        rows = list(queryset[:size + 1])
+        self.next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            self.next_cursor = self._encode(name, model_field.value_to_string(last), last.pk)
+        self.request = request
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -1,159 +1,56 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from django.utils import timezone
-from p2p.models import Order, Transaction, Message
-from users.api.serializers import UserSerializer
+
+from p2p.models import Fill, Order
+
+
+def short_name(user):
+    # Как на странице рынка: только первые символы имени
+    return (user.username or user.first_name or "")[:2]
+
 
 class OrderSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    is_expired = serializers.BooleanField(read_only=True)
-    total_price = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
-    expires_in = serializers.SerializerMethodField()
-    
-    class Meta:
-        model = Order
-        fields = (
-            'id', 'user', 'type', 'token_type', 'amount', 'price_per_unit',
-            'min_amount', 'payment_details', 'status', 'created_at',
-            'expires_at', 'is_expired', 'total_price', 'expires_in'
-        )
-        read_only_fields = ('id', 'user', 'created_at', 'is_expired', 'total_price')
-    
-    def get_expires_in(self, obj):
-        """Вычисляет время до истечения срока действия ордера в секундах"""
-        if obj.expires_at and obj.expires_at > timezone.now():
-            return int((obj.expires_at - timezone.now()).total_seconds())
-        return 0
-    
-    def validate(self, data):
-        """Проверка данных перед созданием или обновлением ордера"""
-        # Если это обновление, проверяем статус
-        if self.instance and self.instance.status in ['completed', 'cancelled']:
-            raise serializers.ValidationError("Нельзя редактировать завершенный или отмененный ордер")
-        
-        # Проверка минимальной суммы
-        if data.get('min_amount') and data.get('amount'):
-            if data['min_amount'] > data['amount']:
-                raise serializers.ValidationError(
-                    "Минимальная сумма не может быть больше общей суммы ордера"
-                )
-        
-        return data
-
-
-class OrderCreateSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания ордера"""
+    """Ордер книги; ONLY — поля, которые нужно загрузить (queryset.only)"""
+    ONLY = (
+        'id', 'action', 'cf_amount', 'filled_cf', 'price_rub', 'ton_to_rub', 'is_active', 'created_at', 'fulfilled_at',
+        'expires_at', 'user__telegram_id', 'user__username', 'user__first_name',
+    )
+
+    seller = serializers.SerializerMethodField()
+    # cf_amount — остаток к продаже, original_cf_amount — размер при выставлении
+    original_cf_amount = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    price_in_ton = serializers.FloatField(read_only=True)
+    total_ton = serializers.FloatField(read_only=True)
+
     class Meta:
         model = Order
         fields = (
-            'type', 'token_type', 'amount', 'price_per_unit',
-            'min_amount', 'payment_details'
-        )
-    
-    def validate(self, data):
-        """Проверка данных перед созданием ордера"""
-        user = self.context['request'].user
-        
-        # Проверка доступа к P2P-бирже
-        if not user.has_p2p_access:
-            raise serializers.ValidationError("У вас нет доступа к P2P-бирже")
-        
-        # Проверка баланса пользователя для ордера на продажу
-        if data['type'] == 'sell':
-            token_type = data['token_type']
-            amount = data['amount']
-            
-            if token_type == 'CF' and user.cf_balance < amount:
-                raise serializers.ValidationError(
-                    f"Недостаточно средств на балансе. Требуется {amount} CF, доступно {user.cf_balance} CF"
-                )
-            elif token_type == 'TON' and user.ton_balance < amount:
-                raise serializers.ValidationError(
-                    f"Недостаточно средств на балансе. Требуется {amount} TON, доступно {user.ton_balance} TON"
-                )
-            elif token_type == 'NOT' and user.not_balance < amount:
-                raise serializers.ValidationError(
-                    f"Недостаточно средств на балансе. Требуется {amount} NOT, доступно {user.not_balance} NOT"
-                )
-        
-        # Проверка минимальной суммы
-        if data['min_amount'] > data['amount']:
-            raise serializers.ValidationError(
-                "Минимальная сумма не может быть больше общей суммы ордера"
-            )
-        
-        return data
-    
-    def create(self, validated_data):
-        """Создание нового ордера"""
-        user = self.context['request'].user
-        
-        # Создаем ордер
-        order = Order.objects.create(
-            user=user,
-            **validated_data,
-            expires_at=timezone.now() + timezone.timedelta(days=3)  # Срок действия ордера по умолчанию
-        )
-        
-        # Если это ордер на продажу, блокируем средства на балансе пользователя
-        if order.type == 'sell':
-            if order.token_type == 'CF':
-                user.cf_balance -= order.amount
-            elif order.token_type == 'TON':
-                user.ton_balance -= order.amount
-            elif order.token_type == 'NOT':
-                user.not_balance -= order.amount
-            
-            user.save()
-        
-        return order
-
-
-class TransactionSerializer(serializers.ModelSerializer):
-    order = OrderSerializer(read_only=True)
-    buyer = UserSerializer(read_only=True)
-    seller = UserSerializer(read_only=True)
-    total_price = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
-    total_with_commission = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
-    
-    class Meta:
-        model = Transaction
-        fields = (
-            'id', 'order', 'buyer', 'seller', 'amount', 'price_per_unit',
-            'token_type', 'commission', 'status', 'created_at', 'updated_at',
-            'total_price', 'total_with_commission'
-        )
-        read_only_fields = (
-            'id', 'order', 'buyer', 'seller', 'amount', 'price_per_unit',
-            'token_type', 'commission', 'created_at', 'updated_at',
-            'total_price', 'total_with_commission'
+            'id', 'action', 'seller', 'cf_amount', 'filled_cf', 'original_cf_amount', 'price_rub', 'ton_to_rub',
+            'price_in_ton', 'total_ton', 'is_active', 'created_at', 'fulfilled_at', 'expires_at',
         )
+        read_only_fields = fields
+
+    def get_seller(self, obj):
+        return short_name(obj.user)
+
+
+class FillSerializer(serializers.ModelSerializer):
+    """Сделка текущего пользователя: side — buy, если он покупатель"""
+    ONLY = ('id', 'order_id', 'buyer_id', 'seller_id', 'cf_amount', 'price_rub', 'ton_amount', 'created_at')
 
+    order = serializers.IntegerField(source='order_id', read_only=True)
+    side = serializers.SerializerMethodField()
 
-class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
-    recipient = UserSerializer(read_only=True, source='recipient')
-    
     class Meta:
-        model = Message
-        fields = (
-            'id', 'transaction', 'sender', 'recipient', 'content',
-            'is_read', 'created_at'
-        )
-        read_only_fields = ('id', 'transaction', 'sender', 'is_read', 'created_at')
-    
-    def create(self, validated_data):
-        user = self.context['request'].user
-        transaction = validated_data['transaction']
-        
-        # Проверка, что пользователь является участником транзакции
-        if user != transaction.buyer and user != transaction.seller:
-            raise serializers.ValidationError("Вы не являетесь участником этой сделки")
-        
-        # Создаем сообщение
-        message = Message.objects.create(
-            transaction=transaction,
-            sender=user,
-            content=validated_data['content']
-        )
-        
-        return message 
\ No newline at end of file
+        model = Fill
+        fields = ('id', 'order', 'side', 'cf_amount', 'price_rub', 'ton_amount', 'created_at')
+        read_only_fields = fields
+
+    def get_side(self, obj):
+        return 'buy' if obj.buyer_id == self.context['request'].user.pk else 'sell'
+
+
+class BuySerializer(serializers.Serializer):
+    """Покупка по ордеру: без amount — весь остаток или ничего"""
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2, min_value=Decimal('0.01'), required=False)
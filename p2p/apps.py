@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class P2PConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'p2p'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,144 @@
+# p2p/candles.py
+"""
+OHLCV-свечи по сделкам P2P (Fill) в разрешениях 1m / 1h / 1d.
+
+record_fills() вызывается из p2p.matching в транзакции сделки и обновляет
+свечу каждого разрешения одним условным UPDATE (Greatest/Least для high/low).
+rebuild() пересчитывает свечи с нуля (команда rebuild_candles), в том числе по
+ордерам, исполненным до появления Fill. Границы свечей — по местному времени.
+"""
+
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+RESOLUTIONS = OrderedDict([
+    ("1m", timedelta(minutes=1)),
+    ("1h", timedelta(hours=1)),
+    ("1d", timedelta(days=1)),
+])
+
+
+def bucket_start(dt, resolution):
+    """Начало свечи, в которую попадает момент dt."""
+    local = timezone.localtime(dt)
+    if resolution == "1m":
+        return local.replace(second=0, microsecond=0)
+    if resolution == "1h":
+        return local.replace(minute=0, second=0, microsecond=0)
+    if resolution == "1d":
+        return local.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"unknown resolution {resolution}")
+
+
+def _volumes(trades):
+    """(объём CF, объём TON, оборот ₽) сделок [(price, cf, ton), ...]."""
+    return (
+        sum((cf for _price, cf, _ton in trades), Decimal("0")),
+        sum((ton for _price, _cf, ton in trades), Decimal("0")),
+        sum((price * cf for price, cf, _ton in trades), Decimal("0")),
+    )
+
+
+def _apply(resolution, bucket, trades):
+    """Добавляет сделки [(price, cf, ton), ...] одной свечи."""
+    from .models import Candle
+
+    prices = [price for price, _cf, _ton in trades]
+    volume_cf, volume_ton, volume_rub = _volumes(trades)
+    high, low, close = max(prices), min(prices), prices[-1]
+
+    updates = dict(
+        high=Greatest(F("high"), high), low=Least(F("low"), low), close=close,
+        volume_cf=F("volume_cf") + volume_cf, volume_ton=F("volume_ton") + volume_ton,
+        volume_rub=F("volume_rub") + volume_rub, trades=F("trades") + len(trades),
+    )
+    if Candle.objects.filter(resolution=resolution, bucket=bucket).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            Candle.objects.create(
+                resolution=resolution, bucket=bucket, open=prices[0], high=high, low=low, close=close,
+                volume_cf=volume_cf, volume_ton=volume_ton, volume_rub=volume_rub, trades=len(trades),
+            )
+    except IntegrityError:
+        # Свечу успела создать параллельная сделка
+        Candle.objects.filter(resolution=resolution, bucket=bucket).update(**updates)
+
+
+def _group(trades):
+    """{(resolution, bucket): [(price, cf, ton), ...]} в порядке времени сделок."""
+    groups = OrderedDict()
+    for at, price, cf, ton in sorted(trades, key=lambda t: t[0]):
+        for resolution in RESOLUTIONS:
+            groups.setdefault((resolution, bucket_start(at, resolution)), []).append((price, cf, ton))
+    return groups
+
+
+def record_fills(fills):
+    for (resolution, bucket), trades in _group(
+        (f.created_at, f.price_rub, f.cf_amount, f.ton_amount) for f in fills
+    ).items():
+        _apply(resolution, bucket, trades)
+
+
+def iter_trades(since=None):
+    """Все сделки по времени: Fill плюс ордера, исполненные до появления Fill."""
+    from .models import Fill, Order
+
+    fills = Fill.objects.order_by("created_at", "id")
+    legacy = Order.objects.filter(
+        action="sell", is_active=False, fulfilled_at__isnull=False, fills__isnull=True,
+    ).order_by("fulfilled_at", "id")
+    if since is not None:
+        fills = fills.filter(created_at__gte=since)
+        legacy = legacy.filter(fulfilled_at__gte=since)
+    for fill in fills.values_list("created_at", "price_rub", "cf_amount", "ton_amount").iterator(chunk_size=2000):
+        yield fill
+    for order in legacy.only("fulfilled_at", "price_rub", "cf_amount", "ton_to_rub").iterator(chunk_size=2000):
+        yield order.fulfilled_at, order.price_rub, order.cf_amount, Decimal(str(order.total_ton()))
+
+
+def rebuild(since=None):
+    """Пересчитывает свечи (начиная с since, выровненного на сутки). Возвращает число свечей."""
+    from .models import Candle
+
+    if since is not None:
+        since = bucket_start(since, "1d")
+    candles = []
+    for (resolution, bucket), trades in _group(iter_trades(since)).items():
+        prices = [price for price, _cf, _ton in trades]
+        volume_cf, volume_ton, volume_rub = _volumes(trades)
+        candles.append(Candle(
+            resolution=resolution, bucket=bucket,
+            open=prices[0], high=max(prices), low=min(prices), close=prices[-1],
+            volume_cf=volume_cf, volume_ton=volume_ton, volume_rub=volume_rub, trades=len(trades),
+        ))
+    with transaction.atomic():
+        stale = Candle.objects.all()
+        if since is not None:
+            stale = stale.filter(bucket__gte=since)
+        stale.delete()
+        Candle.objects.bulk_create(candles, batch_size=1000)
+    return len(candles)
+
+
+def get_candles(resolution, start=None, end=None, limit=None):
+    """Свечи одним запросом по индексу (resolution, bucket)."""
+    from .models import Candle
+
+    qs = Candle.objects.filter(resolution=resolution)
+    if start is not None:
+        qs = qs.filter(bucket__gte=start)
+    if end is not None:
+        qs = qs.filter(bucket__lt=end)
+    if start is None and limit:
+        # Последние limit свечей
+        return list(qs.order_by("-bucket")[:limit])[::-1]
+    qs = qs.order_by("bucket")
+    return list(qs[:limit] if limit else qs)
@@ -0,0 +1,81 @@
+# p2p/expiry.py
+"""
+Снятие просроченных ордеров (Order.expires_at) с возвратом CF из эскроу.
+
+Проход идёт пачками по индексу (is_active, expires_at). В транзакции пачки
+ордера снимаются условным UPDATE (только ещё активные — параллельная покупка
+могла успеть исполнить ордер), а CF возвращаются продавцам одним UPDATE с CASE
+на пачку, как при свёртке начислений (users.balances.flush). Книга и поток
+рынка узнают о снятии после коммита.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from users.models import User
+from users.supply import add_cf_circulating
+from .models import Order
+
+EXPIRY_CHUNK_SIZE = 500
+
+
+def expire_chunk(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """Снимает до chunk_size просроченных ордеров. Возвращает (ордеров, возвращено CF)."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        rows = list(
+            Order.objects.select_for_update()
+            .filter(is_active=True, expires_at__lte=now)
+            .order_by('expires_at', 'id')
+            .values_list('id', 'user_id', 'action', 'cf_amount')[:chunk_size]
+        )
+        if not rows:
+            return 0, Decimal('0')
+
+        ids = [row[0] for row in rows]
+        if Order.objects.filter(pk__in=ids, is_active=True).update(is_active=False) != len(rows):
+            # Часть пачки успели исполнить — откатываем и перечитаем в следующем проходе
+            transaction.set_rollback(True)
+            return 0, Decimal('0')
+
+        # В эскроу лежат только CF sell-ордеров
+        refunds = defaultdict(Decimal)
+        for _id, user_id, action, cf_amount in rows:
+            if action == 'sell' and cf_amount > 0:
+                refunds[user_id] += cf_amount
+        if refunds:
+            User.objects.filter(pk__in=list(refunds)).update(cf_balance=F('cf_balance') + Case(
+                *(When(pk=user_id, then=Value(amount)) for user_id, amount in refunds.items()),
+                default=Value(0),
+                output_field=DecimalField(max_digits=15, decimal_places=2),
+            ))
+        refunded = sum(refunds.values(), Decimal('0'))
+        if refunded:
+            add_cf_circulating(refunded)
+        transaction.on_commit(lambda: _sync_book(ids))
+    return len(rows), refunded
+
+
+def expire_due(now=None, chunk_size=EXPIRY_CHUNK_SIZE):
+    """Снимает все просроченные на now ордера пачками. Возвращает (ордеров, возвращено CF)."""
+    now = now or timezone.now()
+    total, refunded = 0, Decimal('0')
+    while True:
+        count, cf = expire_chunk(now, chunk_size)
+        total += count
+        refunded += cf
+        if count < chunk_size:
+            # Пустая пачка — либо всё снято, либо откат из-за гонки: добьём в следующем проходе
+            return total, refunded
+
+
+def _sync_book(order_ids):
+    from . import stream
+    from .orderbook import book
+    for order_id in order_ids:
+        book.remove(order_id)
+        stream.book_remove(order_id)
@@ -0,0 +1,202 @@
+# p2p/fx.py
+"""
+Курсы TON→USD и USD→RUB.
+
+Значения хранятся в таблице FxRate (общая для всех процессов) и обновляются
+в фоне командой `manage.py refresh_fx_rates --loop`. Читатели никогда не ходят
+во внешние API: они сразу получают последнее удачное значение и его возраст.
+Если значение устарело, читатель веб-процесса запускает обновление в фоновом
+потоке (settings.P2P_FX_BACKGROUND_REFRESH);
+одновременные обновления схлопываются арендой (lease_until) в строке курса,
+поэтому внешний API получает один запрос, а не лавину.
+
+Источники подключаются через settings.P2P_FX_UPSTREAMS (dotted path к функции
+без аргументов, возвращающей курс), в тестах их подменяют заглушкой.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+TON_USD = "TON_USD"
+USD_RUB = "USD_RUB"
+PAIRS = (TON_USD, USD_RUB)
+
+DEFAULT_UPSTREAMS = {
+    TON_USD: "p2p.fx.cryptocompare_ton_usd",
+    USD_RUB: "p2p.fx.cbr_usd_rub",
+}
+
+CACHE_KEY = "p2p:fx:{}"
+LEASE_SECONDS = 30
+
+
+def cryptocompare_ton_usd():
+    r = requests.get("https://min-api.cryptocompare.com/data/price?fsym=TON&tsyms=USD", timeout=5)
+    r.raise_for_status()
+    return Decimal(str(r.json()["USD"]))
+
+
+def cbr_usd_rub():
+    r = requests.get("https://www.cbr-xml-daily.ru/daily_json.js", timeout=5)
+    r.raise_for_status()
+    return Decimal(str(r.json()["Valute"]["USD"]["Value"]))
+
+
+def _upstream(pair):
+    upstreams = {**DEFAULT_UPSTREAMS, **getattr(settings, "P2P_FX_UPSTREAMS", {})}
+    return import_string(upstreams[pair])
+
+
+def _stale_after():
+    return getattr(settings, "P2P_FX_STALE_AFTER", 300)
+
+
+def _cache_ttl():
+    return getattr(settings, "P2P_FX_CACHE_TTL", 10)
+
+
+class Quote:
+    """Курс и момент его получения (fetched_at=None — курса ещё нет)."""
+
+    __slots__ = ("pair", "value", "fetched_at")
+
+    def __init__(self, pair, value=Decimal("0"), fetched_at=None):
+        self.pair = pair
+        self.value = value
+        self.fetched_at = fetched_at
+
+    @property
+    def age(self):
+        """Возраст в секундах или None."""
+        if self.fetched_at is None:
+            return None
+        return (timezone.now() - self.fetched_at).total_seconds()
+
+    @property
+    def is_stale(self):
+        return self.age is None or self.age > _stale_after()
+
+
+# --- чтение ---
+
+def get_quote(pair):
+    cached = cache.get(CACHE_KEY.format(pair))
+    if cached is not None:
+        quote = Quote(pair, *cached)
+    else:
+        quote = _load(pair)
+        cache.set(CACHE_KEY.format(pair), (quote.value, quote.fetched_at), _cache_ttl())
+
+    if quote.is_stale and getattr(settings, "P2P_FX_BACKGROUND_REFRESH", False):
+        refresh_in_background(pair)
+    return quote
+
+
+def _load(pair):
+    from .models import FxRate
+    row = FxRate.objects.filter(pair=pair).values_list("value", "fetched_at").first()
+    return Quote(pair, *row) if row else Quote(pair)
+
+
+def get_ton_to_usd():
+    """TON -> USD (0, если курса ещё нет)."""
+    return round(float(get_quote(TON_USD).value), 6)
+
+
+def get_usd_to_rub():
+    """USD -> RUB (₽ за 1$, 0, если курса ещё нет)."""
+    return round(float(get_quote(USD_RUB).value), 4)
+
+
+def get_ton_to_rub():
+    ton_usd = get_ton_to_usd()
+    usd_rub = get_usd_to_rub()
+    if ton_usd and usd_rub:
+        return round(ton_usd * usd_rub, 2)
+    return 0
+
+
+# --- обновление ---
+
+def _acquire_lease(pair):
+    """Single-flight: условный UPDATE пропускает только одного обновляющего."""
+    from .models import FxRate
+
+    now = timezone.now()
+    FxRate.objects.get_or_create(pair=pair)
+    return bool(
+        FxRate.objects.filter(pair=pair)
+        .filter(Q(lease_until__isnull=True) | Q(lease_until__lt=now))
+        .update(lease_until=now + timedelta(seconds=LEASE_SECONDS))
+    )
+
+
+def refresh(pair, force=False):
+    """
+    Запрашивает курс у источника и сохраняет его. Возвращает True при успехе.
+    Если обновление уже идёт в другом месте (или курс свежий и не force) — False.
+    """
+    from .models import FxRate
+
+    if not force and not _load(pair).is_stale:
+        return False
+    if not _acquire_lease(pair):
+        return False
+
+    try:
+        value = Decimal(_upstream(pair)())
+        if value <= 0:
+            raise ValueError(f"non-positive rate {value}")
+    except Exception as e:
+        # Последнее удачное значение остаётся в силе; аренду не снимаем —
+        # при недоступном источнике следующая попытка будет не раньше, чем через LEASE_SECONDS
+        logger.warning("FX %s refresh failed: %s", pair, e)
+        return False
+
+    now = timezone.now()
+    FxRate.objects.filter(pair=pair).update(value=value, fetched_at=now, lease_until=None)
+    cache.set(CACHE_KEY.format(pair), (value, now), _cache_ttl())
+    return True
+
+
+def refresh_all(force=False):
+    return {pair: refresh(pair, force=force) for pair in PAIRS}
+
+
+_last_attempt = {}
+_attempt_lock = threading.Lock()
+
+
+def refresh_in_background(pair):
+    """
+    Обновление в фоновом потоке. В пределах процесса — не чаще раза в LEASE_SECONDS
+    на пару, между процессами дубли отсекает аренда в refresh().
+    """
+    now = time.monotonic()
+    with _attempt_lock:
+        if now - _last_attempt.get(pair, float("-inf")) < LEASE_SECONDS:
+            return
+        _last_attempt[pair] = now
+
+    def run():
+        try:
+            refresh(pair)
+        except Exception:
+            logger.exception("FX %s background refresh crashed", pair)
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, name=f"fx-refresh-{pair}", daemon=True).start()
@@ -0,0 +1,239 @@
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from p2p import fx
+from p2p.models import Order, P2PSettings
+from p2p.orderbook import book
+from users.models import User
+
+OPERATIONS = ("sell", "buy", "book")
+
+# Курсы-заглушки: бенчмарк не ходит во внешние API
+STUB_UPSTREAMS = {
+    fx.TON_USD: "p2p.management.commands.bench_p2p.stub_ton_usd",
+    fx.USD_RUB: "p2p.management.commands.bench_p2p.stub_usd_rub",
+}
+
+
+def stub_ton_usd():
+    return Decimal("5")
+
+
+def stub_usd_rub():
+    return Decimal("90")
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу (values отсортированы)."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, math.ceil(p * len(values) / 100) - 1))
+    return values[index]
+
+
+def parse_mix(value):
+    """'sell=1,buy=1,book=2' -> веса операций."""
+    weights = dict.fromkeys(OPERATIONS, 0)
+    try:
+        for part in value.split(","):
+            name, weight = part.split("=")
+            if name not in weights:
+                raise ValueError(name)
+            weights[name] = int(weight)
+    except ValueError:
+        raise CommandError(f"--mix: ожидается {','.join(f'{op}=N' for op in OPERATIONS)}")
+    if not any(weights.values()):
+        raise CommandError("--mix: все веса нулевые")
+    return weights
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест P2P: N пользователей и M sell-ордеров на отдельной тестовой БД, "
+        "create_order_sell / buy_order / buy_ajax из пула потоков через тестовый клиент. "
+        "Печатает p50/p95/p99, ops/sec и запросов на операцию, проверяет сохранение CF и TON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50, help="Сколько пользователей создать")
+        parser.add_argument("--orders", type=int, default=200, help="Сколько sell-ордеров создать")
+        parser.add_argument("--threads", type=int, default=8, help="Размер пула потоков")
+        parser.add_argument("--ops", type=int, default=1000, help="Сколько операций выполнить")
+        parser.add_argument("--mix", default="sell=1,buy=1,book=2", help="Веса операций")
+        parser.add_argument("--seed", type=int, default=None, help="Seed генератора случайных чисел")
+        parser.add_argument("--output", help="Куда записать результат в JSON")
+        parser.add_argument("--keepdb", action="store_true", help="Не пересоздавать тестовую БД")
+
+    def handle(self, *args, **options):
+        weights = parse_mix(options["mix"])
+        if options["users"] < 2 or options["threads"] < 1 or options["ops"] < 1:
+            raise CommandError("Нужно минимум 2 пользователя, 1 поток и 1 операция")
+
+        # Как manage.py test: отдельная БД, рабочие данные не трогаются
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            with override_settings(P2P_FX_UPSTREAMS=STUB_UPSTREAMS, P2P_FX_BACKGROUND_REFRESH=False):
+                report = self.run(options, weights)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if not report["conservation"]["ok"]:
+            raise CommandError("Баланс CF/TON не сохранился")
+
+    # --- подготовка ---
+
+    def seed(self, n_users, n_orders, rng):
+        cache.clear()
+        P2PSettings.objects.all().delete()
+        P2PSettings.objects.create(is_market_open=True)
+        fx.refresh_all(force=True)
+
+        base = 9_000_000_000
+        User.objects.bulk_create([
+            User(
+                telegram_id=base + i, username=f"bench{i}", first_name="Bench",
+                cf_balance=Decimal("10000"), ton_balance=Decimal("1000"),
+            )
+            for i in range(n_users)
+        ])
+        users = list(User.objects.filter(telegram_id__gte=base).order_by("pk"))
+
+        # Ордера создаются с эскроу, как в create_order_sell: CF списаны с продавца
+        escrow = {}
+        orders = []
+        for _ in range(n_orders):
+            seller = rng.choice(users)
+            amount = Decimal(rng.randint(1, 50))
+            escrow[seller.pk] = escrow.get(seller.pk, Decimal("0")) + amount
+            orders.append(Order(
+                user=seller, action="sell", cf_amount=amount,
+                price_rub=Decimal(rng.randint(100, 300)) / 100, ton_to_rub=Decimal("450"),
+            ))
+        Order.objects.bulk_create(orders)
+        for user in users:
+            if user.pk in escrow:
+                user.cf_balance -= escrow[user.pk]
+                user.save(update_fields=["cf_balance"])
+        book.rebuild()
+
+        sessions = {}
+        for user in users:
+            session = SessionStore()
+            session["telegram_id"] = user.pk
+            session.save()
+            sessions[user.pk] = session.session_key
+        return [user.pk for user in users], sessions
+
+    @staticmethod
+    def totals():
+        cf = User.objects.aggregate(s=Sum("cf_balance"))["s"] or Decimal("0")
+        cf += Order.objects.filter(action="sell", is_active=True).aggregate(s=Sum("cf_amount"))["s"] or Decimal("0")
+        ton = User.objects.aggregate(s=Sum("ton_balance"))["s"] or Decimal("0")
+        return cf, ton
+
+    # --- нагрузка ---
+
+    def run(self, options, weights):
+        rng = random.Random(options["seed"])
+        user_ids, sessions = self.seed(options["users"], options["orders"], rng)
+        cf_before, ton_before = self.totals()
+
+        urls = {
+            "sell": reverse("p2p:sell_order"),
+            "buy": reverse("p2p:buy_order"),
+            "book": reverse("p2p:buy_ajax"),
+        }
+        plan = rng.choices(list(weights), weights=list(weights.values()), k=options["ops"])
+        picks = [(op, rng.choice(user_ids), rng.random()) for op in plan]
+        results = {op: [] for op in OPERATIONS}
+        results_lock = threading.Lock()
+
+        def call(op, user_id, r):
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = sessions[user_id]
+            if op == "sell":
+                request = lambda: client.post(urls["sell"], {"cf_amount": str(1 + int(r * 20))})
+            elif op == "buy":
+                orders, _has_more = book.page(sort="price_asc", limit=20)
+                if not orders:
+                    return
+                order = orders[int(r * len(orders))]
+                request = lambda: client.post(urls["buy"], {"order_id": order.id})
+            else:
+                request = lambda: client.get(urls["book"], {"sort": "price_asc"})
+
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = request()
+                    elapsed = time.perf_counter() - started
+                ok = response.status_code == 200 and (op == "book" or response.json().get("success"))
+                with results_lock:
+                    results[op].append((elapsed, len(queries), bool(ok)))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            for future in [pool.submit(call, *pick) for pick in picks]:
+                future.result()
+        wall = time.perf_counter() - started
+
+        cf_after, ton_after = self.totals()
+        return {
+            "config": {key: options[key] for key in ("users", "orders", "threads", "ops", "mix", "seed")},
+            "seconds": round(wall, 3),
+            "ops_per_sec": round(sum(len(r) for r in results.values()) / wall, 1) if wall else None,
+            "operations": {op: self.summary(rows, wall) for op, rows in results.items() if rows},
+            "conservation": {
+                "cf_before": str(cf_before), "cf_after": str(cf_after),
+                "ton_before": str(ton_before), "ton_after": str(ton_after),
+                "ok": cf_before == cf_after and ton_before == ton_after,
+            },
+        }
+
+    @staticmethod
+    def summary(rows, wall):
+        latencies = sorted(elapsed * 1000 for elapsed, _queries, _ok in rows)
+        return {
+            "count": len(rows),
+            "ok": sum(1 for _elapsed, _queries, ok in rows if ok),
+            "ops_per_sec": round(len(rows) / wall, 1) if wall else None,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "queries_per_request": round(sum(queries for _elapsed, queries, _ok in rows) / len(rows), 2),
+        }
+
+    def print_report(self, report):
+        self.stdout.write(f"{report['seconds']} s, {report['ops_per_sec']} ops/sec")
+        for op, s in report["operations"].items():
+            self.stdout.write(
+                f"{op:5} n={s['count']} ok={s['ok']} {s['ops_per_sec']} ops/sec "
+                f"p50={s['p50_ms']}ms p95={s['p95_ms']}ms p99={s['p99_ms']}ms "
+                f"queries={s['queries_per_request']}"
+            )
+        c = report["conservation"]
+        line = f"CF {c['cf_before']} -> {c['cf_after']}, TON {c['ton_before']} -> {c['ton_after']}"
+        self.stdout.write(self.style.SUCCESS(line) if c["ok"] else self.style.ERROR(line))
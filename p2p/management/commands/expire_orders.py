@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from p2p.expiry import EXPIRY_CHUNK_SIZE, expire_due
+
+
+class Command(BaseCommand):
+    help = "Снимает просроченные P2P-ордера (expires_at) и возвращает CF из эскроу продавцам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=EXPIRY_CHUNK_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Работать постоянно")
+        parser.add_argument("--interval", type=float, default=60.0, help="Пауза между проходами в --loop, сек")
+
+    def handle(self, *args, **options):
+        while True:
+            expired, refunded = expire_due(chunk_size=options["chunk_size"])
+            if expired or not options["loop"]:
+                self.stdout.write(f"Expired orders: {expired}, refunded CF: {refunded}")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,27 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from p2p import stats
+from p2p.candles import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает OHLCV-свечи P2P по сделкам (Fill и ранее исполненным ордерам)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", help="Пересчитать только начиная с даты YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            day = parse_date(options["since"])
+            if day is None:
+                raise CommandError("--since: ожидается дата YYYY-MM-DD")
+            since = timezone.make_aware(datetime.combine(day, time.min))
+        count = rebuild(since=since)
+        # Статистика 24ч вычитает вышедшие минутные свечи — пересобираем её по новым
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Candles rebuilt: {count}"))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from p2p.fx import PAIRS, get_quote, refresh
+
+
+class Command(BaseCommand):
+    help = "Обновляет курсы TON→USD и USD→RUB (p2p.fx); с --loop работает постоянно"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Работать постоянно")
+        parser.add_argument("--interval", type=float, default=60.0, help="Пауза между проходами в --loop, сек")
+        parser.add_argument("--force", action="store_true", help="Обновлять, даже если курс свежий")
+
+    def handle(self, *args, **options):
+        # Воркер обновляет курсы при каждом проходе, не дожидаясь устаревания
+        force = options["force"] or options["loop"]
+        while True:
+            for pair in PAIRS:
+                ok = refresh(pair, force=force)
+                quote = get_quote(pair)
+                age = "never" if quote.age is None else f"{quote.age:.0f}s"
+                line = f"{pair}: {quote.value} (age {age})"
+                self.stdout.write(self.style.SUCCESS(line) if ok else line)
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from p2p.market import warm_market_state
 from p2p.models import PriceHistory
 
 
@@ -11,8 +12,10 @@ class Command(BaseCommand):
         today = timezone.localdate()
         last = PriceHistory.objects.order_by('-date').first()
         if last and last.date == today:
+            warm_market_state()
             self.stdout.write("Already updated today.")
             return
         new_price = last.price + 1 if last else 1
         PriceHistory.objects.create(date=today, price=new_price)
+        warm_market_state()
         self.stdout.write(f"New price for {today}: {new_price}")
@@ -0,0 +1,93 @@
+# p2p/market.py
+"""
+Цена CF на сегодня и флаг «рынок открыт» одним закэшированным снимком.
+
+Ключ кэша включает местную дату, поэтому в полночь снимок меняется сам.
+Снимок заполняет команда update_price или первый запрос дня (под блокировкой,
+чтобы цена на новый день создавалась один раз). Сохранение P2PSettings и
+PriceHistory сбрасывает снимок — так срабатывают /market_open, /market_close
+бота и правки в админке. Бот — отдельный процесс: при LocMemCache веб-процессы
+увидят его изменение после MARKET_CACHE_TTL.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+CACHE_KEY = "p2p:market:{}"
+
+_lock = threading.Lock()
+
+
+def _cache_ttl():
+    return getattr(settings, "P2P_MARKET_CACHE_TTL", 60)
+
+
+def _key(today=None):
+    return CACHE_KEY.format((today or timezone.localdate()).isoformat())
+
+
+def _load(today):
+    """Читает (и при открытом рынке создаёт) цену дня: как раньше get_today_cf_price."""
+    from .models import P2PSettings, PriceHistory
+
+    p2p_settings = P2PSettings.objects.first()
+    is_open = p2p_settings.is_market_open if p2p_settings else True
+
+    today_obj = PriceHistory.objects.filter(date=today).first()
+    if today_obj:
+        return {"price": float(today_obj.price), "is_open": is_open}
+
+    prev = PriceHistory.objects.filter(date__lt=today).order_by('-date').first()
+    prev_price = float(prev.price) if prev else 1.0
+
+    # если рынок закрыт — НЕ повышаем и НЕ создаём запись за сегодня
+    if not is_open:
+        return {"price": prev_price, "is_open": is_open}
+
+    # рынок открыт — создаём цену +1 (параллельный процесс мог успеть раньше)
+    try:
+        with transaction.atomic():
+            obj, _created = PriceHistory.objects.get_or_create(date=today, defaults={"price": prev_price + 1})
+    except IntegrityError:
+        obj = PriceHistory.objects.get(date=today)
+    return {"price": float(obj.price), "is_open": is_open}
+
+
+def get_market_state():
+    """{"price": цена CF в ₽ на сегодня, "is_open": открыт ли рынок}."""
+    today = timezone.localdate()
+    key = _key(today)
+    state = cache.get(key)
+    if state is not None:
+        return state
+
+    with _lock:
+        state = cache.get(key)
+        if state is not None:
+            return state
+        # Между процессами дубль цены дня не даёт unique(date) + get_or_create
+        state = _load(today)
+        cache.set(key, state, _cache_ttl())
+    return state
+
+
+def get_today_cf_price():
+    return get_market_state()["price"]
+
+
+def is_market_open():
+    return get_market_state()["is_open"]
+
+
+def invalidate_market_state():
+    cache.delete(_key())
+
+
+def warm_market_state():
+    """Пересчитывает снимок (команда update_price)."""
+    invalidate_market_state()
+    return get_market_state()
@@ -0,0 +1,64 @@
+# p2p/matching.py
+"""
+Исполнение покупок CF по sell-ордерам.
+
+match_buy() проходит лучшие предложения в порядке price-time и исполняет их
+полностью или частично; plan_legs() раскладывает количество по ордерам,
+а саму проводку (блокировки, балансы, Fill, идемпотентность) делает p2p.settlement.
+"""
+
+from decimal import Decimal, ROUND_DOWN
+
+CF_QUANT = Decimal('0.01')
+TON_QUANT = Decimal('0.00000001')
+
+# Сколько ордеров максимум исполняется одной покупкой
+MAX_LEGS = 100
+
+
+class MatchError(Exception):
+    """Покупка не может быть исполнена; текст — для пользователя."""
+
+
+def leg_ton(order, cf_amount):
+    # Вниз, чтобы сумма ног не превысила бюджет покупателя
+    return (Decimal(str(order.price_in_ton)) * cf_amount).quantize(TON_QUANT, rounding=ROUND_DOWN)
+
+
+def plan_legs(orders, cf_amount, budget=None):
+    """
+    Раскладывает покупку cf_amount по ордерам (в порядке price-time) с учётом
+    бюджета покупателя в TON (None — без ограничения). Возвращает [(ордер, CF, TON)].
+    """
+    remaining = cf_amount
+    legs = []
+    for order in orders:
+        if remaining <= 0:
+            break
+        take = min(remaining, order.cf_amount)
+        price_in_ton = Decimal(str(order.price_in_ton))
+        if budget is not None and price_in_ton > 0:
+            # Не больше, чем покупатель может оплатить
+            take = min(take, (budget / price_in_ton).quantize(CF_QUANT, rounding=ROUND_DOWN))
+        if take <= 0:
+            break
+        ton = leg_ton(order, take)
+        if budget is not None:
+            budget -= ton
+        remaining -= take
+        legs.append((order, take, ton))
+    return legs
+
+
+def match_buy(buyer, cf_amount, limit_price=None, order_ids=None, fill_or_kill=False, idempotency_key=None):
+    """
+    Покупает до cf_amount CF по лучшим ценам (не дороже limit_price ₽/FL),
+    насколько хватает TON покупателя. order_ids ограничивает выбор ордеров,
+    fill_or_kill — купить всё количество или ничего. Проводка — p2p.settlement.settle.
+    Возвращает {"cf_amount", "ton_amount", "fills", "replayed"}; при неудаче — MatchError.
+    """
+    from .settlement import settle
+    return settle(
+        buyer, cf_amount, limit_price=limit_price, order_ids=order_ids,
+        fill_or_kill=fill_or_kill, idempotency_key=idempotency_key,
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0006_p2psettings'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['action', 'is_active', 'price_rub'], name='p2p_order_book_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0007_order_book_index'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cf_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('price_rub', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('ton_amount', models.DecimalField(decimal_places=8, max_digits=15)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='p2p_buys', to='users.user')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fills', to='p2p.order')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='p2p_sells', to='users.user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0008_fill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('pair', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('value', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('fetched_at', models.DateTimeField(blank=True, null=True)),
+                ('lease_until', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
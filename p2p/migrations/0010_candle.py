@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0009_fxrate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1 минута'), ('1h', '1 час'), ('1d', '1 день')], max_length=2)),
+                ('bucket', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('high', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('low', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('close', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('volume_cf', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('volume_ton', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('trades', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('resolution', 'bucket')},
+            },
+        ),
+    ]
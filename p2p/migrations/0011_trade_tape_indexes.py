@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0010_candle'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fill',
+            index=models.Index(fields=['created_at', 'id'], name='p2p_fill_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['fulfilled_at', 'id'], name='p2p_order_fulfilled_idx'),
+        ),
+    ]
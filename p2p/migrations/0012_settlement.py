@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0011_trade_tape_indexes'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Settlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('cf_amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('ton_amount', models.DecimalField(decimal_places=8, max_digits=15)),
+                ('fill_ids', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='p2p_settlements', to='users.user')),
+            ],
+            options={
+                'unique_together': {('buyer', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0012_settlement'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fill',
+            index=models.Index(fields=['buyer', 'created_at'], name='p2p_fill_buyer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fill',
+            index=models.Index(fields=['seller', 'created_at'], name='p2p_fill_seller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['action', 'is_active', 'created_at'], name='p2p_order_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='p2p_order_user_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0013_api_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('volume_cf', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('volume_ton', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('volume_rub', models.DecimalField(decimal_places=4, default=0, max_digits=24)),
+                ('trades', models.PositiveIntegerField(default=0)),
+                ('high', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True)),
+                ('low', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='candle',
+            name='volume_rub',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=24),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-17 08:05
+
+from datetime import timedelta
+
+import p2p.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_expires_at(apps, schema_editor):
+    # Срок старых ордеров считаем от создания: давно висящие снимет первый проход expire_orders
+    Order = apps.get_model('p2p', 'Order')
+    days = settings.GAME_SETTINGS['ORDER_EXPIRY']
+    Order.objects.update(expires_at=F('created_at') + timedelta(days=days))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0014_market_stats'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, default=p2p.models.order_expires_at, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['is_active', 'expires_at'], name='p2p_order_expiry_idx'),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-17 14:20
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+
+def backfill_filled_cf(apps, schema_editor):
+    # Исполненное по ордерам с Fill; у старых ордеров без Fill cf_amount не уменьшался
+    Order = apps.get_model('p2p', 'Order')
+    Fill = apps.get_model('p2p', 'Fill')
+    filled = (
+        Fill.objects.filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum('cf_amount'))
+        .values('total')
+    )
+    Order.objects.filter(pk__in=Fill.objects.values('order_id')).update(filled_cf=Subquery(filled))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('p2p', '0015_order_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='filled_cf',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15),
+        ),
+        migrations.RunPython(backfill_filled_cf, migrations.RunPython.noop),
+    ]
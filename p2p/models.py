@@ -1,3 +1,6 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from users.models import User  # Используй свой путь к модели пользователя!
@@ -12,6 +15,11 @@ class PriceHistory(models.Model):
     def __str__(self):
         return f"{self.date}: {self.price}₽"
 
+def order_expires_at():
+    """Срок жизни нового ордера: GAME_SETTINGS['ORDER_EXPIRY'] дней."""
+    return timezone.now() + timedelta(days=settings.GAME_SETTINGS['ORDER_EXPIRY'])
+
+
 class Order(models.Model):
     ACTIONS = (
         ('buy', 'Купить CF за TON'),
@@ -19,13 +27,36 @@ class Order(models.Model):
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     action = models.CharField(max_length=4, choices=ACTIONS)
+    # cf_amount — непроданный остаток: уменьшается каждым Fill и у исполненного ордера равен 0.
+    # filled_cf — сколько уже продано; исходный размер ордера — original_cf_amount.
     cf_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    filled_cf = models.DecimalField(max_digits=15, decimal_places=2, default=0)
     price_rub = models.DecimalField(max_digits=15, decimal_places=2)
     ton_to_rub = models.DecimalField(max_digits=15, decimal_places=8)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     fulfilled_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='fulfilled_orders')
     fulfilled_at = models.DateTimeField(null=True, blank=True)
+    # Просроченные ордера снимает p2p.expiry (команда expire_orders) и возвращает CF из эскроу
+    expires_at = models.DateTimeField(null=True, blank=True, default=order_expires_at)
+
+    class Meta:
+        indexes = [
+            # Холодная сборка книги ордеров (p2p.orderbook) и выборки активных ордеров по цене
+            models.Index(fields=['action', 'is_active', 'price_rub'], name='p2p_order_book_idx'),
+            # Исполненные ордера по времени (сделки до появления Fill, rebuild_candles)
+            models.Index(fields=['fulfilled_at', 'id'], name='p2p_order_fulfilled_idx'),
+            # API: новые ордера книги и «мои ордера» с курсором (created_at, id)
+            models.Index(fields=['action', 'is_active', 'created_at'], name='p2p_order_recent_idx'),
+            models.Index(fields=['user', 'created_at'], name='p2p_order_user_idx'),
+            # Проход expire_orders: активные ордера с истёкшим сроком
+            models.Index(fields=['is_active', 'expires_at'], name='p2p_order_expiry_idx'),
+        ]
+
+    @property
+    def original_cf_amount(self):
+        """Размер ордера при выставлении: остаток плюс исполненное."""
+        return self.cf_amount + self.filled_cf
 
     @property
     def price_in_ton(self):
@@ -37,7 +68,95 @@ class Order(models.Model):
         return float(self.cf_amount) * float(self.price_in_ton)
 
     def __str__(self):
-        return f"{self.get_action_display()} {self.cf_amount}CF @ {self.price_rub}₽"
+        return f"{self.get_action_display()} {self.original_cf_amount}CF @ {self.price_rub}₽"
+
+class Fill(models.Model):
+    """Исполнение (полное или частичное) sell-ордера, см. p2p.matching"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='fills')
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='p2p_buys')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='p2p_sells')
+    cf_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    price_rub = models.DecimalField(max_digits=15, decimal_places=2)
+    ton_amount = models.DecimalField(max_digits=15, decimal_places=8)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Сделки по времени с курсором по id (свечи, статистика)
+            models.Index(fields=['created_at', 'id'], name='p2p_fill_time_idx'),
+            # API: сделки пользователя, новые сначала
+            models.Index(fields=['buyer', 'created_at'], name='p2p_fill_buyer_idx'),
+            models.Index(fields=['seller', 'created_at'], name='p2p_fill_seller_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cf_amount}CF @ {self.price_rub}₽ ({self.ton_amount} TON)"
+
+class Settlement(models.Model):
+    """Результат покупки по ключу идемпотентности клиента (см. p2p.settlement)"""
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='p2p_settlements')
+    key = models.CharField(max_length=64)
+    cf_amount = models.DecimalField(max_digits=15, decimal_places=2)
+    ton_amount = models.DecimalField(max_digits=15, decimal_places=8)
+    fill_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('buyer', 'key')
+
+    def __str__(self):
+        return f"{self.buyer_id}:{self.key} {self.cf_amount}CF"
+
+class Candle(models.Model):
+    """OHLCV-свеча по сделкам P2P (см. p2p.candles)"""
+    RESOLUTIONS = (
+        ('1m', '1 минута'),
+        ('1h', '1 час'),
+        ('1d', '1 день'),
+    )
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()
+    open = models.DecimalField(max_digits=15, decimal_places=2)
+    high = models.DecimalField(max_digits=15, decimal_places=2)
+    low = models.DecimalField(max_digits=15, decimal_places=2)
+    close = models.DecimalField(max_digits=15, decimal_places=2)
+    volume_cf = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    volume_ton = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    # Оборот в рублях (Σ цена × CF) — для VWAP
+    volume_rub = models.DecimalField(max_digits=24, decimal_places=4, default=0)
+    trades = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        # Уникальный индекс (resolution, bucket) обслуживает и выборку диапазона
+        unique_together = ('resolution', 'bucket')
+
+    def __str__(self):
+        return f"{self.resolution} {self.bucket}: {self.open}/{self.high}/{self.low}/{self.close}"
+
+class MarketStats(models.Model):
+    """Суммы по сделкам за скользящие 24 часа, одна строка (см. p2p.stats)"""
+    # Первая минутная свеча, входящая в окно; более ранние уже вычтены
+    window_start = models.DateTimeField()
+    volume_cf = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    volume_ton = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    volume_rub = models.DecimalField(max_digits=24, decimal_places=4, default=0)
+    trades = models.PositiveIntegerField(default=0)
+    high = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    low = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+
+    def __str__(self):
+        return f"24h from {self.window_start}: {self.volume_cf} CF, {self.trades} trades"
+
+class FxRate(models.Model):
+    """Последний удачный курс валютной пары (см. p2p.fx)"""
+    pair = models.CharField(max_length=16, primary_key=True)
+    value = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    fetched_at = models.DateTimeField(null=True, blank=True)
+    # Аренда на обновление: пока не истекла, другие процессы не ходят во внешний API
+    lease_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.pair}: {self.value}"
 
 class P2PSettings(models.Model):
     is_market_open = models.BooleanField(default=True)
\ No newline at end of file
@@ -0,0 +1,226 @@
+# p2p/orderbook.py
+"""
+Книга ордеров на продажу CF в памяти процесса.
+
+Активные sell-ордера хранятся в двух отсортированных списках ключей:
+по цене (цена, время, id — приоритет price-time) и по объёму. Книга строится
+из БД при первом обращении (индекс action/is_active/price_rub) и обновляется
+сигналами Order после коммита транзакции. Между процессами книги согласуются
+через номер версии в кэше: изменившая книгу сторона атомарно увеличивает версию
+(cache.incr) и применяет изменение у себя, только если получила ровно свою версию + 1;
+иначе (было чужое изменение) и в остальных процессах книга перестраивается из БД.
+
+Для нескольких веб-процессов нужен общий кэш (settings.CACHES, Redis): с LocMemCache
+версия своя в каждом процессе, и чужие изменения видны только после перестройки
+по P2P_ORDERBOOK_MAX_AGE.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_CACHE_KEY = "p2p:orderbook:version"
+
+SORTS = ("price_asc", "price_desc", "amount_asc", "amount_desc")
+
+
+def _max_age():
+    # Страховка от изменений в обход сигналов (queryset.update и т.п.)
+    return getattr(settings, "P2P_ORDERBOOK_MAX_AGE", 60)
+
+
+class BookUser:
+    __slots__ = ("pk", "username", "first_name")
+
+    def __init__(self, pk, username, first_name):
+        self.pk = pk
+        self.username = username
+        self.first_name = first_name
+
+
+class BookOrder:
+    """Снимок sell-ордера с полями, нужными шаблону _buy_orders.html."""
+
+    __slots__ = ("id", "user", "cf_amount", "price_rub", "ton_to_rub", "created_at")
+
+    def __init__(self, id, user, cf_amount, price_rub, ton_to_rub, created_at):
+        self.id = id
+        self.user = user
+        self.cf_amount = cf_amount
+        self.price_rub = price_rub
+        self.ton_to_rub = ton_to_rub
+        self.created_at = created_at
+
+    @classmethod
+    def from_order(cls, order):
+        user = order.user
+        return cls(
+            order.id, BookUser(user.pk, user.username, user.first_name),
+            order.cf_amount, order.price_rub, order.ton_to_rub, order.created_at,
+        )
+
+    @property
+    def price_in_ton(self):
+        if self.ton_to_rub > 0:
+            return round(float(self.price_rub) / float(self.ton_to_rub), 8)
+        return 0
+
+    def total_ton(self):
+        return float(self.cf_amount) * float(self.price_in_ton)
+
+    @property
+    def price_key(self):
+        return (self.price_rub, self.created_at, self.id)
+
+    @property
+    def amount_key(self):
+        return (self.cf_amount, self.created_at, self.id)
+
+
+class OrderBook:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.orders = {}
+        self.by_price = []
+        self.by_amount = []
+        self.version = None
+        self.loaded_at = None
+
+    # --- синхронизация с БД ---
+
+    def _shared_version(self):
+        return cache.get(VERSION_CACHE_KEY, 0)
+
+    def _bump_version(self):
+        if cache.add(VERSION_CACHE_KEY, 1, None):
+            return 1
+        try:
+            return cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            # Ключ успел вытесниться между add и incr
+            cache.set(VERSION_CACHE_KEY, 1, None)
+            return 1
+
+    def rebuild(self):
+        from .models import Order
+
+        version = self._shared_version()
+        qs = (
+            Order.objects.filter(action="sell", is_active=True)
+            .select_related("user")
+            .only(
+                "id", "cf_amount", "price_rub", "ton_to_rub", "created_at",
+                "user__telegram_id", "user__username", "user__first_name",
+            )
+            .order_by("price_rub", "created_at", "id")
+        )
+        orders = [BookOrder.from_order(order) for order in qs]
+        with self.lock:
+            self.orders = {order.id: order for order in orders}
+            self.by_price = [order.price_key for order in orders]
+            self.by_amount = sorted(order.amount_key for order in orders)
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    def ensure_fresh(self):
+        if (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > _max_age()
+            or self.version != self._shared_version()
+        ):
+            self.rebuild()
+
+    # --- изменения ---
+
+    def _insert(self, entry):
+        self.orders[entry.id] = entry
+        insort(self.by_price, entry.price_key)
+        insort(self.by_amount, entry.amount_key)
+
+    def _remove(self, order_id):
+        entry = self.orders.pop(order_id, None)
+        if entry is None:
+            return
+        for keys, key in ((self.by_price, entry.price_key), (self.by_amount, entry.amount_key)):
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+
+    def _changed(self, apply):
+        with self.lock:
+            expected = self.version
+            # Проверка и увеличение — одна операция: между ними не вклинится чужое изменение
+            version = self._bump_version()
+            if self.loaded_at is not None and expected is not None and version == expected + 1:
+                apply()
+                self.version = version
+            # Иначе книга перестроится из БД при следующем чтении
+
+    def upsert(self, order):
+        """Новый ордер или изменение остатка (частичное исполнение)."""
+        if order.action != "sell":
+            return
+        if not order.is_active or order.cf_amount <= 0:
+            self.remove(order.id)
+            return
+        entry = BookOrder.from_order(order)
+
+        def apply():
+            self._remove(entry.id)
+            self._insert(entry)
+        self._changed(apply)
+
+    def remove(self, order_id):
+        """Ордер исполнен полностью, отменён или истёк."""
+        self._changed(lambda: self._remove(order_id))
+
+    # --- чтение ---
+
+    def _iter(self, sort, min_amount):
+        if sort in ("amount_asc", "amount_desc"):
+            keys = self.by_amount
+            if sort == "amount_asc":
+                start = bisect_left(keys, (min_amount,)) if min_amount else 0
+                for key in keys[start:]:
+                    yield self.orders[key[2]]
+            else:
+                stop = bisect_left(keys, (min_amount,)) if min_amount else 0
+                for key in reversed(keys[stop:]):
+                    yield self.orders[key[2]]
+            return
+        keys = self.by_price if sort != "price_desc" else reversed(self.by_price)
+        for key in keys:
+            order = self.orders[key[2]]
+            if min_amount and order.cf_amount < min_amount:
+                continue
+            yield order
+
+    def page(self, sort="price_asc", min_amount=None, offset=0, limit=50):
+        """Срез книги: (ордера, есть_ли_ещё)."""
+        if sort not in SORTS:
+            sort = "price_asc"
+        self.ensure_fresh()
+        with self.lock:
+            result = []
+            for index, order in enumerate(self._iter(sort, min_amount)):
+                if index < offset:
+                    continue
+                if len(result) == limit:
+                    return result, True
+                result.append(order)
+            return result, False
+
+    def top(self, n=10, sort="price_asc", min_amount=None):
+        return self.page(sort=sort, min_amount=min_amount, limit=n)[0]
+
+    def best_asks(self):
+        """Ордера в порядке price-time (для матчинга); без блокировки строк БД."""
+        self.ensure_fresh()
+        with self.lock:
+            return [self.orders[key[2]] for key in self.by_price]
+
+
+book = OrderBook()
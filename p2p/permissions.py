@@ -1,32 +1,22 @@
 from rest_framework import permissions
-from django.db.models import Q
 
-class HasP2PAccess(permissions.BasePermission):
+from users.models import User
+
+
+class IsTelegramUser(permissions.BasePermission):
     """
-    Проверяет, имеет ли пользователь доступ к P2P-бирже.
-    Доступ имеют только пользователи, которые участвуют в стейкинге.
+    Пользователь вошёл через Telegram (users.User, а не AnonymousUser).
     """
-    
+
     def has_permission(self, request, view):
-        """Проверка доступа"""
-        return request.user.has_p2p_access
+        return isinstance(request.user, User)
 
 
 class IsOrderOwner(permissions.BasePermission):
     """
     Проверяет, является ли пользователь владельцем ордера.
     """
-    
-    def has_object_permission(self, request, view, obj):
-        """Проверка на уровне объекта"""
-        return obj.user == request.user
-
 
-class IsTransactionParticipant(permissions.BasePermission):
-    """
-    Проверяет, является ли пользователь участником транзакции (покупателем или продавцом).
-    """
-    
     def has_object_permission(self, request, view, obj):
         """Проверка на уровне объекта"""
-        return obj.buyer == request.user or obj.seller == request.user 
\ No newline at end of file
+        return obj.user_id == request.user.pk
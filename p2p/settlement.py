@@ -0,0 +1,197 @@
+# p2p/settlement.py
+"""
+Проводка покупки CF по sell-ордерам одной транзакцией.
+
+Порядок блокировок всегда один: сначала ордера (в порядке price-time, id как
+последний ключ), затем строки пользователей — покупатель и продавцы — по
+возрастанию pk. Поэтому встречные покупки (продавец одного ордера покупает
+ордер другого) ждут друг друга, а не взаимоблокируются. Под заблокированными
+строками остатки и балансы меняются условными UPDATE (F() и проверка остатка),
+а не чтением-записью в Python.
+
+Ключ идемпотентности клиента (повтор запроса из мобильного клиента)
+сохраняется в Settlement вместе с результатом: повтор с тем же ключом
+возвращает сохранённый результат и ничего не исполняет повторно.
+"""
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_DOWN
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from users.balances import flush_pending
+from users.models import User
+from users.supply import add_cf_circulating
+from . import stats as market_stats
+from .candles import record_fills
+from .matching import CF_QUANT, MAX_LEGS, MatchError, plan_legs
+from .models import Fill, Order, Settlement
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+
+def _lock_asks(buyer, limit_price, order_ids):
+    qs = (
+        Order.objects.select_for_update()
+        .select_related('user')
+        .filter(action='sell', is_active=True)
+        .exclude(user=buyer)
+        .order_by('price_rub', 'created_at', 'id')
+    )
+    if order_ids is not None:
+        qs = qs.filter(id__in=order_ids)
+    if limit_price is not None:
+        qs = qs.filter(price_rub__lte=limit_price)
+    return list(qs[:MAX_LEGS])
+
+
+def _lock_users(user_ids):
+    rows = (
+        User.objects.select_for_update()
+        .filter(pk__in=user_ids)
+        .order_by('pk')
+        .values_list('pk', 'ton_balance')
+    )
+    return dict(rows)
+
+
+def _clean_key(idempotency_key):
+    return None if idempotency_key is None else str(idempotency_key)[:IDEMPOTENCY_KEY_MAX_LENGTH]
+
+
+def replay(buyer, idempotency_key):
+    """Сохранённый результат покупки с этим ключом или None."""
+    if idempotency_key is None:
+        return None
+    stored = Settlement.objects.filter(buyer=buyer, key=_clean_key(idempotency_key)).first()
+    if stored is None:
+        return None
+    fills = list(Fill.objects.filter(id__in=stored.fill_ids).order_by('id'))
+    return {"cf_amount": stored.cf_amount, "ton_amount": stored.ton_amount, "fills": fills, "replayed": True}
+
+
+def settle(buyer, cf_amount, limit_price=None, order_ids=None, fill_or_kill=False, idempotency_key=None):
+    """См. p2p.matching.match_buy."""
+    idempotency_key = _clean_key(idempotency_key)
+    stored = replay(buyer, idempotency_key)
+    if stored is not None:
+        return stored
+    cf_amount = Decimal(cf_amount)
+    # NaN/Infinity не квантуются и не сравниваются — отсекаем до quantize
+    if not cf_amount.is_finite() or cf_amount.quantize(CF_QUANT, rounding=ROUND_DOWN) <= 0:
+        raise MatchError(_("Введите положительное число FL."))
+    cf_amount = cf_amount.quantize(CF_QUANT, rounding=ROUND_DOWN)
+    if limit_price is not None:
+        limit_price = Decimal(limit_price)
+        if not limit_price.is_finite() or limit_price <= 0:
+            raise MatchError(_("Некорректная цена."))
+
+    # Несвёрнутые начисления (users.balances) должны попасть в баланс до условного списания TON
+    flush_pending([buyer.pk])
+    try:
+        result = _settle(buyer, cf_amount, limit_price, order_ids, fill_or_kill, idempotency_key)
+    except IntegrityError:
+        # Параллельный повтор с тем же ключом успел провести покупку — наша откатилась
+        stored = replay(buyer, idempotency_key)
+        if stored is None:
+            raise
+        return stored
+
+    buyer.refresh_from_db(fields=['cf_balance', 'ton_balance'])
+    return result
+
+
+def _settle(buyer, cf_amount, limit_price, order_ids, fill_or_kill, idempotency_key):
+    now = timezone.now()
+    with transaction.atomic():
+        orders = _lock_asks(buyer, limit_price, order_ids)
+        # Продавцы, которых коснётся покупка, известны только после раскладки;
+        # раскладываем по бюджету без блокировки, затем блокируем пользователей
+        # и раскладываем заново уже по заблокированному балансу
+        budget = User.objects.values_list('ton_balance', flat=True).get(pk=buyer.pk)
+        legs = plan_legs(orders, cf_amount, budget)
+        balances = _lock_users({buyer.pk, *(order.user_id for order, _cf, _ton in legs)})
+        budget = balances[buyer.pk]
+        legs = plan_legs([order for order, _cf, _ton in legs], cf_amount, budget)
+
+        total_cf = sum((cf for _order, cf, _ton in legs), Decimal('0'))
+        if fill_or_kill and total_cf < cf_amount:
+            need = sum((ton for _order, _cf, ton in plan_legs(orders, cf_amount)), Decimal('0'))
+            if sum((order.cf_amount for order in orders), Decimal('0')) < cf_amount:
+                raise MatchError(_("Ордер не найден или уже исполнен."))
+            raise MatchError(_("Недостаточно TON. Нужно %(need)s TON, у вас %(have)s.") % {
+                "need": f"{need:.5f}",
+                "have": budget,
+            })
+        if not legs:
+            raise MatchError(_("Нет подходящих ордеров или недостаточно TON."))
+
+        fills = []
+        seller_ton = defaultdict(Decimal)
+        for order, take, ton in legs:
+            closes = take == order.cf_amount
+            updates = {
+                "cf_amount": F('cf_amount') - take,
+                "filled_cf": F('filled_cf') + take,
+                "is_active": not closes,
+            }
+            if closes:
+                updates.update(fulfilled_by=buyer, fulfilled_at=now)
+            # Строка заблокирована, но UPDATE всё равно условный: остаток должен быть тем,
+            # по которому считали ногу, иначе вся покупка откатывается
+            remaining = {"cf_amount": take} if closes else {"cf_amount__gt": take}
+            if not Order.objects.filter(pk=order.pk, is_active=True, **remaining).update(**updates):
+                raise MatchError(_("Ордер не найден или уже исполнен."))
+            order.cf_amount -= take
+            order.filled_cf += take
+            order.is_active = not closes
+            if closes:
+                order.fulfilled_by = buyer
+                order.fulfilled_at = now
+            seller_ton[order.user_id] += ton
+            fills.append(Fill(
+                order=order, buyer=buyer, seller_id=order.user_id,
+                cf_amount=take, price_rub=order.price_rub, ton_amount=ton, created_at=now,
+            ))
+            transaction.on_commit(lambda order=order: _sync_book(order))
+
+        total_ton = sum((f.ton_amount for f in fills), Decimal('0'))
+        # Условное UPDATE: TON списывается, только если его хватает
+        if not User.objects.filter(pk=buyer.pk, ton_balance__gte=total_ton).update(
+            ton_balance=F('ton_balance') - total_ton,
+            cf_balance=F('cf_balance') + total_cf,
+        ):
+            raise MatchError(_("Недостаточно TON."))
+        for seller_id, ton in seller_ton.items():
+            User.objects.filter(pk=seller_id).update(ton_balance=F('ton_balance') + ton)
+        Fill.objects.bulk_create(fills)
+        # Статистика 24ч читает вышедшие из окна минутные свечи — до записи новых
+        market_stats.record_fills(fills)
+        record_fills(fills)
+        # CF продавцов списаны при создании ордера, покупателю — зачисляем в эмиссию
+        add_cf_circulating(total_cf)
+        if idempotency_key is not None:
+            Settlement.objects.create(
+                buyer=buyer, key=idempotency_key, cf_amount=total_cf, ton_amount=total_ton,
+                fill_ids=[f.id for f in fills],
+            )
+        transaction.on_commit(lambda: _publish_trades(fills))
+
+    return {"cf_amount": total_cf, "ton_amount": total_ton, "fills": fills, "replayed": False}
+
+
+def _sync_book(order):
+    from . import stream
+    from .orderbook import book
+    # Исполненный ордер upsert убирает из книги
+    book.upsert(order)
+    stream.book_upsert(order)
+
+
+def _publish_trades(fills):
+    from . import stream, tape
+    tape.publish()
+    stream.trades(fills)
@@ -0,0 +1,41 @@
+# p2p/signals.py
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .market import invalidate_market_state
+from .models import Order, P2PSettings, PriceHistory
+from .orderbook import book
+from . import stream
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # Книгу трогаем только после коммита — откаченный ордер в неё не попадёт
+    transaction.on_commit(lambda: _order_saved(instance))
+
+
+def _order_saved(order):
+    book.upsert(order)
+    stream.book_upsert(order)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    order_id = instance.id
+    transaction.on_commit(lambda: _order_deleted(order_id))
+
+
+def _order_deleted(order_id):
+    book.remove(order_id)
+    stream.book_remove(order_id)
+
+
+@receiver(post_save, sender=P2PSettings)
+@receiver(post_delete, sender=P2PSettings)
+@receiver(post_save, sender=PriceHistory)
+@receiver(post_delete, sender=PriceHistory)
+def market_state_changed(sender, **kwargs):
+    # /market_open, /market_close бота, админка, update_price
+    transaction.on_commit(invalidate_market_state)
@@ -0,0 +1,170 @@
+# p2p/stats.py
+"""
+Статистика рынка P2P за скользящие 24 часа: объём, оборот, VWAP, high/low, число сделок.
+
+Суммы хранятся в одной строке MarketStats. Каждая покупка прибавляет к ней свои
+сделки (record_fills, в транзакции p2p.settlement), а минутные свечи (p2p.candles),
+выпавшие из окна, вычитаются при сдвиге window_start. Экстремум пересчитывается
+по свечам окна, только если вышедшая свеча его задавала. Чтение — снимок строки
+из кэша, который обновляется не чаще раза в минуту (сдвиг окна) или после сделки;
+промах кэша читает строку без блокировки и пишет её, только если окно сдвинулось.
+
+Строка одна на весь рынок и блокируется каждой покупкой — как и текущие свечи
+1m/1h/1d, которые та же транзакция обновляет; новой точки сериализации она не добавляет.
+"""
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .candles import bucket_start
+
+WINDOW = timedelta(hours=24)
+CACHE_KEY = "p2p:stats:24h"
+ROW_ID = 1
+
+ZERO = Decimal("0")
+
+
+def _cache_ttl():
+    return getattr(settings, "P2P_STATS_CACHE_TTL", 60)
+
+
+def window_start(now=None):
+    """Первая минута окна: окно — последние 24 часа минутных свечей, включая текущую."""
+    return bucket_start(now or timezone.now(), "1m") - WINDOW + timedelta(minutes=1)
+
+
+def _aggregate(start, end=None):
+    from .models import Candle
+
+    qs = Candle.objects.filter(resolution="1m", bucket__gte=start)
+    if end is not None:
+        qs = qs.filter(bucket__lt=end)
+    return qs.aggregate(
+        volume_cf=Sum("volume_cf"), volume_ton=Sum("volume_ton"), volume_rub=Sum("volume_rub"),
+        trades=Sum("trades"), high=Max("high"), low=Min("low"),
+    )
+
+
+def _fill_from(stats, totals):
+    stats.volume_cf = totals["volume_cf"] or ZERO
+    stats.volume_ton = totals["volume_ton"] or ZERO
+    stats.volume_rub = totals["volume_rub"] or ZERO
+    stats.trades = totals["trades"] or 0
+    stats.high = totals["high"]
+    stats.low = totals["low"]
+
+
+def _locked(start):
+    """Строка статистики под блокировкой; при первом обращении — собранная по свечам окна."""
+    from .models import MarketStats
+
+    stats = MarketStats.objects.select_for_update().filter(pk=ROW_ID).first()
+    if stats is not None:
+        return stats
+    stats = MarketStats(pk=ROW_ID, window_start=start)
+    _fill_from(stats, _aggregate(start))
+    try:
+        with transaction.atomic():
+            stats.save(force_insert=True)
+    except IntegrityError:
+        stats = MarketStats.objects.select_for_update().get(pk=ROW_ID)
+    return stats
+
+
+def _advance(stats, start):
+    """Вычитает минутные свечи, вышедшие из окна до start."""
+    if stats.window_start >= start:
+        return
+    expired = _aggregate(stats.window_start, start)
+    stats.window_start = start
+    if not expired["trades"]:
+        return
+    stats.trades -= expired["trades"]
+    if stats.trades <= 0:
+        # Окно опустело: обнуляем, чтобы не копить погрешность вычитания
+        _fill_from(stats, {"volume_cf": None, "volume_ton": None, "volume_rub": None, "trades": 0, "high": None, "low": None})
+        return
+    stats.volume_cf -= expired["volume_cf"]
+    stats.volume_ton -= expired["volume_ton"]
+    stats.volume_rub -= expired["volume_rub"]
+    if expired["high"] >= stats.high or expired["low"] <= stats.low:
+        # Вышедшая свеча могла задавать экстремум — берём его по оставшимся свечам
+        rest = _aggregate(start)
+        stats.high, stats.low = rest["high"], rest["low"]
+
+
+def record_fills(fills):
+    """Добавляет сделки к окну. Вызывается в транзакции сделки до записи свечей."""
+    if not fills:
+        return
+    start = window_start(max(f.created_at for f in fills))
+    with transaction.atomic():
+        stats = _locked(start)
+        _advance(stats, start)
+        prices = [f.price_rub for f in fills]
+        stats.volume_cf += sum((f.cf_amount for f in fills), ZERO)
+        stats.volume_ton += sum((f.ton_amount for f in fills), ZERO)
+        stats.volume_rub += sum((f.price_rub * f.cf_amount for f in fills), ZERO)
+        stats.trades += len(fills)
+        stats.high = max(prices) if stats.high is None else max(stats.high, *prices)
+        stats.low = min(prices) if stats.low is None else min(stats.low, *prices)
+        stats.save()
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
+
+
+def rebuild(now=None):
+    """Пересобирает окно по минутным свечам (после rebuild_candles)."""
+    start = window_start(now)
+    with transaction.atomic():
+        stats = _locked(start)
+        stats.window_start = start
+        _fill_from(stats, _aggregate(start))
+        stats.save()
+    cache.delete(CACHE_KEY)
+    return stats
+
+
+def _snapshot(stats, now):
+    volume_cf = stats.volume_cf or ZERO
+    return {
+        "window_start": int(stats.window_start.timestamp()),
+        "as_of": int(now.timestamp()),
+        "trades": stats.trades,
+        "volume_cf": float(volume_cf),
+        "volume_ton": float(stats.volume_ton),
+        "volume_rub": round(float(stats.volume_rub), 2),
+        "vwap": round(float(stats.volume_rub / volume_cf), 4) if volume_cf > 0 else None,
+        "high": float(stats.high) if stats.high is not None else None,
+        "low": float(stats.low) if stats.low is not None else None,
+    }
+
+
+def get_stats():
+    """
+    Снимок статистики за 24 часа (dict, готовый для JSON). Строку читает без
+    блокировки; пишет, только если окно сдвинулось с прошлой записи.
+    """
+    from .models import MarketStats
+
+    now = timezone.now()
+    start = window_start(now)
+    snapshot = cache.get(CACHE_KEY)
+    if snapshot is not None and snapshot["window_start"] == int(start.timestamp()):
+        return snapshot
+    stats = MarketStats.objects.filter(pk=ROW_ID).first()
+    if stats is None or stats.window_start < start:
+        with transaction.atomic():
+            stats = _locked(start)
+            if stats.window_start < start:
+                _advance(stats, start)
+                stats.save()
+    snapshot = _snapshot(stats, now)
+    cache.set(CACHE_KEY, snapshot, _cache_ttl())
+    return snapshot
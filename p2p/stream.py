@@ -0,0 +1,40 @@
+# p2p/stream.py
+"""
+События рынка P2P для SSE-потока p2p:stream (канал cryptofarm.events "p2p").
+
+book  — изменение книги ордеров: {"op": "upsert", ...поля строки} или {"op": "remove", "id"};
+trade — сделка в формате ленты p2p.tape.
+Публикуются после коммита теми же местами, что обновляют книгу и ленту.
+"""
+
+from cryptofarm import events
+
+from . import tape
+
+CHANNEL = "p2p"
+
+
+def book_upsert(order):
+    if order.action != "sell":
+        return
+    if not order.is_active or order.cf_amount <= 0:
+        book_remove(order.id)
+        return
+    user = order.user
+    events.publish(CHANNEL, "book", {
+        "op": "upsert",
+        "id": order.id,
+        "user": (user.username or user.first_name or "")[:2],
+        "cf_amount": float(order.cf_amount),
+        "price_rub": float(order.price_rub),
+        "total_ton": round(float(order.total_ton()), 8),
+    })
+
+
+def book_remove(order_id):
+    events.publish(CHANNEL, "book", {"op": "remove", "id": order_id})
+
+
+def trades(fills):
+    for fill in fills:
+        events.publish(CHANNEL, "trade", tape.entry(fill))
@@ -0,0 +1,85 @@
+# p2p/tape.py
+"""
+Лента сделок P2P с курсором по id сделки (Fill).
+
+Последние TAPE_SIZE сделок лежат кольцевым буфером в кэше: после коммита
+покупки p2p.matching вызывает publish(), который перечитывает хвост Fill по
+первичному ключу и кладёт его в кэш на P2P_TAPE_CACHE_TTL секунд. Опрос ленты
+(trades_since) обычно обслуживается из буфера без запросов к БД; к БД идёт
+только клиент, отставший дальше начала буфера, или первый запрос после истечения
+буфера. С общим кэшем буфер обновляется сразу во всех процессах, с LocMemCache
+чужой процесс увидит новые сделки не позже чем через P2P_TAPE_CACHE_TTL.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+CACHE_KEY = "p2p:tape"
+
+
+def _size():
+    return getattr(settings, "P2P_TAPE_SIZE", 50)
+
+
+def _cache_ttl():
+    return getattr(settings, "P2P_TAPE_CACHE_TTL", 5)
+
+
+def entry(fill):
+    buyer = fill.buyer
+    return {
+        "id": fill.id,
+        # Как и раньше на странице — только первые символы имени покупателя
+        "buyer": (buyer.username or buyer.first_name or "")[:2],
+        "cf_amount": float(fill.cf_amount),
+        "price_rub": float(fill.price_rub),
+        "time": int(fill.created_at.timestamp()),
+    }
+
+
+def _query(since_id=None, limit=None):
+    from .models import Fill
+
+    qs = Fill.objects.select_related("buyer").only(
+        "id", "cf_amount", "price_rub", "created_at", "buyer__username", "buyer__first_name",
+    )
+    if since_id is None:
+        # Хвост ленты: последние limit сделок по возрастанию id
+        return [entry(f) for f in reversed(qs.order_by("-id")[:limit])]
+    return [entry(f) for f in qs.filter(id__gt=since_id).order_by("id")[:limit]]
+
+
+def publish():
+    """Перечитывает хвост ленты в буфер (после коммита сделки)."""
+    entries = _query(limit=_size())
+    cache.set(CACHE_KEY, entries, _cache_ttl())
+    return entries
+
+
+def _ring():
+    entries = cache.get(CACHE_KEY)
+    if entries is None:
+        entries = publish()
+    return entries
+
+
+def latest(limit=10):
+    """Последние limit сделок, новые в конце."""
+    return _ring()[-limit:] if limit else []
+
+
+def trades_since(since_id=None, limit=50):
+    """
+    Сделки с id > since_id по возрастанию (без since_id — последние limit).
+    Возвращает (сделки, курсор для следующего запроса).
+    """
+    ring = _ring()
+    if since_id is None:
+        trades = ring[-limit:]
+    elif not ring or since_id >= ring[0]["id"] - 1 or len(ring) < _size():
+        # Буфер покрывает всё, что новее курсора
+        trades = [e for e in ring if e["id"] > since_id][:limit]
+    else:
+        trades = _query(since_id, limit)
+    cursor = trades[-1]["id"] if trades else (since_id if since_id is not None else 0)
+    return trades, cursor
@@ -0,0 +1,86 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from p2p.models import Fill, Order
+from users.models import User
+
+
+class OrderAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, username="seller", first_name="S")
+        self.buyer = User.objects.create(telegram_id=2, first_name="Buyer", ton_balance=Decimal("10"))
+        start = timezone.now() - timedelta(hours=1)
+        self.orders = []
+        # Повторяющиеся цены: курсор должен различать ордера по id
+        for i, price in enumerate(["3", "1", "2", "2", "2", "1", "4"]):
+            order = Order.objects.create(
+                user=self.seller, action="sell", cf_amount=Decimal(10 + i),
+                price_rub=Decimal(price), ton_to_rub=Decimal("100"),
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=start + timedelta(minutes=i))
+            self.orders.append(order)
+        Order.objects.create(
+            user=self.buyer, action="sell", cf_amount=Decimal("5"), price_rub=Decimal("1"), ton_to_rub=Decimal("100"),
+        )
+        session = self.client.session
+        session["telegram_id"] = self.buyer.pk
+        session.save()
+
+    def walk(self, params):
+        url, ids, pages = reverse("p2p:order-list"), [], 0
+        while url:
+            response = self.client.get(url, params if pages == 0 else None)
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            ids += [row["id"] for row in data["results"]]
+            url, pages = data["next"], pages + 1
+        return ids, pages
+
+    def test_keyset_pages_by_price_and_created(self):
+        expected = sorted(self.orders, key=lambda o: (o.price_rub, o.id))
+        ids, pages = self.walk({"limit": 2, "exclude_own": "true"})
+        self.assertEqual(ids, [o.id for o in expected])
+        self.assertEqual(pages, 4)
+
+        ids, _pages = self.walk({"limit": 3, "ordering": "-created", "exclude_own": "true"})
+        self.assertEqual(ids, [o.id for o in reversed(self.orders)])
+
+    def test_filters_and_no_count(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("p2p:order-list"), {"min_price": "2", "max_price": "3", "min_amount": "13"})
+        rows = response.json()["results"]
+        self.assertEqual([r["id"] for r in rows], [self.orders[3].id, self.orders[4].id])
+        self.assertEqual(rows[0]["seller"], "se")
+        self.assertEqual(rows[0]["price_in_ton"], 0.02)
+        self.assertFalse([q for q in ctx.captured_queries if "COUNT(" in q["sql"]])
+        order_queries = [q["sql"] for q in ctx.captured_queries if '"p2p_order"' in q["sql"]]
+        self.assertEqual(len(order_queries), 1)
+        self.assertNotIn("fulfilled_by_id", order_queries[0])
+
+        self.assertEqual(self.client.get(reverse("p2p:order-list"), {"cursor": "bogus"}).status_code, 404)
+        self.assertEqual(self.client.get(reverse("p2p:order-list"), {"min_price": "x"}).status_code, 400)
+
+    def test_mine_buy_and_fills(self):
+        self.assertEqual(len(self.client.get(reverse("p2p:order-mine")).json()["results"]), 1)
+
+        url = reverse("p2p:order-buy", args=[self.orders[1].id])
+        first = self.client.post(url, {"amount": "4"}, headers={"Idempotency-Key": "a1"}).json()
+        again = self.client.post(url, {"amount": "4"}, headers={"Idempotency-Key": "a1"}).json()
+        self.assertEqual((first["cf_amount"], first["replayed"], again["replayed"]), ("4.00", False, True))
+        self.assertEqual(Fill.objects.count(), 1)
+
+        response = self.client.post(reverse("p2p:order-buy", args=[self.orders[2].id]))
+        self.assertEqual(response.json()["cf_amount"], "12.00")
+        self.assertFalse(Order.objects.get(pk=self.orders[2].id).is_active)
+
+        fills = self.client.get(reverse("p2p:fill-list")).json()["results"]
+        self.assertEqual([(f["order"], f["side"]) for f in fills], [(self.orders[2].id, "buy"), (self.orders[1].id, "buy")])
+        self.assertEqual(self.client.get(reverse("p2p:fill-list"), {"side": "sell"}).json()["results"], [])
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from p2p.candles import bucket_start, record_fills
+from p2p.matching import match_buy
+from p2p.models import Candle, Fill, Order
+from users.models import User
+
+
+class CandleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="S")
+        self.buyer = User.objects.create(telegram_id=2, first_name="B", ton_balance=Decimal("100"))
+        self.t0 = bucket_start(timezone.now() - timedelta(days=2), "1d") + timedelta(hours=10, minutes=5)
+
+    def sell(self, amount, price):
+        return Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal(amount),
+            price_rub=Decimal(price), ton_to_rub=Decimal("100"),
+        )
+
+    def fill(self, price, cf, at):
+        order = self.sell(cf, price)
+        return Fill.objects.create(
+            order=order, buyer=self.buyer, seller=self.seller, cf_amount=Decimal(cf),
+            price_rub=Decimal(price), ton_amount=Decimal(cf) * Decimal(price) / 100, created_at=at,
+        )
+
+    def test_match_updates_all_resolutions(self):
+        self.sell("10", "2")
+        self.sell("10", "3")
+        match_buy(self.buyer, Decimal("15"))
+        match_buy(self.buyer, Decimal("5"))
+        for resolution in ("1m", "1h", "1d"):
+            candle = Candle.objects.get(resolution=resolution)
+            self.assertEqual(
+                (candle.open, candle.high, candle.low, candle.close, candle.volume_cf, candle.trades),
+                (Decimal("2"), Decimal("3"), Decimal("2"), Decimal("3"), Decimal("20"), 3),
+            )
+            self.assertEqual(candle.volume_ton, Decimal("0.5"))
+
+    def test_incremental_matches_rebuild(self):
+        fills = [
+            self.fill("5", "1", self.t0),
+            self.fill("7", "2", self.t0 + timedelta(seconds=30)),
+            self.fill("4", "3", self.t0 + timedelta(minutes=3)),
+            self.fill("6", "1", self.t0 + timedelta(hours=1)),
+        ]
+        for fill in fills:
+            record_fills([fill])
+        fields = ("resolution", "bucket", "open", "high", "low", "close", "volume_cf", "volume_ton", "trades")
+        incremental = sorted(Candle.objects.values_list(*fields))
+        self.assertEqual(Candle.objects.filter(resolution="1m").count(), 3)
+        self.assertEqual(Candle.objects.filter(resolution="1h").count(), 2)
+
+        day = Candle.objects.get(resolution="1d")
+        self.assertEqual((day.open, day.high, day.low, day.close, day.trades), (5, 7, 4, 6, 4))
+
+        out = StringIO()
+        call_command("rebuild_candles", stdout=out)
+        self.assertIn("Candles rebuilt: 6", out.getvalue())
+        self.assertEqual(sorted(Candle.objects.values_list(*fields)), incremental)
+
+    def test_rebuild_includes_orders_filled_before_fills(self):
+        order = self.sell("10", "8")
+        Order.objects.filter(pk=order.pk).update(is_active=False, fulfilled_by=self.buyer, fulfilled_at=self.t0)
+        call_command("rebuild_candles", stdout=StringIO())
+        candle = Candle.objects.get(resolution="1h")
+        self.assertEqual((candle.close, candle.volume_cf, candle.volume_ton), (Decimal("8"), Decimal("10"), Decimal("0.8")))
+
+    def test_chart_endpoint(self):
+        for minutes, price in ((0, "5"), (60, "6"), (120, "7")):
+            record_fills([self.fill(price, "1", self.t0 + timedelta(minutes=minutes))])
+        url = reverse("p2p:price_history_json")
+        session = self.client.session
+        session["telegram_id"] = self.buyer.pk
+        session.save()
+
+        start = int(bucket_start(self.t0, "1h").timestamp())
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, {"resolution": "1h", "from": start, "to": start + 7200})
+        self.assertEqual(len([q for q in ctx.captured_queries if "p2p_candle" in q["sql"]]), 1)
+        history = response.json()["history"]
+        self.assertEqual([c["close"] for c in history], [5.0, 6.0])
+        self.assertEqual(history[0]["time"], start)
+        # Диапазон из закрытых свечей кэшируется надолго
+        self.assertEqual(response["Cache-Control"], "public, max-age=86400")
+        self.assertIn("Last-Modified", response)
+
+        response = self.client.get(url, {"resolution": "1h", "limit": 2})
+        self.assertEqual([c["close"] for c in response.json()["history"]], [6.0, 7.0])
+        max_age = int(response["Cache-Control"].rsplit("=", 1)[1])
+        self.assertLessEqual(max_age, 5)
+
+        # limit вне диапазона прижимается к 1..CHART_MAX_LIMIT
+        for limit in (-5, 0):
+            response = self.client.get(url, {"resolution": "1h", "limit": limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([c["close"] for c in response.json()["history"]], [7.0])
+
+        self.assertEqual(self.client.get(url, {"resolution": "5m"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"from": "x"}).status_code, 400)
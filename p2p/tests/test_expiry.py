@@ -0,0 +1,70 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from p2p.expiry import expire_due
+from p2p.models import Order
+from p2p.orderbook import book
+from users.models import User
+from users.supply import get_cf_supply
+
+
+class OrderExpiryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(telegram_id=1, first_name="A")
+        self.bob = User.objects.create(telegram_id=2, first_name="B")
+        self.past = timezone.now() - timedelta(minutes=1)
+
+    def sell(self, user, amount, expires_at=None):
+        order = Order.objects.create(
+            user=user, action="sell", cf_amount=Decimal(amount),
+            price_rub=Decimal("2"), ton_to_rub=Decimal("100"),
+        )
+        if expires_at is not None:
+            Order.objects.filter(pk=order.pk).update(expires_at=expires_at)
+        return order
+
+    def test_new_order_expires_after_order_expiry_days(self):
+        order = self.sell(self.alice, "1")
+        self.assertAlmostEqual(
+            (order.expires_at - order.created_at).total_seconds(), timedelta(days=3).total_seconds(), delta=5,
+        )
+
+    def test_due_orders_are_refunded_in_chunks(self):
+        for amount in ("10", "5", "2.5"):
+            self.sell(self.alice, amount, self.past)
+        self.sell(self.bob, "7", self.past)
+        fresh = self.sell(self.bob, "3")
+        book.rebuild()
+        supply = get_cf_supply()["grown"]
+
+        expired, refunded = expire_due(chunk_size=2)
+
+        self.assertEqual((expired, refunded), (4, Decimal("24.5")))
+        self.assertEqual(User.objects.get(pk=self.alice.pk).cf_balance, Decimal("17.5"))
+        self.assertEqual(User.objects.get(pk=self.bob.pk).cf_balance, Decimal("7"))
+        self.assertEqual(list(Order.objects.filter(is_active=True)), [fresh])
+        self.assertEqual(get_cf_supply()["grown"] - supply, Decimal("24.5"))
+        self.assertEqual(expire_due(), (0, Decimal("0")))
+
+    def test_refund_is_one_update_per_chunk(self):
+        for i in range(6):
+            self.sell(self.alice if i % 2 else self.bob, "1", self.past)
+        with CaptureQueriesContext(connection) as queries:
+            expire_due(chunk_size=10)
+        refunds = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "users_user"')]
+        self.assertEqual(len(refunds), 1)
+
+    def test_command(self):
+        self.sell(self.alice, "4", self.past)
+        out = StringIO()
+        call_command("expire_orders", stdout=out)
+        self.assertIn("Expired orders: 1, refunded CF: 4", out.getvalue())
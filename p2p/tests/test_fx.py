@@ -0,0 +1,60 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from p2p import fx
+from p2p.models import FxRate
+
+CALLS = []
+
+
+def stub_ton_usd():
+    CALLS.append(fx.TON_USD)
+    return Decimal("5.5")
+
+
+def failing_upstream():
+    CALLS.append("fail")
+    raise ConnectionError("upstream down")
+
+
+@override_settings(
+    P2P_FX_UPSTREAMS={"TON_USD": "p2p.tests.test_fx.stub_ton_usd", "USD_RUB": "p2p.tests.test_fx.failing_upstream"},
+    P2P_FX_BACKGROUND_REFRESH=False,
+)
+class FxServiceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        CALLS.clear()
+
+    def test_refresh_is_single_flight_and_keeps_last_known_good(self):
+        self.assertEqual(fx.get_ton_to_usd(), 0)
+        self.assertIsNone(fx.get_quote(fx.TON_USD).age)
+
+        self.assertTrue(fx.refresh(fx.TON_USD))
+        self.assertFalse(fx.refresh(fx.TON_USD))  # курс свежий
+        self.assertEqual(fx.get_ton_to_usd(), 5.5)
+        self.assertLess(fx.get_quote(fx.TON_USD).age, 5)
+
+        # Пока аренда не истекла, второй обновляющий во внешний API не идёт
+        FxRate.objects.filter(pair=fx.TON_USD).update(lease_until=timezone.now() + timedelta(seconds=30))
+        self.assertFalse(fx.refresh(fx.TON_USD, force=True))
+        self.assertEqual(CALLS, [fx.TON_USD])
+
+        FxRate.objects.create(pair=fx.USD_RUB, value=Decimal("90"), fetched_at=timezone.now() - timedelta(hours=1))
+        self.assertFalse(fx.refresh(fx.USD_RUB))
+        self.assertFalse(fx.refresh(fx.USD_RUB))  # после сбоя — пауза до конца аренды
+        self.assertEqual(CALLS.count("fail"), 1)
+        cache.clear()
+        self.assertEqual(fx.get_usd_to_rub(), 90.0)
+        self.assertEqual(fx.get_ton_to_rub(), 495.0)
+
+    @override_settings(P2P_FX_BACKGROUND_REFRESH=True)
+    def test_stale_read_triggers_background_refresh(self):
+        with mock.patch.object(fx, "refresh_in_background") as background:
+            self.assertEqual(fx.get_usd_to_rub(), 0)
+        background.assert_called_once_with(fx.USD_RUB)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from p2p.market import get_market_state, get_today_cf_price, is_market_open
+from p2p.models import P2PSettings, PriceHistory
+
+
+class MarketStateCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        PriceHistory.objects.create(date=timezone.localdate() - timedelta(days=1), price=Decimal("4"))
+
+    def test_price_is_created_once_and_served_from_cache(self):
+        self.assertEqual(get_today_cf_price(), 5.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_market_state(), {"price": 5.0, "is_open": True})
+        self.assertEqual(PriceHistory.objects.filter(date=timezone.localdate()).count(), 1)
+
+    def test_flag_flip_invalidates(self):
+        self.assertTrue(is_market_open())
+        with self.captureOnCommitCallbacks(execute=True):
+            P2PSettings.objects.create(is_market_open=False)
+        self.assertFalse(is_market_open())
+
+    def test_closed_market_keeps_previous_price(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            P2PSettings.objects.create(is_market_open=False)
+        self.assertEqual(get_today_cf_price(), 4.0)
+        self.assertFalse(PriceHistory.objects.filter(date=timezone.localdate()).exists())
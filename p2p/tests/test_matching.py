@@ -0,0 +1,112 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from p2p.matching import MatchError, match_buy
+from p2p.models import Fill, Order
+from users.models import User
+from users.supply import CF_CIRCULATING, reconcile
+
+
+class MatchingEngineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller1 = User.objects.create(telegram_id=1, first_name="S1")
+        self.seller2 = User.objects.create(telegram_id=2, first_name="S2")
+        self.buyer = User.objects.create(telegram_id=3, first_name="B", ton_balance=Decimal("10"))
+        # 100 ₽ за TON: 2 ₽/FL = 0.02 TON/FL
+        self.cheap = self.sell(self.seller1, "30", "2")
+        self.mid = self.sell(self.seller2, "50", "3")
+        self.dear = self.sell(self.seller1, "100", "5")
+
+    def sell(self, user, amount, price):
+        return Order.objects.create(
+            user=user, action="sell", cf_amount=Decimal(amount),
+            price_rub=Decimal(price), ton_to_rub=Decimal("100"),
+        )
+
+    def login(self, user):
+        session = self.client.session
+        session["telegram_id"] = user.pk
+        session.save()
+
+    def test_walks_best_asks_with_partial_fill(self):
+        result = match_buy(self.buyer, Decimal("60"))
+        self.assertEqual(result["cf_amount"], Decimal("60"))
+        # 30 * 0.02 + 30 * 0.03
+        self.assertEqual(result["ton_amount"], Decimal("1.5"))
+
+        self.cheap.refresh_from_db()
+        self.mid.refresh_from_db()
+        self.assertFalse(self.cheap.is_active)
+        self.assertEqual(self.cheap.fulfilled_by, self.buyer)
+        self.assertTrue(self.mid.is_active)
+        self.assertEqual(self.mid.cf_amount, Decimal("20"))
+        self.assertEqual(
+            list(Fill.objects.order_by("id").values_list("order_id", "cf_amount")),
+            [(self.cheap.id, Decimal("30")), (self.mid.id, Decimal("30"))],
+        )
+
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.buyer.cf_balance, self.buyer.ton_balance), (Decimal("60"), Decimal("8.5")))
+        self.assertEqual(User.objects.get(pk=1).ton_balance, Decimal("0.6"))
+        self.assertEqual(User.objects.get(pk=2).ton_balance, Decimal("0.9"))
+
+    def test_limit_price_and_budget(self):
+        result = match_buy(self.buyer, Decimal("1000"), limit_price=Decimal("3"))
+        self.assertEqual(result["cf_amount"], Decimal("80"))
+        self.assertTrue(Order.objects.get(pk=self.dear.pk).is_active)
+
+        poor = User.objects.create(telegram_id=4, first_name="P", ton_balance=Decimal("0.5"))
+        self.assertEqual(match_buy(poor, Decimal("1000"))["cf_amount"], Decimal("10"))
+        with self.assertRaises(MatchError):
+            match_buy(poor, Decimal("1"))
+
+    def test_buy_endpoints(self):
+        self.login(self.buyer)
+        response = self.client.post(reverse("p2p:buy_order"), {"order_id": self.cheap.id})
+        self.assertTrue(response.json()["success"])
+        self.assertFalse(Order.objects.get(pk=self.cheap.pk).is_active)
+
+        response = self.client.post(reverse("p2p:buy_market"), {"cf_amount": "60", "limit_price": "5"})
+        data = response.json()
+        self.assertTrue(data["success"])
+        self.assertEqual((data["cf_amount"], data["fills"]), (60.0, 2))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+    def test_fills_keep_original_order_size(self):
+        match_buy(self.buyer, Decimal("60"))
+
+        cheap = Order.objects.get(pk=self.cheap.pk)
+        mid = Order.objects.get(pk=self.mid.pk)
+        self.assertEqual((cheap.cf_amount, cheap.filled_cf, cheap.original_cf_amount), (0, 30, 30))
+        self.assertEqual((mid.cf_amount, mid.filled_cf, mid.original_cf_amount), (20, 30, 50))
+        self.assertIn("30.00CF", str(cheap))
+
+        self.login(self.seller1)
+        mine = {row["id"]: row for row in self.client.get(reverse("p2p:order-mine")).json()["results"]}
+        self.assertEqual(
+            (mine[cheap.id]["cf_amount"], mine[cheap.id]["filled_cf"], mine[cheap.id]["original_cf_amount"]),
+            ("0.00", "30.00", "30.00"),
+        )
+
+    def test_non_finite_amounts_are_rejected(self):
+        self.login(self.buyer)
+        for payload in ({"cf_amount": "NaN"}, {"cf_amount": "Infinity"}, {"cf_amount": "-5"},
+                        {"cf_amount": "10", "limit_price": "NaN"}, {"cf_amount": "10", "limit_price": "-Infinity"}):
+            response = self.client.post(reverse("p2p:buy_market"), payload)
+            self.assertEqual(response.status_code, 200, payload)
+            self.assertFalse(response.json()["success"], payload)
+        for amount in ("NaN", "sNaN", "Infinity"):
+            response = self.client.post(reverse("p2p:sell_order"), {"cf_amount": amount})
+            self.assertFalse(response.json()["success"], amount)
+        for amount in (Decimal("NaN"), Decimal("Infinity")):
+            with self.assertRaises(MatchError):
+                match_buy(self.buyer, amount)
+        with self.assertRaises(MatchError):
+            match_buy(self.buyer, Decimal("10"), limit_price=Decimal("NaN"))
+
+        self.assertFalse(Fill.objects.exists())
+        self.assertEqual(Order.objects.filter(user=self.buyer).count(), 0)
@@ -0,0 +1,107 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from p2p.models import Order
+from p2p.orderbook import OrderBook, book
+from users.models import User
+
+
+class OrderBookTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="Seller", username="seller")
+
+    def make_order(self, amount, price, **kwargs):
+        return Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal(amount),
+            price_rub=Decimal(price), ton_to_rub=Decimal("300"), **kwargs
+        )
+
+    def test_rebuild_sorts_filters_and_pages(self):
+        cheap_small = self.make_order("5", "2")
+        cheap_big = self.make_order("50", "2")
+        pricey = self.make_order("20", "3")
+        self.make_order("10", "1", is_active=False)
+        Order.objects.create(
+            user=self.seller, action="buy", cf_amount=1, price_rub=1, ton_to_rub=300,
+        )
+
+        orderbook = OrderBook()
+        orderbook.rebuild()
+        # Цена, затем время создания
+        self.assertEqual([o.id for o in orderbook.top(10)], [cheap_small.id, cheap_big.id, pricey.id])
+        self.assertEqual(
+            [o.id for o in orderbook.top(10, sort="amount_desc", min_amount=Decimal("10"))],
+            [cheap_big.id, pricey.id],
+        )
+        self.assertEqual([o.id for o in orderbook.top(10, min_amount=Decimal("10"))], [cheap_big.id, pricey.id])
+
+        page, has_more = orderbook.page(offset=1, limit=1)
+        self.assertEqual(([o.id for o in page], has_more), ([cheap_big.id], True))
+
+    def test_buy_ajax_reads_from_book(self):
+        order = self.make_order("5", "2")
+        session = self.client.session
+        session["telegram_id"] = self.seller.pk
+        session.save()
+
+        book.rebuild()
+        with self.assertNumQueries(0):
+            orders, _ = book.page()
+        self.assertEqual([o.id for o in orders], [order.id])
+        response = self.client.get(reverse("p2p:buy_ajax"))
+        self.assertContains(response, f'data-order-id="{order.id}"')
+
+
+class OrderBookSignalsTest(TransactionTestCase):
+    """Книга обновляется сигналами после коммита."""
+
+    def setUp(self):
+        cache.clear()
+        book.rebuild()
+        self.seller = User.objects.create(telegram_id=1, first_name="Seller")
+
+    def test_create_fill_and_delete(self):
+        order = Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal("10"),
+            price_rub=Decimal("2"), ton_to_rub=Decimal("300"),
+        )
+        self.assertEqual([o.id for o in book.top(5)], [order.id])
+
+        order.cf_amount = Decimal("4")
+        order.save(update_fields=["cf_amount"])
+        self.assertEqual(book.top(5)[0].cf_amount, Decimal("4"))
+
+        order.is_active = False
+        order.save(update_fields=["is_active"])
+        self.assertEqual(book.top(5), [])
+
+        other = Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal("1"),
+            price_rub=Decimal("1"), ton_to_rub=Decimal("300"),
+        )
+        other.delete()
+        self.assertEqual(book.top(5), [])
+
+    def test_foreign_change_forces_rebuild(self):
+        order = Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal("10"),
+            price_rub=Decimal("2"), ton_to_rub=Decimal("300"),
+        )
+        bump = book._bump_version
+
+        def racing_bump():
+            # Другой процесс изменил ордер и увеличил версию прямо перед нами
+            Order.objects.filter(pk=order.pk).update(cf_amount=Decimal("7"))
+            bump()
+            return bump()
+
+        # Локальное изменение не должно принять чужую версию как свою
+        with mock.patch.object(book, "_bump_version", racing_bump):
+            book.remove(-1)
+        self.assertNotEqual(book.version, book._shared_version())
+        self.assertEqual(book.top(5)[0].cf_amount, Decimal("7"))
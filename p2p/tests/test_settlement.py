@@ -0,0 +1,146 @@
+import threading
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from p2p.management.commands.bench_p2p import STUB_UPSTREAMS
+from p2p.matching import MatchError, match_buy
+from p2p.models import Fill, Order, Settlement
+from users.models import User
+
+
+def sell(user, amount, price="2"):
+    # 100 ₽ за TON: 2 ₽/FL = 0.02 TON/FL
+    return Order.objects.create(
+        user=user, action="sell", cf_amount=Decimal(amount),
+        price_rub=Decimal(price), ton_to_rub=Decimal("100"),
+    )
+
+
+class IdempotentSettlementTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="S")
+        self.buyer = User.objects.create(telegram_id=2, first_name="B", ton_balance=Decimal("1"))
+        self.order = sell(self.seller, "100")
+
+    def test_retry_with_same_key_replays_result(self):
+        first = match_buy(self.buyer, Decimal("10"), idempotency_key="k1")
+        again = match_buy(self.buyer, Decimal("10"), idempotency_key="k1")
+        self.assertFalse(first["replayed"])
+        self.assertTrue(again["replayed"])
+        self.assertEqual((again["cf_amount"], again["ton_amount"]), (Decimal("10"), Decimal("0.2")))
+        self.assertEqual([f.id for f in again["fills"]], [f.id for f in first["fills"]])
+        self.assertEqual(Fill.objects.count(), 1)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).cf_amount, Decimal("90"))
+
+        # Другой ключ — новая покупка
+        match_buy(self.buyer, Decimal("10"), idempotency_key="k2")
+        self.assertEqual(Fill.objects.count(), 2)
+        self.assertEqual(Settlement.objects.filter(buyer=self.buyer).count(), 2)
+
+    def test_fill_or_kill(self):
+        with self.assertRaisesMessage(MatchError, "Нужно 2.00000 TON"):
+            match_buy(self.buyer, self.order.cf_amount, order_ids=[self.order.id], fill_or_kill=True)
+        self.assertFalse(Fill.objects.exists())
+        self.assertEqual(Order.objects.get(pk=self.order.pk).cf_amount, Decimal("100"))
+
+    def test_buy_order_endpoint_replays(self):
+        small = sell(self.seller, "5")
+        session = self.client.session
+        session["telegram_id"] = self.buyer.pk
+        session.save()
+        for _attempt in range(2):
+            response = self.client.post(
+                reverse("p2p:buy_order"), {"order_id": small.id}, headers={"Idempotency-Key": "retry-1"},
+            )
+            self.assertTrue(response.json()["success"])
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.buyer.cf_balance, self.buyer.ton_balance), (Decimal("5"), Decimal("0.9")))
+        small.refresh_from_db()
+        self.assertEqual((small.is_active, small.fulfilled_by_id), (False, self.buyer.pk))
+
+
+class ConcurrentSettlementTest(TransactionTestCase):
+    THREADS = 12
+
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="S")
+        self.buyers = [
+            User.objects.create(telegram_id=100 + i, first_name=f"B{i}", ton_balance=Decimal("1"))
+            for i in range(self.THREADS)
+        ]
+        self.order = sell(self.seller, "50")
+
+    def hammer(self, work):
+        errors = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def run(i):
+            try:
+                barrier.wait()
+                work(i)
+            except MatchError:
+                pass
+            except Exception as e:  # noqa: BLE001 — любая другая ошибка валит тест
+                errors.append(e)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_many_buyers_one_order(self):
+        # Каждый хочет 7 FL из 50: исполнятся 7 покупок и одна частичная на 1 FL
+        self.hammer(lambda i: match_buy(User.objects.get(pk=self.buyers[i].pk), Decimal("7"), order_ids=[self.order.id]))
+
+        self.order.refresh_from_db()
+        fills = list(Fill.objects.all())
+        sold = sum((f.cf_amount for f in fills), Decimal("0"))
+        paid = sum((f.ton_amount for f in fills), Decimal("0"))
+        self.assertEqual((sold, self.order.cf_amount, self.order.is_active), (Decimal("50"), Decimal("0"), False))
+
+        buyers = User.objects.filter(pk__in=[b.pk for b in self.buyers])
+        self.assertEqual(sum((b.cf_balance for b in buyers), Decimal("0")), sold)
+        self.assertEqual(sum((Decimal("1") - b.ton_balance for b in buyers), Decimal("0")), paid)
+        self.assertEqual(User.objects.get(pk=self.seller.pk).ton_balance, paid)
+        self.assertTrue(all(b.ton_balance >= 0 for b in buyers))
+
+    def test_retries_with_one_key(self):
+        buyer = self.buyers[0]
+        self.hammer(lambda i: match_buy(User.objects.get(pk=buyer.pk), Decimal("7"), idempotency_key="same"))
+
+        self.assertEqual(Fill.objects.count(), 1)
+        buyer.refresh_from_db()
+        self.assertEqual((buyer.cf_balance, buyer.ton_balance), (Decimal("7"), Decimal("0.86")))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).cf_amount, Decimal("43"))
+
+    @override_settings(P2P_FX_UPSTREAMS=STUB_UPSTREAMS, P2P_FX_BACKGROUND_REFRESH=False)
+    def test_concurrent_sells_keep_escrow(self):
+        # 12 продаж по 5 FL при балансе 30: списание не теряется, проходят ровно 6
+        User.objects.filter(pk=self.seller.pk).update(cf_balance=Decimal("30"))
+        session = self.client.session
+        session["telegram_id"] = self.seller.pk
+        session.save()
+        results = []
+
+        def work(i):
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+            results.append(client.post(reverse("p2p:sell_order"), {"cf_amount": "5"}).json()["success"])
+
+        self.hammer(work)
+        self.assertEqual(results.count(True), 6)
+        self.assertEqual(User.objects.get(pk=self.seller.pk).cf_balance, Decimal("0"))
+        escrow = sum(o.cf_amount for o in Order.objects.filter(user=self.seller).exclude(pk=self.order.pk))
+        self.assertEqual(escrow, Decimal("30"))
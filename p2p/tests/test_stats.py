@@ -0,0 +1,115 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from p2p import candles, stats
+from p2p.matching import match_buy
+from p2p.models import Fill, MarketStats, Order
+from users.models import User
+
+
+class MarketStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="S")
+        self.buyer = User.objects.create(telegram_id=2, first_name="B", ton_balance=Decimal("100"))
+        self.t0 = candles.bucket_start(timezone.now() - timedelta(days=3), "1m")
+
+    def sell(self, amount, price):
+        return Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal(amount),
+            price_rub=Decimal(price), ton_to_rub=Decimal("100"),
+        )
+
+    def fill(self, price, cf, at):
+        """Сделка в прошлом — записывается так же, как в p2p.settlement."""
+        fill = Fill.objects.create(
+            order=self.sell(cf, price), buyer=self.buyer, seller=self.seller, cf_amount=Decimal(cf),
+            price_rub=Decimal(price), ton_amount=Decimal(cf) * Decimal(price) / 100, created_at=at,
+        )
+        stats.record_fills([fill])
+        candles.record_fills([fill])
+        return fill
+
+    def stats_at(self, now):
+        with mock.patch("p2p.stats.timezone.now", return_value=now):
+            return stats.get_stats()
+
+    def test_match_updates_stats(self):
+        self.sell("10", "2")
+        self.sell("10", "4")
+        match_buy(self.buyer, Decimal("15"))
+        data = stats.get_stats()
+        self.assertEqual(data["trades"], 2)
+        self.assertEqual(data["volume_cf"], 15.0)
+        self.assertEqual(data["volume_rub"], 40.0)
+        self.assertAlmostEqual(data["vwap"], 40 / 15, places=4)
+        self.assertEqual((data["low"], data["high"]), (2.0, 4.0))
+
+    def test_expired_minutes_are_evicted(self):
+        self.fill("9", "1", self.t0)
+        self.fill("5", "2", self.t0 + timedelta(hours=2))
+        self.fill("6", "2", self.t0 + timedelta(hours=3))
+
+        data = self.stats_at(self.t0 + timedelta(hours=23, minutes=59))
+        self.assertEqual((data["trades"], data["high"]), (3, 9.0))
+
+        data = self.stats_at(self.t0 + timedelta(hours=24, seconds=1))
+        self.assertEqual(data["trades"], 2)
+        self.assertEqual(data["volume_cf"], 4.0)
+        self.assertEqual(data["volume_rub"], 22.0)
+        # Максимум задавала вышедшая сделка — пересчитан по оставшимся свечам
+        self.assertEqual((data["low"], data["high"]), (5.0, 6.0))
+
+        data = self.stats_at(self.t0 + timedelta(days=2))
+        self.assertEqual((data["trades"], data["volume_cf"], data["vwap"], data["high"]), (0, 0.0, None, None))
+
+    def test_fill_advances_window(self):
+        self.fill("9", "1", self.t0)
+        self.fill("5", "2", self.t0 + timedelta(hours=25))
+        row = MarketStats.objects.get()
+        self.assertEqual((row.trades, row.volume_cf, row.high, row.low), (1, Decimal("2"), Decimal("5"), Decimal("5")))
+
+    def test_rebuild_matches_incremental(self):
+        for minutes, price in ((0, "5"), (90, "7"), (600, "4"), (1500, "6")):
+            self.fill(price, "1", self.t0 + timedelta(minutes=minutes))
+        now = self.t0 + timedelta(hours=26)
+        incremental = self.stats_at(now)
+        with mock.patch("p2p.stats.timezone.now", return_value=now):
+            stats.rebuild()
+        self.assertEqual(self.stats_at(now), incremental)
+
+    def test_reads_are_cached(self):
+        self.sell("10", "2")
+        match_buy(self.buyer, Decimal("1"))
+        stats.get_stats()
+        with self.assertNumQueries(0):
+            stats.get_stats()
+
+    def test_cache_miss_in_same_window_is_one_read(self):
+        self.sell("10", "2")
+        match_buy(self.buyer, Decimal("1"))
+        stats.get_stats()
+        cache.delete(stats.CACHE_KEY)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(stats.get_stats()["trades"], 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertTrue(ctx.captured_queries[0]["sql"].startswith("SELECT"))
+
+    def test_stats_json(self):
+        self.sell("10", "3")
+        match_buy(self.buyer, Decimal("2"))
+        session = self.client.session
+        session["telegram_id"] = self.buyer.pk
+        session.save()
+        response = self.client.get(reverse("p2p:stats_json"))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["trades"], data["volume_cf"], data["vwap"]), (1, 2.0, 3.0))
@@ -0,0 +1,150 @@
+import asyncio
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cryptofarm import events
+from p2p import stream
+from p2p.matching import match_buy
+from p2p.models import Order
+from users.models import User
+
+
+def parse(chunks):
+    """SSE-сообщения -> [(event, data)] без служебных."""
+    result = []
+    for message in "".join(chunks).split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            result.append((fields["event"], json.loads(fields["data"])))
+    return result
+
+
+async def collect(channel, since_id, count):
+    chunks = []
+    async for chunk in events.stream(channel, since_id, max_events=count):
+        chunks.append(chunk)
+    return chunks
+
+
+class EventChannelTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        events.cache().clear()
+
+    def test_resume_from_last_event_id(self):
+        for n in range(3):
+            events.publish("test", "tick", {"n": n})
+        chunks = asyncio.run(collect("test", 1, 2))
+        self.assertEqual(parse(chunks), [("tick", {"n": 1}), ("tick", {"n": 2})])
+        self.assertIn("id: 3\n", chunks[-1])
+
+    def test_wakes_on_publish(self):
+        async def scenario():
+            task = asyncio.ensure_future(collect("test", None, 1))
+            await asyncio.sleep(0.05)
+            events.publish("test", "tick", {"n": 7})
+            return await asyncio.wait_for(task, 0.5)
+
+        # Интервал опроса больше таймаута: событие доходит только через пробуждение
+        with override_settings(EVENTS_POLL_INTERVAL=5):
+            self.assertEqual(parse(asyncio.run(scenario())), [("tick", {"n": 7})])
+
+    @override_settings(EVENTS_BACKLOG=2)
+    def test_reset_when_too_far_behind_or_expired(self):
+        for n in range(4):
+            events.publish("test", "tick", {"n": n})
+        self.assertEqual(events.read_since("test", 0), ([], 4, True))
+
+        events.cache().delete(events.EVENT_KEY.format("test", 3))
+        with mock.patch("cryptofarm.events.time.time", return_value=events.time.time() + 10):
+            found, cursor, reset = events.read_since("test", 2)
+        self.assertEqual(([e["data"] for e in found], cursor, reset), ([{"n": 3}], 4, True))
+
+    def test_waits_for_event_being_written(self):
+        events.publish("test", "tick", {"n": 0})
+        events._next_id("test")  # id выдан, событие ещё не записано
+        self.assertEqual(events.read_since("test", 0)[1:], (1, False))
+
+    def test_heartbeat(self):
+        async def first_chunks():
+            gen = events.stream("test", None)
+            chunks = [await gen.__anext__(), await gen.__anext__()]
+            await gen.aclose()
+            return chunks
+
+        with override_settings(EVENTS_HEARTBEAT=0):
+            self.assertEqual(asyncio.run(first_chunks())[1], ": ping\n\n")
+
+    def test_events_do_not_evict_other_keys(self):
+        cache.set("p2p:orderbook:version", 7, None)
+        for n in range(500):
+            events.publish(f"rps:game:{n}", "game", {"n": n})
+        self.assertEqual(cache.get("p2p:orderbook:version"), 7)
+
+    def test_backlog_is_bounded_by_cache_size(self):
+        self.assertEqual(events._backlog(), 1000)
+        with override_settings(EVENTS_BACKLOG=10**6):
+            self.assertEqual(events._backlog(), events.cache()._max_entries - 1)
+
+    def test_channel_counter_expires(self):
+        events.publish("rps:game:1", "game", {})
+        events.publish("rps:game:1", "game", {})
+        later = events.time.time() + events._seq_ttl() + 1
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            self.assertEqual(events.last_id("rps:game:1"), 0)
+
+
+class MarketStreamTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        events.cache().clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="Seller")
+        self.buyer = User.objects.create(telegram_id=2, username="buyer", ton_balance=Decimal("100"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(
+                user=self.seller, action="sell", cf_amount=Decimal("10"),
+                price_rub=Decimal("2"), ton_to_rub=Decimal("100"),
+            )
+        self.session = SessionStore()
+        self.session["telegram_id"] = self.buyer.pk
+        self.session.create()
+
+    def test_book_and_trade_events(self):
+        start = events.last_id(stream.CHANNEL)
+        with self.captureOnCommitCallbacks(execute=True):
+            match_buy(self.buyer, Decimal("4"))
+        with self.captureOnCommitCallbacks(execute=True):
+            match_buy(self.buyer, Decimal("6"))
+
+        got = parse(asyncio.run(collect(stream.CHANNEL, start, 4)))
+        self.assertEqual([(kind, data.get("op")) for kind, data in got], [
+            ("book", "upsert"), ("trade", None), ("book", "remove"), ("trade", None),
+        ])
+        self.assertEqual(got[0][1]["cf_amount"], 6.0)
+        self.assertEqual(got[1][1]["cf_amount"], 4.0)
+        self.assertEqual(got[1][1]["buyer"], "bu")
+
+    def login(self, client):
+        client.cookies[settings.SESSION_COOKIE_NAME] = self.session.session_key
+
+    def test_endpoint_under_wsgi(self):
+        # Под WSGI поток не отдаётся: клиент остаётся на опросе
+        self.login(self.client)
+        self.assertEqual(self.client.get(reverse("p2p:stream")).status_code, 204)
+
+    async def test_endpoint(self):
+        self.login(self.async_client)
+        response = await self.async_client.get(reverse("p2p:stream"), headers={"Last-Event-ID": "0"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = response.streaming_content
+        self.assertEqual(await content.__anext__(), b"retry: 3000\nid: 0\n\n")
+        # С курсором 0 клиент получает уже опубликованное изменение книги
+        self.assertIn(b"event: book", await content.__anext__())
+        await content.aclose()
@@ -0,0 +1,82 @@
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from p2p import tape
+from p2p.matching import match_buy
+from p2p.models import Fill, Order
+from users.models import User
+
+
+@override_settings(P2P_TAPE_SIZE=5)
+class TradeTapeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create(telegram_id=1, first_name="S")
+        self.buyer = User.objects.create(telegram_id=2, username="buyer", ton_balance=Decimal("100"))
+        Order.objects.create(
+            user=self.seller, action="sell", cf_amount=Decimal("1000"),
+            price_rub=Decimal("2"), ton_to_rub=Decimal("100"),
+        )
+
+    def buy(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            match_buy(self.buyer, Decimal(amount))
+        return Fill.objects.latest("id")
+
+    def test_cursor_returns_only_new_trades_from_buffer(self):
+        first = self.buy("1")
+        second = self.buy("2")
+        third = self.buy("3")
+
+        with self.assertNumQueries(0):
+            trades, cursor = tape.trades_since(first.id)
+        self.assertEqual([t["id"] for t in trades], [second.id, third.id])
+        self.assertEqual(cursor, third.id)
+        self.assertEqual(trades[0]["buyer"], "bu")
+        self.assertEqual(trades[0]["cf_amount"], 2.0)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(tape.trades_since(cursor), ([], cursor))
+
+    def test_client_behind_buffer_reads_db(self):
+        fills = [self.buy("1") for _ in range(7)]
+        self.assertEqual(len(cache.get(tape.CACHE_KEY)), 5)
+        trades, cursor = tape.trades_since(fills[0].id, limit=3)
+        self.assertEqual([t["id"] for t in trades], [f.id for f in fills[1:4]])
+        self.assertEqual(cursor, fills[3].id)
+
+    def test_buffer_expires_and_rereads_db(self):
+        first = self.buy("1")
+        tape.trades_since()
+        # Сделку провёл другой процесс — его publish() в наш LocMemCache не попал
+        second = Fill.objects.create(
+            order=first.order, buyer=self.buyer, seller=self.seller, cf_amount=Decimal("2"),
+            price_rub=Decimal("2"), ton_amount=Decimal("0.04"), created_at=first.created_at,
+        )
+        self.assertEqual([t["id"] for t in tape.trades_since()[0]], [first.id])
+        later = time.time() + tape._cache_ttl() + 1
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            self.assertEqual([t["id"] for t in tape.trades_since()[0]], [first.id, second.id])
+
+    def test_endpoint(self):
+        first = self.buy("1")
+        second = self.buy("4")
+        session = self.client.session
+        session["telegram_id"] = self.buyer.pk
+        session.save()
+
+        response = self.client.get(reverse("p2p:trades_json"), {"since": first.id})
+        self.assertEqual(response.json(), {
+            "trades": [tape.entry(second)], "cursor": second.id,
+        })
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("p2p:trades_json"), {"since": second.id})
+        self.assertFalse([q for q in ctx.captured_queries if "p2p_fill" in q["sql"]])
+        self.assertEqual(self.client.get(reverse("p2p:trades_json"), {"since": "x"}).status_code, 400)
@@ -1,4 +1,4 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
 
 app_name = "p2p"
@@ -8,5 +8,10 @@ urlpatterns = [
     path('buy-ajax/', views.buy_ajax, name='buy_ajax'),
     path('sell-order/', views.create_order_sell, name='sell_order'),
 path('buy_order/', views.buy_order, name='buy_order'),
+    path('buy-market/', views.buy_market, name='buy_market'),
 path('price-history-json/', views.price_history_json, name='price_history_json'),
+    path('trades/', views.trades_json, name='trades_json'),
+    path('stats/', views.stats_json, name='stats_json'),
+    path('stream/', views.market_stream, name='stream'),
+    path('api/', include('p2p.api.urls')),
 ]
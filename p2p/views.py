@@ -1,77 +1,48 @@
 import datetime
 import hashlib
-import random
 
 from _decimal import Decimal, InvalidOperation
-from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Sum
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.utils import timezone
-from django.views.decorators.http import require_POST
-
-from trees.models import BurnedToken
-from users.models import User
-from .models import Order, PriceHistory, P2PSettings
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_POST
+
+from cryptofarm import events
+from users.balances import debit
+from users.supply import get_cf_supply
+from .candles import RESOLUTIONS, bucket_start, get_candles
+from .models import Order, PriceHistory
+from .fx import TON_USD, USD_RUB, get_quote, get_ton_to_rub, get_ton_to_usd, get_usd_to_rub
+from .market import get_today_cf_price, is_market_open
+from .matching import MatchError, match_buy
+from .orderbook import book
+from .settlement import replay
+from . import stats, stream, tape
 from django.template.loader import render_to_string
-import requests
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy
 
 
-def get_today_cf_price():
-    today = timezone.now().date()
-
-    # если цена уже есть за сегодня — просто вернём
-    today_obj = PriceHistory.objects.filter(date=today).first()
-    if today_obj:
-        return float(today_obj.price)
-
-    prev = PriceHistory.objects.filter(date__lt=today).order_by('-date').first()
-    prev_price = float(prev.price) if prev else 1.0
-
-    # проверяем рынок
-    settings = P2PSettings.objects.first()
-    market_open = settings.is_market_open if settings else True
+# Свечей на графике по умолчанию и максимум за запрос
+CHART_LIMIT = 72
+CHART_MAX_LIMIT = 1000
+# Сделок в ленте на странице рынка
+RECENT_TRADES = 10
 
-    # если рынок закрыт — НЕ повышаем и НЕ создаём запись за сегодня
-    if not market_open:
-        return prev_price
-
-    # рынок открыт — создаём цену +1
-    new_price = prev_price + 1
-    PriceHistory.objects.create(date=today, price=new_price)
-    return float(new_price)
-
-def get_ton_to_rub():
-    try:
-        # 1. Курс TON к USD
-        r1 = requests.get('https://min-api.cryptocompare.com/data/price?fsym=TON&tsyms=USD', timeout=5)
-        r1.raise_for_status()
-        ton_usd = float(r1.json()['USD'])
-
-        # 2. Курс USD к RUB (ЦБ РФ)
-        r2 = requests.get('https://www.cbr-xml-daily.ru/daily_json.js', timeout=5)
-        r2.raise_for_status()
-        usd_rub = float(r2.json()['Valute']['USD']['Value'])
-
-        ton_rub = ton_usd * usd_rub
-        # Если вдруг что-то пошло не так — возвращаем 0
-        return round(ton_rub, 2) if ton_rub > 0 else 0
-    except Exception as e:
-        print("Ошибка получения TON к рублю (через CryptoCompare+CBR):", e)
-        return 0  # Не возвращай 85.0, лучше 0 чтобы на фронте показать ошибку
 
 def p2p_market(request):
-    cf_created = 25000000
-    burned = BurnedToken.objects.aggregate(total=Sum('amount'))['total'] or 0
-    cf_grown = User.objects.aggregate(total=Sum('cf_balance'))['total'] or 0
-    cf_left = cf_created - cf_grown - burned
+    supply = get_cf_supply()
+    cf_created = supply["total_created"]
+    cf_grown = supply["grown"]
+    cf_left = supply["left"]
 
     usd_to_rub = get_usd_to_rub()      # ✅ для фронта (конвертер ₽/$)
     ton_to_usd = get_ton_to_usd()      # ✅ опционально (показ TON в $)
+    fx_ages = [q.age for q in (get_quote(TON_USD), get_quote(USD_RUB))]
     ton_to_rub = round(ton_to_usd * usd_to_rub, 2) if (ton_to_usd and usd_to_rub) else 0
 
     cf_price_rub = get_today_cf_price()
@@ -79,14 +50,10 @@ def p2p_market(request):
 
     ton_per_cf = round(cf_price_rub / ton_to_rub, 8) if ton_to_rub else None
 
-    settings = P2PSettings.objects.first()
-    market_open = settings.is_market_open if settings else True
+    market_open = is_market_open()
 
-    recent_trades = (
-        Order.objects.filter(action='sell', is_active=False, fulfilled_by__isnull=False)
-        .select_related('user', 'fulfilled_by')
-        .order_by('-fulfilled_at')[:10]
-    )
+    # Лента сделок из буфера в кэше; дальше страница дочитывает новые через trades_json
+    recent_trades = tape.latest(RECENT_TRADES)[::-1]
 
     return render(request, "p2p/market.html", {
         "cf_created": cf_created,
@@ -100,17 +67,19 @@ def p2p_market(request):
         "ton_to_rub": ton_to_rub,
         "ton_to_usd": ton_to_usd,       # ✅ если захочешь показывать TON в $
         "usd_to_rub": usd_to_rub,       # ✅ главное для кнопки ₽/$
+        "fx_age": None if None in fx_ages else int(max(fx_ages)),  # сек с последнего обновления курса
 
         "error_no_ton": ton_to_rub == 0,
         "recent_trades": recent_trades,
+        "trades_cursor": recent_trades[0]["id"] if recent_trades else 0,
+        "stats_24h": stats.get_stats(),
         "market_open": market_open,
     })
 
 
 @require_POST
 def create_order_sell(request):
-    settings = P2PSettings.objects.first()
-    if settings and not settings.is_market_open:
+    if not is_market_open():
         return JsonResponse({"success": False, "msg": _("P2P рынок временно закрыт.")})
 
     try:
@@ -118,21 +87,20 @@ def create_order_sell(request):
     except InvalidOperation:
         return JsonResponse({"success": False, "msg": _("Некорректное число CF.")})
 
-    if cf_amount <= 0:
+    # NaN/Infinity парсятся в Decimal, но сравнение NaN <= 0 само бросает InvalidOperation
+    if not cf_amount.is_finite() or cf_amount <= 0:
         return JsonResponse({"success": False, "msg": _("Введите положительное число CF.")})
 
     user = request.user
-    user.refresh_from_db()
-    if user.cf_balance < cf_amount:
-        return JsonResponse({"success": False, "msg": _("Недостаточно CF на балансе.")})
-
     ton_to_rub = get_ton_to_rub()
     cf_price_rub = get_today_cf_price()
     ton_per_cf = round(float(cf_price_rub) / float(ton_to_rub), 8) if ton_to_rub else 0
 
     with transaction.atomic():
-        user.cf_balance -= cf_amount
-        user.save(update_fields=['cf_balance'])
+        # Условное UPDATE: параллельные продажи одного пользователя не теряют списание;
+        # CF уходят в эскроу ордера — из эмиссии
+        if not debit(user, cf=cf_amount):
+            return JsonResponse({"success": False, "msg": _("Недостаточно CF на балансе.")})
         order = Order.objects.create(
             user=user,
             action="sell",
@@ -153,32 +121,35 @@ def create_order_sell(request):
 
 from django.db.models import Q
 
+BUY_ORDERS_PAGE_SIZE = 50
+
+
 def buy_ajax(request):
     sort = request.GET.get('sort', 'price_asc')
-    min_amount = request.GET.get('min_amount')
-    orders = Order.objects.filter(action='sell', is_active=True)
 
     # Фильтр по количеству (если передан)
-    if min_amount:
-        try:
-            min_amount = float(min_amount)
-            orders = orders.filter(cf_amount__gte=min_amount)
-        except ValueError:
-            pass
-
-    # Сортировка
-    if sort == 'price_asc':
-        orders = orders.order_by('price_rub')
-    elif sort == 'price_desc':
-        orders = orders.order_by('-price_rub')
-    elif sort == 'amount_asc':
-        orders = orders.order_by('cf_amount')
-    elif sort == 'amount_desc':
-        orders = orders.order_by('-cf_amount')
-    else:
-        orders = orders.order_by('price_rub')
+    try:
+        min_amount = Decimal(request.GET.get('min_amount') or '0')
+    except InvalidOperation:
+        min_amount = Decimal('0')
+    if not min_amount.is_finite():
+        min_amount = Decimal('0')
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        offset = 0
+
+    # Сортировка, фильтр и страница — из книги ордеров в памяти, без запроса к БД
+    orders, has_more = book.page(
+        sort=sort, min_amount=min_amount, offset=offset, limit=BUY_ORDERS_PAGE_SIZE,
+    )
 
-    return render(request, 'p2p/_buy_orders.html', {'orders': orders})
+    return render(request, 'p2p/_buy_orders.html', {
+        'orders': orders,
+        'has_more': has_more,
+        'next_offset': offset + len(orders),
+        'is_first_page': offset == 0,
+    })
 
 
 
@@ -196,262 +167,168 @@ def ensure_today_price():
     )
     return obj.price
 
-def generate_fake_candles(n=90, base=15.0, seed=777):
-    random.seed(seed)
-    candles = []
-    prev_close = base
-    date = datetime.datetime.now() - datetime.timedelta(days=n)
-    for i in range(n):
-        open_ = prev_close
-        close = open_ + random.uniform(-1, 1)
-        high = max(open_, close) + random.uniform(0.1, 0.7)
-        low = min(open_, close) - random.uniform(0.1, 0.7)
-        high = max(high, open_, close)
-        low = min(low, open_, close)
-        candles.append({
-            "time": int(date.timestamp()),
-            "open": round(open_, 2),
-            "high": round(high, 2),
-            "low": round(low, 2),
-            "close": round(close, 2)
-        })
-        prev_close = close
-        date += datetime.timedelta(days=1)
-    return candles
-
-
-def _demo_candles_same_for_all(n=72, base=2.0, interval_minutes=60,red_ratio=0.30):
-    """
-    Свечи как на скрине: большие фитили/размах, есть красные, но общий тренд вверх.
-    Гарантия: close[i] >= close[i-1] всегда.
-    """
-    now = timezone.now().replace(second=0, microsecond=0)
-    day_anchor = now.date().toordinal()
-    rng = random.Random(777 + day_anchor)
-
-    step = datetime.timedelta(minutes=interval_minutes)
-    start = now - step * n
-
-    candles = []
-    prev_close = float(base)
-
-    # Под 5₽ даёт диапазон примерно 4.8–5.2 при 72 свечах
-    body_vol = max(0.02, float(base) * 0.010)   # размер тела
-    wick_vol = max(0.03, float(base) * 0.030)   # размер фитилей (больше тела)
-
-    for i in range(n):
-        t = start + step * i
-
-        # Плавный тренд вверх "ступеньками" (как на картинке)
-        block = (i // 8) % 6
-        drift_map = {0: 0.20, 1: 0.12, 2: 0.06, 3: 0.18, 4: 0.10, 5: 0.14}
-        drift = drift_map.get(block, 0.12) * body_vol
-
-        # Гэп вверх — ключ для красных свечей без падения тренда
-        gap = rng.uniform(0.2, 1.2) * body_vol + drift
-
-        open_ = prev_close + gap
-
-        make_red = (rng.random() < red_ratio)
-
-        if make_red:
-            # красная: close < open, но close >= prev_close
-            red_body = rng.uniform(0.3, 1.2) * body_vol
-            close = max(prev_close, open_ - red_body)
-            # чтобы точно была красной
-            if close >= open_:
-                close = max(prev_close, open_ - max(0.01, body_vol * 0.6))
-        else:
-            # зелёная: close >= open
-            green_body = rng.uniform(0.3, 1.4) * body_vol
-            close = open_ + green_body
-
-        # Большие фитили как на скрине
-        wick_up = rng.uniform(0.2, 2.2) * wick_vol
-        wick_dn = rng.uniform(0.2, 2.2) * wick_vol
-        if rng.random() < 0.12:  # 12% свечей со шпилькой
-            if rng.random() < 0.5:
-                wick_up *= rng.uniform(2.5, 6.0)  # сильная шпилька вверх
-            else:
-                wick_dn *= rng.uniform(2.5, 6.0)
-
-        high = max(open_, close) + wick_up
-        low = max(0.01, min(open_, close) - wick_dn)
-
-        # ГЛАВНОЕ: тренд не падает
-        close = max(close, prev_close)
-
-        candles.append({
-            "time": int(t.timestamp()),
-            "open": round(open_, 2),
-            "high": round(high, 2),
-            "low": round(low, 2),
-            "close": round(close, 2),
-        })
-
-        prev_close = close
-
-    # Сдвиг так, чтобы последняя close == base (и при этом не ломаем UP-тренд)
-    if candles:
-        last_close = float(candles[-1]["close"])
-        delta = float(base) - last_close
-
-        prev = None
-        for c in candles:
-            o = max(0.01, float(c["open"]) + delta)
-            cl = max(0.01, float(c["close"]) + delta)
-            hi = float(c["high"]) + delta
-            lo = float(c["low"]) + delta
+def _timestamp_arg(request, name):
+    """Unix-время из GET-параметра (None, если не задан)."""
+    value = request.GET.get(name)
+    if not value:
+        return None
+    return datetime.datetime.fromtimestamp(int(value), tz=datetime.timezone.utc)
 
-            if prev is not None:
-                cl = max(cl, prev)
 
-            hi = max(hi, o, cl)
-            lo = min(lo, o, cl)
-            lo = max(0.01, lo)
+@require_GET
+async def market_stream(request):
+    """
+    SSE-поток рынка: события book (изменения книги) и trade (сделки), см. p2p.stream.
+    При reset клиент перечитывает buy_ajax/trades_json; без потока они работают как раньше.
+    """
+    return events.sse_response(request, stream.CHANNEL)
 
-            c["open"] = round(o, 2)
-            c["close"] = round(cl, 2)
-            c["high"] = round(hi, 2)
-            c["low"] = round(lo, 2)
 
-            prev = cl
+@require_GET
+def trades_json(request):
+    """Лента сделок: ?since=<id> — только сделки новее курсора; в ответе новый курсор."""
+    try:
+        since = request.GET.get("since")
+        since = int(since) if since else None
+        limit = max(1, min(int(request.GET.get("limit", 50)), 200))
+    except ValueError:
+        return JsonResponse({"error": "bad cursor"}, status=400)
+    trades, cursor = tape.trades_since(since, limit)
+    response = JsonResponse({"trades": trades, "cursor": cursor})
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@require_GET
+def stats_json(request):
+    """Статистика рынка за 24 часа: объём, оборот, VWAP, high/low, число сделок."""
+    response = JsonResponse(stats.get_stats())
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@require_GET
+def price_history_json(request):
+    """
+    Свечи по реальным сделкам: ?resolution=1m|1h|1d&from=<unix>&to=<unix>&limit=N.
+    Без from — последние limit свечей. Диапазон из одних закрытых свечей не меняется
+    и кэшируется надолго; с открытой свечой — до её закрытия, но не дольше P2P_CHART_MAX_AGE.
+    """
+    resolution = request.GET.get("resolution", "1h")
+    if resolution not in RESOLUTIONS:
+        return JsonResponse({"error": "unknown resolution"}, status=400)
+    try:
+        start = _timestamp_arg(request, "from")
+        end = _timestamp_arg(request, "to")
+        limit = max(1, min(int(request.GET.get("limit", CHART_LIMIT)), CHART_MAX_LIMIT))
+    except (ValueError, OverflowError, OSError):
+        return JsonResponse({"error": "bad range"}, status=400)
+
+    candles = get_candles(resolution, start, end, limit)
+    response = JsonResponse({
+        "resolution": resolution,
+        "history": [{
+            "time": int(c.bucket.timestamp()),
+            "open": float(c.open),
+            "high": float(c.high),
+            "low": float(c.low),
+            "close": float(c.close),
+            "volume": float(c.volume_cf),
+        } for c in candles],
+    })
 
-        candles[-1]["close"] = round(float(base), 2)
+    now = timezone.now()
+    open_bucket = bucket_start(now, resolution)
+    if end is not None and end <= open_bucket:
+        response["Cache-Control"] = "public, max-age=86400"
+        last_closed = end
+    else:
+        closes_in = (open_bucket + RESOLUTIONS[resolution] - now).total_seconds()
+        max_age = max(0, min(int(closes_in), getattr(settings, "P2P_CHART_MAX_AGE", 5)))
+        response["Cache-Control"] = f"public, max-age={max_age}"
+        last_closed = open_bucket
+    response["Last-Modified"] = http_date(last_closed.timestamp())
+    return response
 
-    return candles
+def _idempotency_key(request):
+    """Ключ повтора запроса: заголовок Idempotency-Key или поле idempotency_key."""
+    return request.headers.get("Idempotency-Key") or request.POST.get("idempotency_key") or None
 
 
-def price_history_json(request):
-    cf_price_rub = get_today_cf_price()  # как и было — реальная “текущая” цена
-    candles = _demo_candles_same_for_all(
-        n=72,
-        base=float(cf_price_rub),
-        interval_minutes=60
-    )
-    return JsonResponse({"history": candles})
-
 @require_POST
 def buy_order(request):
-    settings = P2PSettings.objects.first()
-    if settings and not settings.is_market_open:
+    if not is_market_open():
         return JsonResponse({"success": False, "msg": _("P2P рынок временно закрыт.")})
     try:
         order_id = int(request.POST.get('order_id', '0'))
     except (ValueError, TypeError):
         return JsonResponse({"success": False, "msg": _("Некорректный номер ордера.")})
 
-    try:
-        order = Order.objects.select_for_update().get(id=order_id, is_active=True, action='sell')
-    except Order.DoesNotExist:
-        return JsonResponse({"success": False, "msg": _("Ордер не найден или уже исполнен.")})
-
     buyer = request.user
-    seller = order.user
-    if buyer == seller:
-        return JsonResponse({"success": False, "msg": _("Нельзя купить свой ордер.")})
-
-    # Рассчитываем сколько TON требуется
-    price_in_ton = order.price_in_ton  # уже float с округлением
-    total_ton = Decimal(price_in_ton) * order.cf_amount
-    total_ton_display = f"{total_ton:.5f}"
-
-    buyer.refresh_from_db()
-    seller.refresh_from_db()
-
-    if buyer.ton_balance < total_ton:
-        return JsonResponse({
-            "success": False,
-            "msg": _("Недостаточно TON. Нужно %(need)s TON, у вас %(have)s.") % {
-                "need": total_ton_display,
-                "have": buyer.ton_balance,
-            }
-        })
-    with transaction.atomic():
-        # Списываем TON с покупателя
-        buyer.ton_balance -= total_ton
-        # Добавляем CF покупателю
-        buyer.cf_balance += order.cf_amount
-        buyer.save(update_fields=['ton_balance', 'cf_balance'])
-
-        # Продавцу зачисляем TON
-        seller.ton_balance += total_ton
-        seller.save(update_fields=['ton_balance'])
-
-        # Завершаем ордер
-        order.is_active = False
-        order.fulfilled_by = buyer
-        order.fulfilled_at = timezone.now()
-        order.save(update_fields=['is_active', 'fulfilled_by', 'fulfilled_at'])
+    key = _idempotency_key(request)
+    # Повтор уже проведённой покупки: ордер к этому времени исполнен, отдаём прежний ответ
+    result = replay(buyer, key)
+    if result is None:
+        order = Order.objects.filter(id=order_id, is_active=True, action='sell').first()
+        if order is None:
+            return JsonResponse({"success": False, "msg": _("Ордер не найден или уже исполнен.")})
+        if order.user_id == buyer.pk:
+            return JsonResponse({"success": False, "msg": _("Нельзя купить свой ордер.")})
+
+        # Весь остаток ордера или ничего; баланс проверяется под блокировкой в p2p.settlement
+        try:
+            result = match_buy(buyer, order.cf_amount, order_ids=[order.id], fill_or_kill=True, idempotency_key=key)
+        except MatchError as e:
+            return JsonResponse({"success": False, "msg": str(e)})
 
     return JsonResponse({
         "success": True,
         "msg": _("Вы успешно купили %(amount)s FL за %(ton)s TON.") % {
-            "amount": order.cf_amount,
-            "ton": f"{total_ton:.3f}",
+            "amount": result["cf_amount"],
+            "ton": f"{result['ton_amount']:.3f}",
         }
     })
 
-def p2p_status(request):
-    settings = P2PSettings.objects.first()
-    return JsonResponse({"open": settings.is_market_open if settings else True})
 
-def get_usd_to_rub():
+@require_POST
+def buy_market(request):
     """
-    USD -> RUB (₽ за 1$), кэш 5 минут
+    Покупка количества FL по лучшим ценам с частичным исполнением ордеров.
+    limit_price (₽/FL) — необязательный предел цены.
     """
-    cache_key = "fx_usd_rub"
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
-
+    if not is_market_open():
+        return JsonResponse({"success": False, "msg": _("P2P рынок временно закрыт.")})
     try:
-        r = requests.get('https://www.cbr-xml-daily.ru/daily_json.js', timeout=5)
-        r.raise_for_status()
-        usd_rub = float(r.json()['Valute']['USD']['Value'])
-
-        if usd_rub > 0:
-            usd_rub = round(usd_rub, 4)
-            cache.set(cache_key, usd_rub, 300)  # ⏱ 5 минут
-            return usd_rub
-    except Exception as e:
-        print("USD→RUB error:", e)
-
-    return 0
-
-
-def get_ton_to_usd():
-    """
-    TON -> USD, кэш 5 минут
-    """
-    cache_key = "fx_ton_usd"
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
+        cf_amount = Decimal(request.POST.get('cf_amount', '0'))
+        limit_price = request.POST.get('limit_price')
+        limit_price = Decimal(limit_price) if limit_price else None
+    except InvalidOperation:
+        return JsonResponse({"success": False, "msg": _("Некорректное число CF.")})
+    if not cf_amount.is_finite() or cf_amount <= 0:
+        return JsonResponse({"success": False, "msg": _("Введите положительное число FL.")})
+    if limit_price is not None and (not limit_price.is_finite() or limit_price <= 0):
+        return JsonResponse({"success": False, "msg": _("Некорректная цена.")})
 
     try:
-        r = requests.get(
-            'https://min-api.cryptocompare.com/data/price?fsym=TON&tsyms=USD',
-            timeout=5
+        result = match_buy(
+            request.user, cf_amount, limit_price=limit_price, idempotency_key=_idempotency_key(request),
         )
-        r.raise_for_status()
-        ton_usd = float(r.json().get('USD', 0))
+    except MatchError as e:
+        return JsonResponse({"success": False, "msg": str(e)})
 
-        if ton_usd > 0:
-            ton_usd = round(ton_usd, 6)
-            cache.set(cache_key, ton_usd, 300)  # ⏱ 5 минут
-            return ton_usd
-    except Exception as e:
-        print("TON→USD error:", e)
-
-    return 0
-
-
-def get_ton_to_rub():
-    ton_usd = get_ton_to_usd()
-    usd_rub = get_usd_to_rub()
-
-    if ton_usd and usd_rub:
-        return round(ton_usd * usd_rub, 2)
+    filled = result["cf_amount"]
+    return JsonResponse({
+        "success": True,
+        "msg": _("Вы успешно купили %(amount)s FL за %(ton)s TON.") % {
+            "amount": filled,
+            "ton": f"{result['ton_amount']:.3f}",
+        },
+        "cf_amount": float(filled),
+        "ton_amount": float(result["ton_amount"]),
+        "avg_price_rub": float(sum(f.price_rub * f.cf_amount for f in result["fills"]) / filled),
+        "fills": len(result["fills"]),
+        "partial": filled < cf_amount,
+    })
 
-    return 0
+def p2p_status(request):
+    return JsonResponse({"open": is_market_open()})
@@ -4,9 +4,10 @@ from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 
 from .models import Referral, ReferralBonus, Task, TaskCompletion
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum
 from decimal import Decimal
+from users.balances import credit
 from .utils import get_telegram_user
 
 
@@ -142,7 +143,7 @@ def check_task(request, task_id):
         if not is_user_in_channel(user.telegram_id, task.channel_username):
             return JsonResponse({'status': 'error', 'msg': 'Вы не подписаны на канал!'})
 
-    user.cf_balance += task.reward_fl
-    user.save(update_fields=['cf_balance'])
-    TaskCompletion.objects.create(user=user, task=task)
+    with transaction.atomic():
+        credit(user, cf=task.reward_fl)
+        TaskCompletion.objects.create(user=user, task=task)
     return JsonResponse({'status': 'success', 'reward': task.reward_fl, 'msg': f'Зачислено {task.reward_fl} FL!'})
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Tournament, TournamentParticipant, Game, GameQueue, BotPool, BotAdmin
+from .models import Tournament, TournamentParticipant, Game, BotPool, BotAdmin, PlayerStats
 
 
 @admin.register(Tournament)
@@ -23,10 +23,11 @@ class GameAdmin(admin.ModelAdmin):
     search_fields = ['player1__username', 'player2__username']
 
 
-@admin.register(GameQueue)
-class GameQueueAdmin(admin.ModelAdmin):
-    list_display = ['user', 'bet_amount', 'created_at', 'expires_at']
-    list_filter = ['created_at']
+@admin.register(PlayerStats)
+class PlayerStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'games', 'wins', 'draws', 'losses', 'cancelled', 'volume']
+    search_fields = ['user__username', 'user__first_name']
+    ordering = list(PlayerStats.RANKING)
 
 
 @admin.register(BotPool)
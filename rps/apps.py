@@ -6,3 +6,6 @@ class RpsConfig(AppConfig):
     name = 'rps'
     verbose_name = 'Камень-Ножницы-Бумага'
 
+    def ready(self):
+        from . import checks  # noqa: F401
+
@@ -0,0 +1,23 @@
+# rps/checks.py
+
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Кэши, хранящие состояние только внутри своего процесса
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_matchmaking_cache(app_configs, **kwargs):
+    """Очередь подбора (rps.matchmaking) живёт в кэше default — он должен быть общим."""
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            "Очередь подбора RPS хранится в кэше процесса: игроки разных процессов не найдут друг друга.",
+            hint="Задайте REDIS_URL (общий кэш default) или запускайте один процесс.",
+            id="rps.E001",
+        )]
+    return []
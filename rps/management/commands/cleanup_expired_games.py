@@ -4,7 +4,8 @@
 """
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from rps.models import Game
+from rps import stream
+from rps.models import Game, PlayerStats
 from django.db import transaction
 
 
@@ -38,6 +39,8 @@ class Command(BaseCommand):
                 # Отменяем игру
                 game.status = 'cancelled'
                 game.save()
+                PlayerStats.record(game)
+                stream.game_changed(game)
                 count += 1
         
         if count > 0:
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rps.models import PlayerStats
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает PlayerStats по завершённым и отменённым играм RPS"
+
+    def handle(self, *args, **options):
+        players = PlayerStats.rebuild()
+        self.stdout.write(f"Rebuilt RPS stats for {players} players")
@@ -0,0 +1,154 @@
+# rps/matchmaking.py
+"""
+Подбор соперника для PvP: FIFO-очередь на каждую ставку (VALID_BETS) в кэше.
+
+Очередь ставки — счётчики head/tail и билет на каждое место. Встать в очередь
+и снять первого ждущего — O(1) под короткой блокировкой ставки (cache.add).
+Билеты отменённых и переставших опрашивать игроков не удаляются из очереди:
+их отбрасывает тот, кто до них дошёл, поэтому каждый билет просматривается
+не больше одного раза.
+
+Пара составляется атомарно: под блокировкой первый ждущий снимается с очереди,
+и ему сразу выставляется метка MATCH_PENDING. Пока метка висит, его опрос
+отвечает «ищем» и не ставит его в очередь заново. Игру в БД создаёт второй
+игрок (rps.views), после чего id игры кладётся на место метки, и ждущий
+получает его следующим опросом. Пока пары нет, опрос к БД не обращается.
+Состояние — в кэше default, как у cryptofarm.events: при общем бэкенде (Redis,
+settings.REDIS_URL) очередь одна на все процессы. С LocMemCache у каждого процесса
+своя очередь и игроки разных процессов не встретятся — поэтому
+`manage.py check --deploy` требует общий кэш (rps.checks, rps.E001).
+"""
+
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+VALID_BETS = (1, 3, 5, 10)
+
+HEAD_KEY = "rps:mm:{}:head"
+TAIL_KEY = "rps:mm:{}:tail"
+TICKET_KEY = "rps:mm:{}:t:{}"
+LOCK_KEY = "rps:mm:{}:lock"
+WAITING_KEY = "rps:mm:user:{}"
+MATCH_KEY = "rps:mm:match:{}"
+
+MATCH_PENDING = "pending"
+
+LOCK_TTL = 2
+LOCK_WAIT = 1.0
+
+
+def _search_ttl():
+    """Сколько секунд ждущий остаётся в очереди без опроса."""
+    return getattr(settings, "RPS_SEARCH_TTL", 5)
+
+
+def _match_ttl():
+    """Сколько секунд хранится id найденной игры для ждущего."""
+    return getattr(settings, "RPS_MATCH_TTL", 60)
+
+
+def bucket(bet_amount):
+    """Ставка -> ключ очереди или None, если ставка не из VALID_BETS."""
+    if bet_amount in VALID_BETS:
+        return int(bet_amount)
+    return None
+
+
+class _BucketLock:
+    def __init__(self, bet):
+        self.key = LOCK_KEY.format(bet)
+        # Метка владельца: блокировку, истёкшую по LOCK_TTL и взятую другим, не снимаем
+        self.token = secrets.token_hex(8)
+        self.acquired = False
+
+    def __enter__(self):
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(self.key, self.token, LOCK_TTL):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        self.acquired = True
+        return True
+
+    def __exit__(self, *exc):
+        if self.acquired and cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+def waiting(user_id):
+    """{"bet", "ticket"} ждущего игрока или None."""
+    return cache.get(WAITING_KEY.format(user_id))
+
+
+def keep_alive(user_id):
+    """Продлевает ожидание (опрос клиента). False — игрок уже не в очереди."""
+    return cache.touch(WAITING_KEY.format(user_id), _search_ttl())
+
+
+def _pop(bet, user_id):
+    """Первый живой ждущий ставки bet (не user_id) или None. Вызывать под блокировкой."""
+    head_key, tail_key = HEAD_KEY.format(bet), TAIL_KEY.format(bet)
+    counters = cache.get_many([head_key, tail_key])
+    head, tail = counters.get(head_key, 0), counters.get(tail_key, 0)
+    opponent = None
+    while head < tail and opponent is None:
+        ticket_key = TICKET_KEY.format(bet, head)
+        candidate = cache.get(ticket_key)
+        cache.delete(ticket_key)
+        if candidate is not None and candidate != user_id:
+            entry = waiting(candidate)
+            # Билет действителен, пока игрок ждёт именно с ним (не отменил и не перевстал)
+            if entry == {"bet": bet, "ticket": head}:
+                cache.delete(WAITING_KEY.format(candidate))
+                cache.set(MATCH_KEY.format(candidate), MATCH_PENDING, _match_ttl())
+                opponent = candidate
+        head += 1
+    if head > counters.get(head_key, 0):
+        cache.set(head_key, head, None)
+    return opponent
+
+
+def join(user_id, bet, enqueue=True):
+    """
+    Ищет соперника со ставкой bet. Возвращает его user_id (ему выставлена метка
+    MATCH_PENDING) или None; в последнем случае при enqueue=True игрок встаёт в очередь.
+    """
+    with _BucketLock(bet) as locked:
+        if not locked:
+            # Очередь занята дольше LOCK_WAIT — клиент повторит опрос
+            return None
+        opponent = _pop(bet, user_id)
+        if opponent is None and enqueue:
+            tail_key = TAIL_KEY.format(bet)
+            ticket = cache.get(tail_key, 0)
+            cache.set(tail_key, ticket + 1, None)
+            cache.set(TICKET_KEY.format(bet, ticket), user_id, _match_ttl())
+            cache.set(WAITING_KEY.format(user_id), {"bet": bet, "ticket": ticket}, _search_ttl())
+        return opponent
+
+
+def cancel(user_id):
+    """Убирает игрока из очереди; его билет отбросит тот, кто до него дойдёт."""
+    cache.delete(WAITING_KEY.format(user_id))
+
+
+def matched(user_id, game_id):
+    """Игра для пары создана — отдаём её id ждущему."""
+    cache.set(MATCH_KEY.format(user_id), game_id, _match_ttl())
+
+
+def match_failed(user_id):
+    """Игру создать не удалось — ждущий при следующем опросе снова встанет в очередь."""
+    cache.delete(MATCH_KEY.format(user_id))
+
+
+def take_match(user_id):
+    """id найденной для ждущего игры, MATCH_PENDING (игра создаётся) или None."""
+    key = MATCH_KEY.format(user_id)
+    game_id = cache.get(key)
+    if game_id is not None and game_id != MATCH_PENDING:
+        cache.delete(key)
+    return game_id
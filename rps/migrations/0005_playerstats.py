@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-17 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rps', '0004_game_bot_name'),
+        ('users', '0007_balanceincrement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rps_stats', serialize=False, to='users.user')),
+                ('games', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('draws', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('volume', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+            ],
+            options={
+                'verbose_name': 'Статистика игрока',
+                'verbose_name_plural': 'Статистика игроков',
+                'indexes': [models.Index(fields=['-wins', '-games', 'user'], name='rps_stats_ranking_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.3 on 2026-10-17 08:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rps', '0005_playerstats'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='GameQueue',
+        ),
+    ]
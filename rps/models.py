@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, IntegrityError, transaction
 from django.utils import timezone
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, F, Q
 from decimal import Decimal
+from users.balances import credit
 from users.models import User
 
 
@@ -200,11 +201,9 @@ class Game(models.Model):
         if result == 'draw':
             # Ничья: возвращаем ставки обоим игрокам
             # (ставки уже были списаны при создании игры)
-            self.player1.cf_balance += self.player1_bet
-            self.player1.save(update_fields=['cf_balance'])
+            credit(self.player1, cf=self.player1_bet)
             if self.player2:
-                self.player2.cf_balance += self.player2_bet
-                self.player2.save(update_fields=['cf_balance'])
+                credit(self.player2, cf=self.player2_bet)
             elif self.is_bot_game:
                 # Для бота возвращаем баланс в пул при ничьей
                 from .models import BotPool
@@ -216,8 +215,7 @@ class Game(models.Model):
                 if result == 'player1_win':
                     # Игрок выиграл - получает весь банк (своя ставка + ставка бота)
                     self.winner = self.player1
-                    self.player1.cf_balance += self.game_bank
-                    self.player1.save(update_fields=['cf_balance'])
+                    credit(self.player1, cf=self.game_bank)
                     # Баланс бота уже был использован из пула при создании игры
                 else:
                     # Бот выиграл - возвращаем весь банк в пул (ставка игрока + ставка бота)
@@ -230,8 +228,7 @@ class Game(models.Model):
                 winner = self.player1 if result == 'player1_win' else self.player2
                 self.winner = winner
                 # Победитель получает: свои ставки + ставки проигравшего
-                winner.cf_balance += self.game_bank
-                winner.save(update_fields=['cf_balance'])
+                credit(winner, cf=self.game_bank)
                 # Проигравший уже потерял свою ставку при создании игры
         
         # Обновляем статистику турнира
@@ -261,28 +258,107 @@ class Game(models.Model):
                     participant2.add_points('draw')
         
         self.save()
+        PlayerStats.record(self)
         return result
 
 
-class GameQueue(models.Model):
-    """Очередь поиска игры"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='game_queues')
-    bet_amount = models.DecimalField(max_digits=15, decimal_places=2)
-    tournament = models.ForeignKey(Tournament, on_delete=models.SET_NULL, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
-    
+class PlayerStats(models.Model):
+    """
+    Итоги игрока по всем играм. Обновляются при завершении (Game.finish_game) и отмене
+    игры (PlayerStats.record), пересобираются командой rebuild_rps_stats.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rps_stats')
+    games = models.IntegerField(default=0)  # завершённые игры
+    wins = models.IntegerField(default=0)
+    draws = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    volume = models.DecimalField(max_digits=15, decimal_places=2, default=0)  # сумма своих ставок в завершённых играх
+
+    # Рейтинг: больше побед, затем больше игр
+    RANKING = ('-wins', '-games', 'user_id')
+
     class Meta:
-        verbose_name = 'Очередь игры'
-        verbose_name_plural = 'Очереди игр'
-        ordering = ['created_at']
-    
+        verbose_name = 'Статистика игрока'
+        verbose_name_plural = 'Статистика игроков'
+        indexes = [
+            models.Index(fields=['-wins', '-games', 'user'], name='rps_stats_ranking_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.user} - {self.bet_amount} CF"
-    
-    def is_expired(self):
-        """Проверяет, истекла ли очередь"""
-        return timezone.now() > self.expires_at
+        return f"{self.user}: {self.wins}/{self.games}"
+
+    @property
+    def win_rate(self):
+        return round(self.wins / self.games * 100, 1) if self.games else 0
+
+    @staticmethod
+    def outcomes(game):
+        """[(user_id, {поле: прирост})] для живых игроков игры."""
+        players = [(game.player1_id, game.player1_bet, 'player1_win', 'player2_win')]
+        if game.player2_id:
+            players.append((game.player2_id, game.player2_bet, 'player2_win', 'player1_win'))
+        rows = []
+        for user_id, bet, win, loss in players:
+            if game.status == 'cancelled':
+                delta = {'cancelled': 1}
+            elif game.result == win:
+                delta = {'games': 1, 'wins': 1, 'volume': bet}
+            elif game.result == loss:
+                delta = {'games': 1, 'losses': 1, 'volume': bet}
+            else:
+                delta = {'games': 1, 'draws': 1, 'volume': bet}
+            rows.append((user_id, delta))
+        return rows
+
+    @classmethod
+    def record(cls, game):
+        """Учитывает завершённую или отменённую игру: одно UPDATE через F() на игрока."""
+        if game.status not in ('finished', 'cancelled'):
+            return
+        for user_id, delta in cls.outcomes(game):
+            if cls.objects.filter(pk=user_id).update(**{field: F(field) + value for field, value in delta.items()}):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(user_id=user_id, **delta)
+            except IntegrityError:
+                # Строку успела создать параллельная игра
+                cls.objects.filter(pk=user_id).update(**{field: F(field) + value for field, value in delta.items()})
+
+    @classmethod
+    def top(cls, n=5):
+        return cls.objects.filter(games__gt=0).select_related('user').order_by(*cls.RANKING)[:n]
+
+    @classmethod
+    def rebuild(cls):
+        """Пересчитывает статистику по таблице игр. Возвращает число игроков."""
+        totals = {}
+        for side, win, loss in (('player1', 'player1_win', 'player2_win'), ('player2', 'player2_win', 'player1_win')):
+            finished = Q(status='finished')
+            rows = (
+                Game.objects.filter(**{f'{side}__isnull': False}, status__in=['finished', 'cancelled'])
+                .values(side)
+                .annotate(
+                    games=Count('id', filter=finished),
+                    wins=Count('id', filter=finished & Q(result=win)),
+                    losses=Count('id', filter=finished & Q(result=loss)),
+                    cancelled=Count('id', filter=Q(status='cancelled')),
+                    volume=Sum(f'{side}_bet', filter=finished),
+                )
+            )
+            for row in rows:
+                stats = totals.setdefault(row[side], cls(user_id=row[side]))
+                stats.games += row['games']
+                stats.wins += row['wins']
+                stats.losses += row['losses']
+                stats.draws += row['games'] - row['wins'] - row['losses']
+                stats.cancelled += row['cancelled']
+                stats.volume += row['volume'] or 0
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(totals.values(), batch_size=1000)
+        return len(totals)
 
 
 class BotPool(models.Model):
@@ -0,0 +1,30 @@
+# rps/stream.py
+"""
+События игры RPS для SSE-потока rps:api_game_stream (канал cryptofarm.events "rps:game:<id>").
+
+game — состояние игры изменилось (ход, результат, отмена):
+{"status", "player1_moved", "player2_moved", "result", "winner_id"}.
+Сами ходы до конца игры в событии не передаются: по событию клиент перечитывает
+api_game_status, который показывает каждому игроку только то, что ему можно видеть.
+"""
+
+from django.db import transaction
+
+from cryptofarm import events
+
+
+def channel(game_id):
+    return f"rps:game:{game_id}"
+
+
+def game_changed(game):
+    """Публикует текущее состояние игры после коммита."""
+    data = {
+        "status": game.status,
+        "player1_moved": bool(game.player1_move),
+        "player2_moved": bool(game.player2_move),
+        "result": game.result,
+        "winner_id": game.winner_id,
+    }
+    game_id = game.id
+    transaction.on_commit(lambda: events.publish(channel(game_id), "game", data))
@@ -0,0 +1,265 @@
+import asyncio
+import json
+from decimal import Decimal
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from cryptofarm import events
+from users.models import User
+from . import checks, matchmaking, stream
+from .models import Game, PlayerStats
+from .views import get_top_5_players
+
+
+class MatchmakingEngineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_pairs_within_bet(self):
+        self.assertIsNone(matchmaking.join(1, 5))
+        self.assertIsNone(matchmaking.join(2, 10))
+        self.assertEqual(matchmaking.join(3, 5), 1)
+        self.assertEqual(matchmaking.take_match(1), matchmaking.MATCH_PENDING)
+        self.assertIsNone(matchmaking.waiting(1))
+        self.assertEqual(matchmaking.join(4, 10), 2)
+        self.assertIsNone(matchmaking.join(5, 5))
+
+    def test_cancelled_and_requeued_tickets_are_skipped(self):
+        matchmaking.join(1, 3)
+        matchmaking.cancel(1)
+        self.assertIsNone(matchmaking.join(2, 3))
+        matchmaking.cancel(2)
+        matchmaking.join(3, 1)
+        matchmaking.cancel(3)
+        self.assertIsNone(matchmaking.join(3, 1))  # встал заново — действует только новый билет
+        self.assertEqual(matchmaking.join(4, 1), 3)
+        self.assertIsNone(matchmaking.join(5, 1))
+        self.assertIsNone(matchmaking.join(6, 3))
+
+    def test_handoff(self):
+        matchmaking.join(1, 1)
+        opponent = matchmaking.join(2, 1)
+        matchmaking.matched(opponent, 42)
+        self.assertEqual(matchmaking.take_match(1), 42)
+        self.assertIsNone(matchmaking.take_match(1))
+
+    def test_expired_lock_taken_by_another_is_kept(self):
+        lock = matchmaking._BucketLock(1)
+        with lock:
+            # Блокировка истекла по LOCK_TTL и её взял другой процесс
+            cache.set(lock.key, "other", matchmaking.LOCK_TTL)
+        self.assertEqual(cache.get(lock.key), "other")
+
+    def test_deploy_check_requires_shared_cache(self):
+        self.assertEqual([e.id for e in checks.check_matchmaking_cache(None)], ["rps.E001"])
+        redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://"}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_matchmaking_cache(None), [])
+
+
+class SearchGameTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("20"))
+        self.bob = User.objects.create(telegram_id=2, first_name="B", cf_balance=Decimal("20"))
+        self.poor = User.objects.create(telegram_id=3, first_name="P", cf_balance=Decimal("2"))
+
+    def client_for(self, user):
+        client = Client()
+        session = client.session
+        session["telegram_id"] = user.pk
+        session.save()
+        return client
+
+    def search(self, client, bet):
+        return client.post(
+            reverse("rps:api_search"), json.dumps({"bet_amount": bet}), content_type="application/json",
+        ).json()
+
+    def test_pair_and_handoff(self):
+        alice, bob = self.client_for(self.alice), self.client_for(self.bob)
+        self.assertTrue(self.search(alice, 5)["searching"])
+
+        # Опрос ждущего не обращается к таблицам игры
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.search(alice, 5)["searching"])
+        self.assertFalse([q for q in queries if "rps_" in q["sql"]])
+
+        found = self.search(bob, 5)
+        self.assertTrue(found["opponent_found"])
+        game = Game.objects.get(pk=found["game_id"])
+        self.assertEqual((game.player1, game.player2, game.game_bank), (self.bob, self.alice, Decimal("10")))
+        self.assertEqual(self.search(alice, 5), {"success": True, "game_id": game.id, "opponent_found": True})
+        self.assertEqual(User.objects.get(pk=self.alice.pk).cf_balance, Decimal("15"))
+        self.assertEqual(User.objects.get(pk=self.bob.pk).cf_balance, Decimal("15"))
+
+    def test_opponent_without_funds_is_dropped(self):
+        poor, alice = self.client_for(self.poor), self.client_for(self.alice)
+        self.assertTrue(self.search(poor, 1)["searching"])
+        User.objects.filter(pk=self.poor.pk).update(cf_balance=0)
+
+        self.assertTrue(self.search(alice, 1)["searching"])
+        self.assertFalse(Game.objects.exists())
+        self.assertEqual(User.objects.get(pk=self.alice.pk).cf_balance, Decimal("20"))
+        # Alice осталась без пары и встанет в очередь следующим опросом
+        self.assertTrue(self.search(alice, 1)["searching"])
+        self.assertEqual(matchmaking.waiting(self.alice.pk)["bet"], 1)
+
+    def test_invalid_bet(self):
+        self.assertEqual(self.search(self.client_for(self.alice), 2), {"error": "Invalid bet amount"})
+
+    def start_game(self, player1, player2, status="playing"):
+        return Game.objects.create(
+            player1=player1, player2=player2, bet_amount=Decimal("1"), player1_bet=Decimal("1"),
+            player2_bet=Decimal("1"), game_bank=Decimal("2"), status=status,
+        )
+
+    def test_player_in_game_is_not_queued(self):
+        game = self.start_game(self.alice, self.poor)
+
+        found = self.search(self.client_for(self.alice), 5)
+        self.assertEqual(found, {"success": True, "game_id": game.id, "opponent_found": True})
+        self.assertIsNone(matchmaking.waiting(self.alice.pk))
+        self.assertEqual(User.objects.get(pk=self.alice.pk).cf_balance, Decimal("20"))
+
+    def test_busy_opponent_is_not_paired(self):
+        alice, bob = self.client_for(self.alice), self.client_for(self.bob)
+        self.assertTrue(self.search(alice, 5)["searching"])
+        # Пока Alice ждала в очереди, она начала другую игру
+        game = self.start_game(self.poor, self.alice, status="betting")
+
+        self.assertTrue(self.search(bob, 5)["searching"])
+        self.assertEqual(Game.objects.count(), 1)
+        self.assertEqual(User.objects.get(pk=self.alice.pk).cf_balance, Decimal("20"))
+        self.assertEqual(User.objects.get(pk=self.bob.pk).cf_balance, Decimal("20"))
+        self.assertEqual(self.search(alice, 5)["game_id"], game.id)
+
+
+class GameStreamTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        events.cache().clear()
+        self.alice = User.objects.create(telegram_id=1, first_name="A")
+        self.bob = User.objects.create(telegram_id=2, first_name="B")
+        self.game = Game.objects.create(
+            player1=self.alice, player2=self.bob, bet_amount=Decimal("1"), player1_bet=Decimal("1"),
+            player2_bet=Decimal("1"), game_bank=Decimal("2"), status="betting",
+        )
+        self.channel = stream.channel(self.game.id)
+        self.session = SessionStore()
+        self.session["telegram_id"] = self.bob.pk
+        self.session.create()
+
+    def move(self, user, move):
+        client = Client()
+        session = client.session
+        session["telegram_id"] = user.pk
+        session.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.post(
+                reverse("rps:api_move"), json.dumps({"game_id": self.game.id, "move": move}),
+                content_type="application/json",
+            ).json()
+
+    def test_moves_and_result_are_published(self):
+        self.move(self.alice, "rock")
+        self.move(self.bob, "paper")
+        got, _cursor, reset = events.read_since(self.channel, 0)
+        self.assertFalse(reset)
+        self.assertEqual([e["data"]["status"] for e in got], ["betting", "finished"])
+        # Ход соперника до конца игры не раскрывается
+        self.assertEqual(got[0]["data"], {
+            "status": "betting", "player1_moved": True, "player2_moved": False, "result": None, "winner_id": None,
+        })
+        self.assertEqual((got[1]["data"]["result"], got[1]["data"]["winner_id"]), ("player2_win", self.bob.pk))
+
+    def test_timeout_cancel_is_published(self):
+        from .views import _resolve_timeout_cancel
+        with self.captureOnCommitCallbacks(execute=True):
+            _resolve_timeout_cancel(self.game)
+        got, _cursor, _reset = events.read_since(self.channel, 0)
+        self.assertEqual([e["data"]["status"] for e in got], ["cancelled"])
+
+    async def test_endpoint(self):
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = self.session.session_key
+        response = await self.async_client.get(reverse("rps:api_game_stream", args=[self.game.id]))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = response.streaming_content
+        self.assertEqual(await content.__anext__(), b"retry: 3000\nid: 0\n\n")
+        await asyncio.to_thread(events.publish, self.channel, "game", {"status": "finished"})
+        self.assertIn(b"event: game", await content.__anext__())
+        await content.aclose()
+
+    def test_endpoint_is_for_players_only(self):
+        outsider = User.objects.create(telegram_id=3, first_name="C")
+        session = self.client.session
+        session["telegram_id"] = outsider.pk
+        session.save()
+        self.assertEqual(self.client.get(reverse("rps:api_game_stream", args=[self.game.id])).status_code, 403)
+
+
+class PlayerStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(telegram_id=i, first_name=str(i)) for i in range(1, 5)]
+
+    def play(self, p1, p2, move1, move2, bet="1"):
+        game = Game.objects.create(
+            player1=p1, player2=p2, bet_amount=Decimal(bet), player1_bet=Decimal(bet),
+            player2_bet=Decimal(bet), game_bank=Decimal(bet) * 2, status="betting",
+            player1_move=move1, player2_move=move2,
+        )
+        game.finish_game()
+        return game
+
+    def stats(self, user):
+        s = PlayerStats.objects.get(user=user)
+        return s.games, s.wins, s.draws, s.losses, s.cancelled, s.volume
+
+    def test_finish_and_cancel_are_counted(self):
+        a, b, c, _ = self.users
+        self.play(a, b, "rock", "scissors", bet="5")
+        self.play(a, b, "rock", "rock")
+        self.play(c, a, "paper", "rock")
+        from .views import _resolve_timeout_cancel
+        _resolve_timeout_cancel(Game.objects.create(
+            player1=b, player2=c, bet_amount=Decimal("1"), player1_bet=Decimal("1"),
+            player2_bet=Decimal("1"), game_bank=Decimal("2"), status="betting",
+        ))
+        self.assertEqual(self.stats(a), (3, 1, 1, 1, 0, Decimal("7")))
+        self.assertEqual(self.stats(b), (2, 0, 1, 1, 1, Decimal("6")))
+        self.assertEqual(self.stats(c), (1, 1, 0, 0, 1, Decimal("1")))
+
+    def test_rebuild_matches_incremental(self):
+        a, b, c, d = self.users
+        self.play(a, b, "rock", "scissors")
+        self.play(b, c, "paper", "paper", bet="3")
+        self.play(d, a, "scissors", "paper")
+        self.play(a, c, "paper", "rock", bet="10")
+        incremental = {s.pk: (s.games, s.wins, s.draws, s.losses, s.cancelled, s.volume) for s in PlayerStats.objects.all()}
+        out = StringIO()
+        call_command("rebuild_rps_stats", stdout=out)
+        self.assertIn("Rebuilt RPS stats for 4 players", out.getvalue())
+        rebuilt = {s.pk: (s.games, s.wins, s.draws, s.losses, s.cancelled, s.volume) for s in PlayerStats.objects.all()}
+        self.assertEqual(rebuilt, incremental)
+
+    def test_top_players_is_one_query(self):
+        a, b, c, d = self.users
+        self.play(a, b, "rock", "scissors")
+        self.play(a, c, "rock", "scissors")
+        self.play(b, c, "rock", "scissors")
+        self.play(d, c, "rock", "rock")
+        with self.assertNumQueries(1):
+            top = get_top_5_players()
+        self.assertEqual([(p["rank"], p["user"], p["wins"], p["total_games"]) for p in top], [
+            (1, a, 2, 2), (2, b, 1, 2), (3, c, 0, 3), (4, d, 0, 1),
+        ])
+        self.assertEqual(top[0]["win_rate"], 100.0)
@@ -13,6 +13,7 @@ urlpatterns = [
     path('api/search/cancel/', views.api_cancel_search, name='api_cancel_search'),
     path('api/move/', views.api_make_move, name='api_move'),
     path('api/game/<int:game_id>/status/', views.api_game_status, name='api_game_status'),
+    path('api/game/<int:game_id>/stream/', views.api_game_stream, name='api_game_stream'),
     path('api/bot/connect/', views.api_connect_bot, name='api_connect_bot'),
     path('api/game/cancel/', views.api_cancel_game, name='api_cancel_game'),
     path('api/leaderboard/', views.api_leaderboard, name='api_leaderboard'),
@@ -2,16 +2,21 @@ from _decimal import InvalidOperation
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
 from django.utils import timezone
 from django.db import transaction
-from django.db.models import Q, Subquery
+from django.db.models import F, Q
 from decimal import Decimal
 from datetime import timedelta
 import json
 import random
 
 from users.models import User
-from .models import Tournament, TournamentParticipant, Game, GameQueue, BotPool
+from cryptofarm import events
+from users.balances import apply_pending, debit, flush_pending, flush_user
+from users.supply import add_cf_circulating
+from . import matchmaking, stream
+from .models import Tournament, TournamentParticipant, Game, BotPool, PlayerStats
 from .templatetags.mask import mask_last
 import logging
 logger = logging.getLogger(__name__)
@@ -70,6 +75,8 @@ def _resolve_timeout_cancel(game: Game, inactive_user=None):
         bot_pool.return_balance(game.player2_bet)
     
     game.save()
+    PlayerStats.record(game)
+    stream.game_changed(game)
     return game
 
 
@@ -80,19 +87,13 @@ def rps_home(request):
     active_tournament = Tournament.objects.filter(status='active').first()
     
     # Получаем статистику пользователя
+    stats = PlayerStats.objects.filter(user=user).first()
     user_stats = {
-        'games_played': Game.objects.filter(
-            Q(player1=user) | Q(player2=user),
-            status='finished'
-        ).count(),
-        'wins': Game.objects.filter(winner=user).count(),
-        'draws': Game.objects.filter(
-            Q(player1=user) | Q(player2=user),
-            result='draw',
-            status='finished'
-        ).count(),
+        'games_played': stats.games if stats else 0,
+        'wins': stats.wins if stats else 0,
+        'draws': stats.draws if stats else 0,
+        'losses': stats.losses if stats else 0,
     }
-    user_stats['losses'] = user_stats['games_played'] - user_stats['wins'] - user_stats['draws']
     
     # Статистика турнира
     tournament_stats = None
@@ -137,60 +138,19 @@ def rps_home(request):
 
 
 def get_top_5_players():
-    """Получает топ-5 игроков по общему рейтингу"""
-    from django.db.models import Count, Q
-    
-    # Получаем всех пользователей, которые играли
-    all_users = User.objects.filter(
-        Q(games_as_player1__status='finished') | Q(games_as_player2__status='finished')
-    ).distinct()
-    
-    players_stats = []
-    
-    for user in all_users:
-        # Игры где пользователь был player1
-        games_as_p1 = Game.objects.filter(player1=user, status='finished')
-        # Игры где пользователь был player2
-        games_as_p2 = Game.objects.filter(player2=user, status='finished')
-        
-        total_games = games_as_p1.count() + games_as_p2.count()
-        
-        if total_games == 0:
-            continue
-        
-        # Подсчитываем победы
-        wins = Game.objects.filter(winner=user, status='finished').count()
-        
-        # Подсчитываем ничьи
-        draws = Game.objects.filter(
-            Q(player1=user, result='draw', status='finished') |
-            Q(player2=user, result='draw', status='finished')
-        ).count()
-        
-        losses = total_games - wins - draws
-        win_rate = (wins / total_games * 100) if total_games > 0 else 0
-        win_rate = round(win_rate, 1)  # Округляем до 1 знака после запятой
-        
-        players_stats.append({
-            'user': user,
-            'wins': wins,
-            'losses': losses,
-            'draws': draws,
-            'total_games': total_games,
-            'win_rate': win_rate,
-        })
-    
-    # Сортируем по победам, затем по общему количеству игр
-    players_stats.sort(key=lambda x: (x['wins'], x['total_games']), reverse=True)
-    
-    # Берем топ-5
-    top_5 = players_stats[:5]
-    
-    # Добавляем ранги
-    for idx, player in enumerate(top_5, 1):
-        player['rank'] = idx
-    
-    return top_5
+    """Получает топ-5 игроков по общему рейтингу (одним запросом по индексу PlayerStats)"""
+    return [
+        {
+            'user': stats.user,
+            'wins': stats.wins,
+            'losses': stats.losses,
+            'draws': stats.draws,
+            'total_games': stats.games,
+            'win_rate': stats.win_rate,
+            'rank': rank,
+        }
+        for rank, stats in enumerate(PlayerStats.top(5), 1)
+    ]
 
 
 def rps_game(request, game_id=None):
@@ -268,124 +228,56 @@ def api_search_game(request):
     except (InvalidOperation, ValueError, TypeError):
         return JsonResponse({'error': f'Invalid bet amount: {raw_bet!r}'}, status=400)
     
-    # Проверяем доступные ставки
-    valid_bets = [1, 3, 5, 10]
-    if bet_amount not in valid_bets:
+    # Очередь подбора — по ставке (rps.matchmaking.VALID_BETS)
+    bet = matchmaking.bucket(bet_amount)
+    if bet is None:
         return JsonResponse({'error': 'Invalid bet amount'}, status=400)
-    
-    # Проверяем баланс
-    user.refresh_from_db()
+
+    # Опрос ждущего: игра уже найдена, создаётся или ещё ищем — без обращения к БД
+    game_id = matchmaking.take_match(user.pk)
+    if game_id == matchmaking.MATCH_PENDING:
+        return _searching()
+    if game_id is not None:
+        return JsonResponse({
+            'success': True,
+            'game_id': game_id,
+            'opponent_found': True,
+        })
+    entry = matchmaking.waiting(user.pk)
+    if entry is not None and entry['bet'] == bet and matchmaking.keep_alive(user.pk):
+        return _searching()
+
+    # Игрок уже в незавершённой игре: отдаём её и в очередь не ставим, иначе ставка заморозится дважды
+    active_game_id = _active_games(user.pk).values_list('id', flat=True).first()
+    if active_game_id is not None:
+        matchmaking.cancel(user.pk)
+        return JsonResponse({
+            'success': True,
+            'game_id': active_game_id,
+            'opponent_found': True,
+        })
+
+    # Предварительная проверка с несвёрнутыми начислениями; окончательно проверит условное списание
+    apply_pending(user)
     if user.cf_balance < bet_amount:
         return JsonResponse({'error': 'Недостаточно средств'}, status=400)
-    
-    # Проверяем активный турнир
-    active_tournament = Tournament.objects.filter(status='active').first()
-    
 
-    expires_at = timezone.now() + timezone.timedelta(seconds=5)
-    queue_item, created = GameQueue.objects.get_or_create(
-        user=user,
-        defaults={
-            'bet_amount': bet_amount,
-            'tournament': active_tournament,
-            'expires_at': expires_at,
-        }
-    )
-    
-    if not created:
-        queue_item.bet_amount = bet_amount
-        queue_item.expires_at = expires_at
-        queue_item.save()
-    
-    # Ищем подходящего противника с блокировкой строк для предотвращения race condition
-    with transaction.atomic():
-        active_players = Game.objects.filter(
-            status__in=['waiting', 'betting', 'playing']
-        )
+    opponent_id = matchmaking.join(user.pk, bet)
+    if opponent_id is None:
+        return _searching()
 
-        # Блокируем строки в очереди и исключаем игроков, уже находящихся в активной игре
-        opponent_queue = GameQueue.objects.select_for_update().filter(
-            ~Q(user=user),
-            bet_amount=bet_amount,
-            expires_at__gt=timezone.now()
-        ).exclude(
-            user__cf_balance__lt=bet_amount
-        ).exclude(
-            Q(user__in=Subquery(active_players.values('player1'))) |
-            Q(user__in=Subquery(active_players.values('player2')))
-        ).first()
-        
-        # Проверяем, не находится ли пользователь уже в активной игре
-        active_game = Game.objects.filter(
-            (Q(player1=user) | Q(player2=user)),
-            status__in=['waiting', 'betting', 'playing'],
-        ).filter(
-            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
-        ).first()
+    game = _start_pvp_game(user, opponent_id, bet_amount)
+    if game is None:
+        # Не хватило средств — следующий опрос снова поставит игрока в очередь
+        return _searching()
+    return JsonResponse({
+        'success': True,
+        'game_id': game.id,
+        'opponent_found': True,
+    })
 
-        if active_game:
-            # Пользователь уже в игре
-            queue_item.delete()
-            return JsonResponse({
-                'success': True,
-                'game_id': active_game.id,
-                'opponent_found': True,
-            })
-        
-        if opponent_queue:
-            # Проверяем, не находится ли противник уже в игре
-            opponent_active_game = Game.objects.filter(
-                (Q(player1=opponent_queue.user) | Q(player2=opponent_queue.user)),
-                status__in=['waiting', 'betting', 'playing']
-            ).first()
-            
-            if opponent_active_game:
-                # Противник уже в игре, удаляем его из очереди и продолжаем поиск
-                opponent_queue.delete()
-                return JsonResponse({
-                    'success': True,
-                    'game_id': None,
-                    'opponent_found': False,
-                    'searching': True,
-                })
-            
-            # Нашли противника - создаем игру
-            # Списываем ставки с балансов обоих игроков
-            # Эти деньги временно "заморожены" в банке игры
-            user.cf_balance -= bet_amount
-            opponent_queue.user.cf_balance -= bet_amount
-            user.save(update_fields=['cf_balance'])
-            opponent_queue.user.save(update_fields=['cf_balance'])
-            
-            # Создаем игру с банком = сумма обеих ставок
-            # Победитель получит весь банк, проигравший потеряет свою ставку
-            from django.conf import settings
-            expires_at = timezone.now() + timedelta(days=settings.GAME_SETTINGS.get('ORDER_EXPIRY', 3))
-            
-            game = Game.objects.create(
-                player1=user,
-                player2=opponent_queue.user,
-                bet_amount=bet_amount,
-                player1_bet=bet_amount,
-                player2_bet=bet_amount,
-                game_bank=bet_amount * 2,  # Банк = ставка игрока 1 + ставка игрока 2
-                tournament=active_tournament,
-                game_type='pvp',
-                status='betting',
-                expires_at=expires_at,
-                move_timer_start=timezone.now(),  # старт таймера сразу после матчмейкинга
-            )
-            
-            # Удаляем из очереди
-            queue_item.delete()
-            opponent_queue.delete()
-            
-            return JsonResponse({
-                'success': True,
-                'game_id': game.id,
-                'opponent_found': True,
-            })
-    
+
+def _searching():
     return JsonResponse({
         'success': True,
         'game_id': None,
@@ -394,6 +286,61 @@ def api_search_game(request):
     })
 
 
+def _active_games(*player_ids):
+    """Незавершённые и не просроченные игры игроков — ставки по ним уже заморожены."""
+    return Game.objects.filter(
+        Q(player1_id__in=player_ids) | Q(player2_id__in=player_ids),
+        status__in=['waiting', 'betting', 'playing'],
+    ).filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+    )
+
+
+def _start_pvp_game(user, opponent_id, bet_amount):
+    """
+    Создаёт PvP-игру для пары из rps.matchmaking и отдаёт её id сопернику.
+    Ставки списываются условным UPDATE (по возрастанию pk); если кому-то не хватает
+    средств или кто-то из пары уже в игре — None, соперник при следующем опросе снова
+    встанет в очередь (или получит свою игру).
+    """
+    from django.conf import settings
+    active_tournament = Tournament.objects.filter(status='active').first()
+    now = timezone.now()
+    flush_pending((user.pk, opponent_id))
+
+    with transaction.atomic():
+        # Пока игрок стоял в очереди, он мог начать другую игру — вторую ставку не замораживаем
+        if _active_games(user.pk, opponent_id).exists():
+            matchmaking.match_failed(opponent_id)
+            return None
+        for player_id in sorted((user.pk, opponent_id)):
+            # Деньги временно "заморожены" в банке игры
+            if not User.objects.filter(pk=player_id, cf_balance__gte=bet_amount).update(
+                cf_balance=F('cf_balance') - bet_amount,
+            ):
+                transaction.set_rollback(True)
+                matchmaking.match_failed(opponent_id)
+                return None
+        add_cf_circulating(-2 * bet_amount)
+
+        # Банк = сумма обеих ставок: победитель получит весь банк, проигравший потеряет свою ставку
+        game = Game.objects.create(
+            player1=user,
+            player2_id=opponent_id,
+            bet_amount=bet_amount,
+            player1_bet=bet_amount,
+            player2_bet=bet_amount,
+            game_bank=bet_amount * 2,
+            tournament=active_tournament,
+            game_type='pvp',
+            status='betting',
+            expires_at=now + timedelta(days=settings.GAME_SETTINGS.get('ORDER_EXPIRY', 3)),
+            move_timer_start=now,  # старт таймера сразу после матчмейкинга
+        )
+    matchmaking.matched(opponent_id, game.id)
+    return game
+
+
 @csrf_exempt
 def api_make_move(request):
     """API для совершения хода"""
@@ -433,6 +380,8 @@ def api_make_move(request):
                 bot_pool.return_balance(game.player2_bet)
             game.status = 'cancelled'
             game.save()
+            PlayerStats.record(game)
+            stream.game_changed(game)
         return JsonResponse({'error': 'Игра истекла, ставки возвращены'}, status=400)
     
     # Проверяем, что пользователь участвует в игре
@@ -499,6 +448,7 @@ def api_make_move(request):
         if game.player1_move and game.player2_move:
             result = game.calculate_result()
             game.finish_game()
+            stream.game_changed(game)
             
             return JsonResponse({
                 'success': True,
@@ -517,6 +467,7 @@ def api_make_move(request):
                         _resolve_timeout_win(game, game.player1)
                     elif game.player2_move and not game.player1_move:
                         _resolve_timeout_win(game, game.player2)
+                    stream.game_changed(game)
                     
                     return JsonResponse({
                         'success': True,
@@ -525,6 +476,8 @@ def api_make_move(request):
                         'winner_id': game.winner.telegram_id if game.winner else None,
                     })
             
+            # Сопернику — что ход сделан (без самого хода)
+            stream.game_changed(game)
             return JsonResponse({
                 'success': True,
                 'game_finished': False,
@@ -583,6 +536,21 @@ def api_game_status(request, game_id):
     return JsonResponse(response)
 
 
+@require_GET
+async def api_game_stream(request, game_id):
+    """
+    SSE-поток игры: событие game при каждом ходе, результате и отмене (rps.stream).
+    По событию клиент перечитывает api_game_status; без потока опрашивает его как раньше.
+    """
+    user = request.user
+    game = await Game.objects.filter(pk=game_id).values('player1_id', 'player2_id').afirst()
+    if game is None:
+        return JsonResponse({'error': 'Game not found'}, status=404)
+    if user.pk not in (game['player1_id'], game['player2_id']):
+        return JsonResponse({'error': 'Not your game'}, status=403)
+    return events.sse_response(request, stream.channel(game_id))
+
+
 @csrf_exempt
 def api_cancel_search(request):
     """API для отмены поиска игры"""
@@ -592,7 +560,7 @@ def api_cancel_search(request):
     user = request.user
     
     # Удаляем пользователя из очереди
-    GameQueue.objects.filter(user=user).delete()
+    matchmaking.cancel(user.pk)
     
     return JsonResponse({
         'success': True,
@@ -644,14 +612,15 @@ def api_cancel_game(request):
             bot_pool.return_balance(game.player2_bet)
         
         # Удаляем из очереди, если есть
-        queue_users = [game.player1]
-        if game.player2:
-            queue_users.append(game.player2)
-        GameQueue.objects.filter(user__in=queue_users).delete()
+        matchmaking.cancel(game.player1_id)
+        if game.player2_id:
+            matchmaking.cancel(game.player2_id)
         
         # Отменяем игру
         game.status = 'cancelled'
         game.save()
+        PlayerStats.record(game)
+        stream.game_changed(game)
     
     return JsonResponse({
         'success': True,
@@ -686,7 +655,7 @@ def api_connect_bot(request):
         return JsonResponse({'error': f'Invalid bet amount: {raw_bet!r}'}, status=400)
     
     # Проверяем баланс
-    user.refresh_from_db()
+    flush_user(user)
     if user.cf_balance < bet_amount:
         return JsonResponse({'error': 'Недостаточно средств'}, status=400)
     
@@ -707,57 +676,25 @@ def api_connect_bot(request):
         })
     
     # Пытаемся найти реального противника прямо сейчас (повторная попытка перед ботом)
-    with transaction.atomic():
-        active_players = Game.objects.filter(
-            status__in=['waiting', 'betting', 'playing']
-        )
-
-        opponent_queue = GameQueue.objects.select_for_update().filter(
-            ~Q(user=user),
-            bet_amount=bet_amount,
-            expires_at__gt=timezone.now()
-        ).exclude(
-            user__cf_balance__lt=bet_amount
-        ).exclude(
-            Q(user__in=Subquery(active_players.values('player1'))) |
-            Q(user__in=Subquery(active_players.values('player2')))
-        ).first()
-
-        if opponent_queue:
-            # Списываем ставки с балансов обоих игроков
-            user.cf_balance -= bet_amount
-            opponent_queue.user.cf_balance -= bet_amount
-            user.save(update_fields=['cf_balance'])
-            opponent_queue.user.save(update_fields=['cf_balance'])
-
-            # Создаем игру PvP
-            from django.conf import settings
-            active_tournament = Tournament.objects.filter(status='active').first()
-            expires_at = timezone.now() + timedelta(days=settings.GAME_SETTINGS.get('ORDER_EXPIRY', 3))
-
-            game = Game.objects.create(
-                player1=user,
-                player2=opponent_queue.user,
-                bet_amount=bet_amount,
-                player1_bet=bet_amount,
-                player2_bet=bet_amount,
-                game_bank=bet_amount * 2,
-                tournament=active_tournament,
-                game_type='pvp',
-                status='betting',
-                expires_at=expires_at,
-            )
-
-            # Очищаем очереди
-            GameQueue.objects.filter(user__in=[user, opponent_queue.user]).delete()
+    matchmaking.cancel(user.pk)
+    game_id = matchmaking.take_match(user.pk)
+    if game_id == matchmaking.MATCH_PENDING:
+        # Соперник уже нашёл этого игрока и создаёт игру — клиент повторит запрос
+        return _searching()
+    if game_id is None:
+        bet = matchmaking.bucket(bet_amount)
+        opponent_id = matchmaking.join(user.pk, bet, enqueue=False) if bet is not None else None
+        if opponent_id is not None:
+            game = _start_pvp_game(user, opponent_id, bet_amount)
+            game_id = game.id if game is not None else None
+    if game_id is not None:
+        return JsonResponse({
+            'success': True,
+            'game_id': game_id,
+            'opponent_found': True,
+            'is_bot_game': False,
+        })
 
-            return JsonResponse({
-                'success': True,
-                'game_id': game.id,
-                'opponent_found': True,
-                'is_bot_game': False,
-            })
-    
     # Получаем пул ботов
     bot_pool = BotPool.get_pool()
     bot_balance = bot_pool.get_bot_balance()
@@ -765,16 +702,13 @@ def api_connect_bot(request):
     if bot_balance < bet_amount:
         return JsonResponse({'error': 'Бот временно недоступен'}, status=400)
     
-    # Удаляем из очереди
-    GameQueue.objects.filter(user=user).delete()
-    
     # Создаем игру с ботом
     active_tournament = Tournament.objects.filter(status='active').first()
     
     with transaction.atomic():
         # Списываем ставку пользователя (деньги временно "заморожены" в банке игры)
-        user.cf_balance -= bet_amount
-        user.save(update_fields=['cf_balance'])
+        if not debit(user, cf=bet_amount):
+            return JsonResponse({'error': 'Недостаточно средств'}, status=400)
         
         # Используем баланс из пула ботов (ставка бота)
         bot_pool.use_balance(bet_amount)
@@ -969,7 +903,7 @@ def api_rematch(request):
         bet_amount = old_game.bet_amount
         
         # Проверяем баланс
-        user.refresh_from_db()
+        flush_user(user)
         if user.cf_balance < bet_amount:
             return JsonResponse({'error': 'Недостаточно средств'}, status=400)
         
@@ -987,8 +921,8 @@ def api_rematch(request):
         
         with transaction.atomic():
             # Списываем ставку пользователя
-            user.cf_balance -= bet_amount
-            user.save(update_fields=['cf_balance'])
+            if not debit(user, cf=bet_amount):
+                return JsonResponse({'error': 'Недостаточно средств'}, status=400)
             
             # Используем баланс из пула ботов
             bot_pool.use_balance(bet_amount)
@@ -1022,8 +956,8 @@ def api_rematch(request):
         bet_amount = old_game.bet_amount
         
         # Проверяем балансы
-        user.refresh_from_db()
-        opponent.refresh_from_db()
+        flush_user(user)
+        flush_user(opponent)
         
         if user.cf_balance < bet_amount:
             return JsonResponse({'error': 'Недостаточно средств'}, status=400)
@@ -1046,11 +980,11 @@ def api_rematch(request):
         expires_at = timezone.now() + timedelta(days=settings.GAME_SETTINGS.get('ORDER_EXPIRY', 3))
         
         with transaction.atomic():
-            # Списываем ставки
-            user.cf_balance -= bet_amount
-            opponent.cf_balance -= bet_amount
-            user.save(update_fields=['cf_balance'])
-            opponent.save(update_fields=['cf_balance'])
+            # Списываем ставки (по возрастанию pk, как в _start_pvp_game)
+            for player in sorted((user, opponent), key=lambda p: p.pk):
+                if not debit(player, cf=bet_amount):
+                    transaction.set_rollback(True)
+                    return JsonResponse({'error': 'Недостаточно средств'}, status=400)
             
             # Создаем игру
             new_game = Game.objects.create(
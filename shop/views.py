@@ -2,15 +2,15 @@ import datetime
 from _decimal import Decimal, InvalidOperation
 
 from django.contrib import messages
-from django.db.models import Sum
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
-from trees.models import Tree, BurnedToken
-from users.models import User
+from trees.models import Tree
+from users.balances import credit, debit
+from users.supply import get_cf_supply
 from .models import ShopItem, Purchase
 from trees.views import get_current_user
 
@@ -26,10 +26,10 @@ def shop(request):
     auto_water_48 = next((item for item in items if 'автополив' in item.name.lower() and '48' in item.name), None)
     fertilizer = next((item for item in items if 'удобрение' in item.name.lower()), None)
 
-    TOTAL_CREATED_CF = 25_000_000
-    all_cf_grown = User.objects.aggregate(total=Sum('cf_balance'))['total'] or 0
-    burned = BurnedToken.objects.aggregate(total=Sum('amount'))['total'] or 0
-    cf_left = TOTAL_CREATED_CF - all_cf_grown - burned
+    supply = get_cf_supply()
+    TOTAL_CREATED_CF = supply["total_created"]
+    all_cf_grown = supply["grown"]
+    cf_left = supply["left"]
 
     purchases = Purchase.objects.filter(user=user).select_related('item').order_by('-valid_until')
 
@@ -55,15 +55,12 @@ def buy_auto_water(request):
     hours = days * 24
     ton_price = Decimal('0.1') if days == 1 else Decimal('0.2')
 
-    if user.ton_balance < ton_price:
-        return JsonResponse({"status": "error", "message": _("Недостаточно TON")}, status=400)
-
     item = ShopItem.objects.filter(type='auto_water', duration=hours).first()
     if not item:
         return JsonResponse({"status": "error", "message": _("Товар не найден")}, status=400)
 
-    user.ton_balance -= ton_price
-    user.save(update_fields=["ton_balance"])
+    if not debit(user, ton=ton_price):
+        return JsonResponse({"status": "error", "message": _("Недостаточно TON")}, status=400)
     Purchase.objects.create(user=user, item=item, price_paid=ton_price, valid_until=None)
 
     return JsonResponse({
@@ -80,16 +77,12 @@ def buy_shop_item(request, item_id):
     price = item.price
 
     if item.price_token_type == 'CF':
-        if user.cf_balance < price:
+        if not debit(user, cf=price):
             return JsonResponse({"status": "error", "message": _("Недостаточно FL")}, status=400)
-        user.cf_balance -= price
-        user.save(update_fields=["cf_balance"])
 
     elif item.price_token_type == 'TON':
-        if user.ton_balance < price:
+        if not debit(user, ton=price):
             return JsonResponse({"status": "error", "message": _("Недостаточно TON")}, status=400)
-        user.ton_balance -= price
-        user.save(update_fields=["ton_balance"])
 
     valid_until = timezone.now() + datetime.timedelta(hours=item.duration) if item.duration else None
     Purchase.objects.create(user=user, item=item, price_paid=price, valid_until=valid_until)
@@ -155,15 +148,12 @@ def buy_fertilizer(request):
     tree_id = request.POST.get("tree_id")  # пока не используешь — ок
     ton_price = Decimal('0.1')
 
-    if user.ton_balance < ton_price:
-        return JsonResponse({"status": "error", "message": _("Недостаточно TON")}, status=400)
-
     item = ShopItem.objects.filter(type='fertilizer').first()
     if not item:
         return JsonResponse({"status": "error", "message": _("Товар не найден")}, status=400)
 
-    user.ton_balance -= ton_price
-    user.save(update_fields=["ton_balance"])
+    if not debit(user, ton=ton_price):
+        return JsonResponse({"status": "error", "message": _("Недостаточно TON")}, status=400)
 
     Purchase.objects.create(user=user, item=item, price_paid=ton_price, valid_until=None)
 
@@ -181,15 +171,12 @@ def buy_branches(request):
 
     ton_price = Decimal('0.5') * quantity
 
-    if user.ton_balance < ton_price:
+    if not debit(user, ton=ton_price):
         return JsonResponse(
             {"status": "error", "message": _("Недостаточно TON для покупки веток.")},
             status=400
         )
-
-    user.ton_balance -= ton_price
-    user.branches_balance += quantity
-    user.save(update_fields=["ton_balance", "branches_balance"])
+    credit(user, branches=quantity)
 
     return JsonResponse({
         "status": "success",
@@ -210,12 +197,9 @@ def buy_ton_tree(request):
         return redirect("home")
 
     cost_ton = Decimal("5")
-    if user.ton_balance < cost_ton:
+    if not debit(user, ton=cost_ton):
         messages.error(request, _("Недостаточно TON для покупки TON-дерева."))
         return redirect("home")
-
-    user.ton_balance -= cost_ton
-    user.save(update_fields=["ton_balance"])
     Tree.objects.create(user=user, type="TON")
 
     messages.success(request, _("TON-дерево успешно куплено!"))
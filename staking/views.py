@@ -4,6 +4,9 @@ from django.contrib import messages
 from .models import Staking
 from django.utils import timezone
 from django.conf import settings
+from decimal import Decimal
+
+from users.balances import debit
 
 def staking(request):
     """Страница стейкинга"""
@@ -53,15 +56,10 @@ def create_staking(request):
     if amount <= 0:
         return JsonResponse({'status': 'error', 'message': 'Сумма должна быть положительной'})
     
-    # Проверяем баланс
-    if token_type == 'CF' and request.user.cf_balance < amount:
+    # Проверяем баланс и списываем средства одним условным UPDATE
+    if token_type == 'CF' and not debit(request.user, cf=Decimal(str(amount))):
         return JsonResponse({'status': 'error', 'message': 'Недостаточно CF на балансе'})
     
-    # Списываем средства
-    if token_type == 'CF':
-        request.user.cf_balance -= amount
-        request.user.save()
-    
     # Создаем стейкинг
     staking = Staking(
         user=request.user,
@@ -19,6 +19,8 @@ let gameFinalized = false;
 let awaitingFinalize = false;
 let finalizeAttempts = 0;
 let finalizeInterval = null;
+let gameStream = null;
+let gameStreamOpen = false;
 
 function isFinalizeReady(data) {
   // считаем финал готовым, если пришёл result ИЛИ пришёл ход соперника
@@ -110,6 +112,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Если мы на странице игры
     if (typeof gameId !== 'undefined' && gameId) {
         currentGameId = gameId;
+        openGameStream();
         startGameStatusPolling();
         
         // Обработчики ходов
@@ -288,6 +291,21 @@ function connectBot(betAmount) {
             return;
         }
         
+        if (data.opponent_found) {
+            // В последний момент нашёлся живой соперник
+            showNotification(tr('opponent_found', 'Противник найден!'), 'success');
+            setTimeout(() => {
+                navigateTo(`/rps/game/${data.game_id}/`);
+            }, 500);
+            return;
+        }
+
+        if (data.searching) {
+            // Соперник уже создаёт игру с нами — повторяем запрос
+            setTimeout(() => connectBot(betAmount), 500);
+            return;
+        }
+
         if (data.bot_connected) {
             showNotification(tr('bot_connected', 'Подключен!'), 'success');
 
@@ -439,7 +457,54 @@ function resetBetButtons() {
     });
 }
 
-// Опрос статуса игры
+// Статус игры: по событию потока или опросом, если потока нет
+function checkGameStatus() {
+  if (!currentGameId || gameFinalized) return;
+  fetch(tgUrl(`/rps/api/game/${currentGameId}/status/`))
+    .then(r => r.json())
+    .then(data => {
+      if (data?.error) return;
+
+      updateGameStatus(data);
+
+      if (data.status === 'cancelled' && !gameFinalized) {
+        gameFinalized = true;
+        stopFinalizeLoop();
+        stopAllRpsIntervals();
+        finalizeGameUI(data);
+        return;
+      }
+
+      // ✅ если уже “дожимаем” — НЕ трогаем finalize тут
+      if (awaitingFinalize) return;
+
+      // ✅ финализируем по обычной логике (если хочешь оставить)
+      if (isGameReadyToFinalize(data) && !gameFinalized) {
+        gameFinalized = true;
+        stopAllRpsIntervals();
+        finalizeGameUI(data);
+      }
+    })
+    .catch(() => {});
+}
+
+// Поток событий игры (SSE): ход соперника, результат, отмена — без опроса
+function openGameStream() {
+  if (!currentGameId || !window.EventSource || gameStream) return;
+  gameStream = new EventSource(tgUrl(`/rps/api/game/${currentGameId}/stream/`));
+  gameStream.onopen = () => { gameStreamOpen = true; checkGameStatus(); };
+  // EventSource переподключается сам; пока соединения нет — работает опрос
+  gameStream.onerror = () => { gameStreamOpen = false; };
+  gameStream.addEventListener('game', checkGameStatus);
+  gameStream.addEventListener('reset', checkGameStatus);
+}
+
+function closeGameStream() {
+  if (gameStream) { gameStream.close(); gameStream = null; }
+  gameStreamOpen = false;
+}
+
+// Опрос статуса игры (запасной путь, когда потока нет)
 function startGameStatusPolling() {
   if (!currentGameId) return;
 
@@ -447,32 +512,7 @@ function startGameStatusPolling() {
   if (gameStatusInterval) clearInterval(gameStatusInterval);
 
   gameStatusInterval = setInterval(() => {
-    fetch(tgUrl(`/rps/api/game/${currentGameId}/status/`))
-      .then(r => r.json())
-      .then(data => {
-        if (data?.error) return;
-
-        updateGameStatus(data);
-
-        if (data.status === 'cancelled' && !gameFinalized) {
-          gameFinalized = true;
-          stopFinalizeLoop();
-          stopAllRpsIntervals();
-          finalizeGameUI(data);
-          return;
-        }
-
-        // ✅ если уже “дожимаем” — НЕ трогаем finalize тут
-        if (awaitingFinalize) return;
-
-        // ✅ финализируем по обычной логике (если хочешь оставить)
-        if (isGameReadyToFinalize(data) && !gameFinalized) {
-          gameFinalized = true;
-          stopAllRpsIntervals();
-          finalizeGameUI(data);
-        }
-      })
-      .catch(() => {});
+    if (!gameStreamOpen) checkGameStatus();
   }, 1200);
 }
 
@@ -581,6 +621,8 @@ function startMoveTimer() {
                 isMoveTimerRunning = false;
                 showNotification(tr('time_over', 'Время вышло!'), 'error');
                 timerEl.style.display = 'none';
+                // Таймаут фиксирует сервер при запросе статуса — с потоком запроса иначе не будет
+                checkGameStatus();
             }
         }
     }, 1000);
@@ -858,6 +900,7 @@ function stopAllRpsIntervals() {
   if (gameStatusInterval) { clearInterval(gameStatusInterval); gameStatusInterval = null; }
   if (moveTimerInterval) { clearInterval(moveTimerInterval); moveTimerInterval = null; }
   isMoveTimerRunning = false;
+  closeGameStream();
 }
 
 function startRematch(gameId) {
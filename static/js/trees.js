@@ -0,0 +1,155 @@
+/**
+ * Деревья: живой доход по /tree/state.json и массовые «Полить все» / «Собрать всё».
+ * Сервер отдаёт только вектор состояния (trees/income.py: state_vector), доход и вода
+ * тикают здесь раз в секунду по тем же формулам, что pending_income / water_percent.
+ * Опрос идёт с If-None-Match, так что пока деревья и пул не менялись, ответ — 304.
+ */
+(function () {
+    const POLL_MS = 60000;
+    const HOUR_MS = 3600 * 1000;
+
+    let root = null;
+    let state = null;
+    let etag = null;
+
+    const url = u => (window.tgUrl ? window.tgUrl(u) : u);
+    const parse = s => (s ? Date.parse(s) : null);
+
+    function isWatered(tree, now) {
+        const autoUntil = parse(tree.auto_water_until);
+        if (autoUntil && now < autoUntil) return true;
+        const lastWatered = parse(tree.last_watered);
+        return Boolean(lastWatered) && now < lastWatered + state.water_duration_hours * HOUR_MS;
+    }
+
+    function waterPercent(tree, now) {
+        const lastWatered = parse(tree.last_watered);
+        if (!lastWatered) return 0;
+        const duration = state.water_duration_hours;
+        const hours = Math.min((now - lastWatered) / HOUR_MS, duration);
+        return Math.max(0, 100 - Math.floor(hours / duration * 100));
+    }
+
+    function pendingIncome(tree, now) {
+        const lastAccrued = parse(tree.last_accrued);
+        if (!lastAccrued) return 0;
+        if (tree.type === 'TON' && !state.pool) return 0;
+
+        // Доход начисляется, пока есть вода (ручной полив или автополив)
+        const duration = state.water_duration_hours;
+        const lastWatered = parse(tree.last_watered);
+        const autoUntil = parse(tree.auto_water_until);
+        const waterExpiry = lastWatered ? lastWatered + duration * HOUR_MS : now;
+        const accrueUntil = (autoUntil && autoUntil > now) ? Math.min(now, autoUntil) : Math.min(now, waterExpiry);
+        const hours = Math.max(0, Math.min((accrueUntil - lastAccrued) / HOUR_MS, duration));
+
+        const fertilizedUntil = parse(tree.fertilized_until);
+        const mult = (fertilizedUntil && now < fertilizedUntil) ? state.fertilizer_multiplier : 1;
+        const pending = tree.income_per_hour * mult * hours;
+        return tree.type === 'TON' ? Math.min(pending, state.pool.left_to_distribute) : pending;
+    }
+
+    function render() {
+        if (!state) return;
+        const now = Date.now();
+        let canCollect = false;
+        let canWater = false;
+
+        state.trees.forEach(tree => {
+            const pending = pendingIncome(tree, now);
+            canCollect = canCollect || pending > 0;
+            canWater = canWater || (!isWatered(tree, now) && (tree.type === 'CF' || Boolean(state.pool)));
+            root.querySelectorAll(`[data-tree-pending="${tree.id}"]`).forEach(el => {
+                el.textContent = pending.toFixed(tree.type === 'TON' ? 4 : 1);
+            });
+            root.querySelectorAll(`[data-tree-water="${tree.id}"]`).forEach(el => {
+                el.textContent = `${waterPercent(tree, now)}%`;
+            });
+        });
+
+        root.querySelectorAll('[data-bulk="collect"]').forEach(btn => { btn.disabled = !canCollect; });
+        root.querySelectorAll('[data-bulk="water"]').forEach(btn => { btn.disabled = !canWater; });
+    }
+
+    function refresh() {
+        const headers = etag ? {'If-None-Match': etag} : {};
+        return fetch(url('/tree/state.json'), {headers: headers, credentials: 'same-origin'})
+            .then(r => {
+                if (r.status === 304 || !r.ok) return;
+                etag = r.headers.get('ETag');
+                return r.json().then(data => {
+                    state = data;
+                    render();
+                });
+            })
+            .catch(() => {});
+    }
+
+    function notify(message, type) {
+        let wrap = document.querySelector('.messages-wrap');
+        if (!wrap) {
+            wrap = document.createElement('div');
+            wrap.className = 'messages-wrap';
+            root.parentNode.insertBefore(wrap, root);
+        }
+        const el = document.createElement('div');
+        el.className = `custom-message custom-message-${type === 'success' ? 'success' : 'error'}`;
+        el.textContent = message;
+        wrap.appendChild(el);
+        setTimeout(() => {
+            el.style.transition = 'opacity 0.5s';
+            el.style.opacity = 0;
+            setTimeout(() => el.remove(), 700);
+        }, 2600);
+    }
+
+    function updateBalances(data) {
+        if (data.new_balance_cf !== undefined) {
+            document.querySelectorAll('[data-balance="cf"]').forEach(el => {
+                el.textContent = Math.floor(data.new_balance_cf).toLocaleString('en-US');
+            });
+        }
+        if (data.new_balance_ton !== undefined) {
+            document.querySelectorAll('[data-balance="ton"]').forEach(el => {
+                el.textContent = data.new_balance_ton.toFixed(1);
+            });
+        }
+    }
+
+    function bulk(action, button) {
+        button.disabled = true;
+        fetch(url(`/tree/${action}_all/`), {
+            method: 'POST',
+            headers: {'X-CSRFToken': root.dataset.csrf},
+            credentials: 'same-origin'
+        })
+            .then(r => r.json())
+            .then(data => {
+                notify(data.message, data.status);
+                if (data.branches_dropped) notify(gettext('🌿 Поздравляем! Вам выпала ветка!'), 'success');
+                if (data.status === 'success') {
+                    updateBalances(data);
+                    return refresh();
+                }
+            })
+            .catch(() => notify(gettext('Ошибка сети, попробуйте ещё раз'), 'error'))
+            .finally(render);
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        root = document.querySelector('[data-trees-live]');
+        if (!root) return;
+
+        root.querySelectorAll('[data-bulk]').forEach(btn => {
+            btn.addEventListener('click', function (e) {
+                e.preventDefault();
+                bulk(this.dataset.bulk, this);
+            });
+        });
+
+        refresh();
+        setInterval(render, 1000);
+        setInterval(() => { if (!document.hidden) refresh(); }, POLL_MS);
+        document.addEventListener('visibilitychange', () => { if (!document.hidden) refresh(); });
+    });
+})();
@@ -7,6 +7,8 @@ from datetime import timedelta
 
 from users.models import User
 from .models import Tree, TonDistribution
+from .distribution import invalidate_active_distribution
+from .participants import recount_ton_participants
 
 
 @admin.register(Tree)
@@ -253,11 +255,22 @@ class TreeAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Новое TON-дерево учитывается в Tree.save(), смену типа пересчитываем
+        if change and 'type' in form.changed_data:
+            recount_ton_participants()
+
     def water_trees(self, request, queryset):
         """Массовый полив: last_watered = now для всех выбранных деревьев."""
         now = timezone.now()
-        count = queryset.count()
-        queryset.update(last_watered=now)
+        trees = list(queryset)
+        count = len(trees)
+        for tree in trees:
+            tree.last_watered = now
+            tree.updated_at = now
+            tree.refresh_water_schedule()
+        Tree.objects.bulk_update(trees, ['last_watered', 'water_expires_at', 'next_reminder_at', 'updated_at'])
         self.message_user(request, f'Успешно полито {count} деревьев.')
     water_trees.short_description = "Полить деревья"
 
@@ -277,7 +290,7 @@ class TreeAdmin(admin.ModelAdmin):
             days = int(days)
             now = timezone.now()
             count = queryset.count()
-            queryset.update(fertilized_until=now + timedelta(days=days))
+            queryset.update(fertilized_until=now + timedelta(days=days), updated_at=now)
             self.message_user(request, f'Успешно удобрено {count} деревьев на {days} дней.')
     fertilize_trees.short_description = "Удобрить деревья"
 
@@ -313,8 +326,22 @@ class TonDistributionAdmin(admin.ModelAdmin):
 
     actions = ["finish_distribution"]
 
+    def get_readonly_fields(self, request, obj=None):
+        # Бюджет уже разложен по слотам — менять его у существующей раздачи нельзя
+        if obj is not None:
+            return ("total_amount", "distributed_amount")
+        return ()
+
     def finish_distribution(self, request, queryset):
         for dist in queryset:
             dist.finish()
         self.message_user(request, "Выбранные раздачи завершены.")
     finish_distribution.short_description = "Завершить выбранные раздачи"
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_active_distribution()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_active_distribution()
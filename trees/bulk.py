@@ -0,0 +1,157 @@
+# trees/bulk.py
+
+import random
+from decimal import Decimal
+
+from django.db import transaction
+
+from users.balances import credit
+from .income import tree_state
+from .models import Tree
+
+
+def _tree_result(tree, state, **extra):
+    result = {
+        "id": tree.id,
+        "type": tree.type,
+        "water_percent": state["water_percent"],
+        "pending_income": float(state["pending_income"]),
+        "is_watered": state["is_watered"],
+    }
+    result.update(extra)
+    return result
+
+
+def _claim(tree, field, old_value, **values):
+    """
+    Условно обновляет дерево: только если field всё ещё равен прочитанному old_value.
+    Повторный запрос с теми же устаревшими данными ничего не обновит и ничего не начислит.
+    """
+    return Tree.objects.filter(pk=tree.pk, **{field: old_value}).update(**values) == 1
+
+
+def water_all(user, trees, now, distribution):
+    """
+    Поливает все деревья пользователя, у которых закончилась вода.
+    CF-деревья сразу отдают накопленное (как Tree.water), TON — только при активном пуле.
+    Каждое дерево поливается условным UPDATE по прочитанному last_watered, поэтому
+    двойная отправка не начислит доход дважды.
+    """
+    pool_open = bool(distribution and distribution.left_to_distribute > 0)
+    results = []
+    watered = []
+    amount_cf = Decimal("0")
+    branches = 0
+
+    with transaction.atomic():
+        for tree in trees:
+            state = tree_state(tree, now, distribution)
+            if state["is_watered"]:
+                results.append(_tree_result(tree, state, status="skipped", reason="already_watered"))
+                continue
+            if tree.type == "TON" and not pool_open:
+                results.append(_tree_result(tree, state, status="skipped", reason="pool_closed"))
+                continue
+
+            old_watered = tree.last_watered
+            tree.last_watered = now
+            tree.water_reminder_sent_at = None
+            tree.refresh_water_schedule()
+            tree.updated_at = now
+            if not _claim(
+                tree, "last_watered", old_watered,
+                last_watered=now,
+                water_reminder_sent_at=None,
+                water_expires_at=tree.water_expires_at,
+                next_reminder_at=tree.next_reminder_at,
+                updated_at=now,
+            ):
+                tree.refresh_from_db()
+                results.append(_tree_result(
+                    tree, tree_state(tree, now, distribution), status="skipped", reason="already_watered",
+                ))
+                continue
+
+            tree_cf = state["pending_income"] if tree.type == "CF" else Decimal("0")
+            branch_dropped = tree.type == "CF" and random.random() < tree.BRANCH_DROP_CHANCE
+            amount_cf += tree_cf
+            branches += int(branch_dropped)
+            watered.append(tree)
+            results.append(_tree_result(
+                tree, tree_state(tree, now, distribution),
+                status="watered", amount_cf=float(tree_cf), branch_dropped=branch_dropped,
+            ))
+
+        credit(user, cf=amount_cf, branches=branches)
+
+    return {
+        "trees": results,
+        "watered_count": len(watered),
+        "amount_cf": amount_cf,
+        "branches_dropped": branches,
+    }
+
+
+def collect_all(user, trees, now, distribution):
+    """
+    Собирает накопленный доход со всех деревьев пользователя одним начислением.
+
+    Сначала каждое дерево забирается условным UPDATE по прочитанному last_cf_accrued:
+    начисляется доход только тех строк, которые реально обновились, так что двойная
+    отправка (или две вкладки) не соберёт одно и то же дважды. Затем TON списывается
+    из пула одним draw на сумму забранных TON-деревьев и раздаётся по порядку; деревьям,
+    которым из пула ничего не досталось, возвращается прежний last_cf_accrued.
+    """
+    results = {}
+    collected = []
+    amount_cf = Decimal("0")
+    amount_ton = Decimal("0")
+    states = {tree.id: tree_state(tree, now, distribution) for tree in trees}
+
+    with transaction.atomic():
+        claimed = []
+        for tree in trees:
+            state = states[tree.id]
+            if state["pending_income"] <= 0 or (tree.type == "TON" and not distribution):
+                results[tree.id] = _tree_result(tree, state, status="skipped", reason="nothing_to_collect")
+            elif _claim(tree, "last_cf_accrued", tree.last_cf_accrued, last_cf_accrued=now, updated_at=now):
+                claimed.append((tree, tree.last_cf_accrued))
+            else:
+                tree.refresh_from_db()
+                results[tree.id] = _tree_result(
+                    tree, tree_state(tree, now, distribution), status="skipped", reason="already_collected",
+                )
+
+        ton_pending = sum(
+            (states[t.id]["pending_income"] for t, _ in claimed if t.type == "TON"), Decimal("0")
+        )
+        ton_available = distribution.draw(ton_pending) if ton_pending > 0 else Decimal("0")
+
+        for tree, old_accrued in claimed:
+            state = states[tree.id]
+            pending = state["pending_income"]
+            if tree.type == "TON":
+                pending = min(pending, ton_available)
+                ton_available -= pending
+                if pending <= 0:
+                    _claim(tree, "last_cf_accrued", now, last_cf_accrued=old_accrued)
+                    results[tree.id] = _tree_result(tree, state, status="skipped", reason="nothing_to_collect")
+                    continue
+                amount_ton += pending
+            else:
+                amount_cf += pending
+            tree.last_cf_accrued = now
+            tree.updated_at = now
+            collected.append(tree)
+            results[tree.id] = _tree_result(
+                tree, tree_state(tree, now, distribution), status="collected", collected=float(pending),
+            )
+
+        credit(user, cf=amount_cf, ton=amount_ton)
+
+    return {
+        "trees": [results[tree.id] for tree in trees],
+        "collected_count": len(collected),
+        "amount_cf": amount_cf,
+        "amount_ton": amount_ton,
+    }
@@ -0,0 +1,55 @@
+# trees/distribution.py
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+CACHE_KEY = "trees:active_ton_distribution"
+
+# Атрибут запроса, в котором хранится снимок на время одного запроса
+REQUEST_ATTR = "_active_ton_distribution"
+
+
+def _cache_ttl():
+    return getattr(settings, "TON_DISTRIBUTION_CACHE_TTL", 5)
+
+
+def get_active_distribution(request=None):
+    """
+    Снимок активной раздачи TON (или None).
+
+    В пределах одного запроса возвращается один и тот же объект, между запросами —
+    значение из кэша с коротким TTL. Снимок только для чтения: изменять пул нужно
+    атомарными UPDATE и после этого вызывать invalidate_active_distribution().
+    """
+    if request is not None and hasattr(request, REQUEST_ATTR):
+        return getattr(request, REQUEST_ATTR)
+
+    cached = cache.get(CACHE_KEY)
+    if cached is not None:
+        # В кэше лежит кортеж, чтобы отличать «нет раздачи» от «нет в кэше»
+        dist = cached[0]
+    else:
+        from .models import TON_QUANT, TonDistribution
+        # Остаток по слотам считается тем же запросом и кэшируется вместе со снимком
+        dist = (
+            TonDistribution.objects.filter(is_active=True)
+            .annotate(slots_left=Sum("slots__remaining"))
+            .last()
+        )
+        if dist is not None and dist.slots_left is not None:
+            dist.__dict__["_left_to_distribute"] = Decimal(dist.slots_left).quantize(TON_QUANT)
+        cache.set(CACHE_KEY, (dist,), _cache_ttl())
+
+    if request is not None:
+        setattr(request, REQUEST_ATTR, dist)
+    return dist
+
+
+def invalidate_active_distribution(request=None):
+    """Сбрасывает снимок после любого изменения пула."""
+    cache.delete(CACHE_KEY)
+    if request is not None and hasattr(request, REQUEST_ATTR):
+        delattr(request, REQUEST_ATTR)
@@ -0,0 +1,142 @@
+# trees/income.py
+
+from decimal import Decimal
+
+from django.utils import timezone
+
+from .distribution import get_active_distribution
+
+# Маркер «раздача ещё не загружена» — None означает «активной раздачи нет».
+UNSET = object()
+
+ZERO = Decimal('0.0000')
+
+
+def effective_income_per_hour(tree, now):
+    """CF/час с учётом удобрения."""
+    if tree.fertilized_until and now < tree.fertilized_until:
+        return tree.income_per_hour * 2
+    return tree.income_per_hour
+
+
+def ton_per_hour(tree, now):
+    """TON/час: 0.01 * уровень, x2 при удобрении."""
+    fertilized = bool(now and tree.fertilized_until and now < tree.fertilized_until)
+    mult = Decimal("2") if fertilized else Decimal("1")
+    return Decimal(tree.level) * Decimal("0.01") * mult
+
+
+def is_watered(tree, now):
+    if tree.auto_water_until and now < tree.auto_water_until:
+        return True
+    if not tree.last_watered:
+        return False
+    return now < tree.last_watered + timezone.timedelta(hours=tree.WATER_DURATION)
+
+
+def water_percent(tree, now):
+    """100% сразу после полива, линейно до 0% за WATER_DURATION часов."""
+    if not tree.last_watered:
+        return 0
+    hours_passed = min((now - tree.last_watered).total_seconds() / 3600, tree.WATER_DURATION)
+    return max(0, 100 - int((hours_passed / tree.WATER_DURATION) * 100))
+
+
+def water_schedule(tree):
+    """
+    Денормализованное расписание полива: (water_expires_at, next_reminder_at).
+    water_expires_at — когда у дерева закончится вода с учётом автополива;
+    next_reminder_at — когда напомнить о поливе (None, если уже напоминали после полива).
+    """
+    if not tree.last_watered:
+        return None, None
+    expires = tree.last_watered + timezone.timedelta(hours=tree.WATER_DURATION)
+    if tree.auto_water_until and tree.auto_water_until > expires:
+        expires = tree.auto_water_until
+    reminded = tree.water_reminder_sent_at and tree.water_reminder_sent_at >= tree.last_watered
+    return expires, (None if reminded else expires)
+
+
+def pending_income(tree, now, distribution):
+    """
+    Сколько CF или TON накопилось с последнего сбора (или полива).
+    distribution — снимок активной раздачи TON (или None), используется только для TON.
+    """
+    last_accrued = tree.last_cf_accrued or tree.last_watered
+    if not last_accrued:
+        return ZERO
+
+    # Доход начисляется, пока есть вода (ручной полив или автополив)
+    water_expiry = tree.last_watered + timezone.timedelta(hours=tree.WATER_DURATION) if tree.last_watered else now
+    if tree.auto_water_until and tree.auto_water_until > now:
+        accrue_until = min(now, tree.auto_water_until)
+    else:
+        accrue_until = min(now, water_expiry)
+    seconds_since = (accrue_until - last_accrued).total_seconds()
+    hours = max(0, min(seconds_since / 3600, tree.WATER_DURATION))
+
+    if tree.type == "CF":
+        pending = effective_income_per_hour(tree, now) * Decimal(hours)
+    elif tree.type == "TON":
+        # Если нет активной раздачи — ничего не накапливаем!
+        if not distribution:
+            return ZERO
+        pending = ton_per_hour(tree, now) * Decimal(f"{hours:.10f}")
+        # Нельзя собрать больше, чем осталось в пуле
+        pending = min(pending, distribution.left_to_distribute)
+    else:
+        return ZERO
+    return pending.quantize(ZERO)
+
+
+def tree_state(tree, now, distribution):
+    fertilized = bool(tree.fertilized_until and tree.fertilized_until > now)
+    state = {
+        "pending_income": pending_income(tree, now, distribution),
+        "water_percent": water_percent(tree, now),
+        "is_watered": is_watered(tree, now),
+        "is_fertilized": fertilized,
+        "is_auto_watered": bool(tree.auto_water_until and tree.auto_water_until > now),
+    }
+    if tree.type == "TON":
+        state["income_per_hour"] = ton_per_hour(tree, now)
+    else:
+        state["income_per_hour"] = effective_income_per_hour(tree, now)
+    return state
+
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+
+def state_vector(tree):
+    """
+    Компактное состояние дерева для клиента (/tree/state.json): только то, что
+    хранится в строке, без now. Клиент сам экстраполирует доход и воду по формулам
+    pending_income / water_percent, поэтому вектор меняется лишь при изменении дерева.
+    """
+    base_rate = ton_per_hour(tree, None) if tree.type == "TON" else tree.income_per_hour
+    return {
+        "id": tree.id,
+        "type": tree.type,
+        "level": tree.level,
+        "income_per_hour": float(base_rate),   # без удобрения; при удобрении x2
+        "last_watered": _iso(tree.last_watered),
+        "last_accrued": _iso(tree.last_cf_accrued or tree.last_watered),
+        "water_expires_at": _iso(tree.water_expires_at),
+        "fertilized_until": _iso(tree.fertilized_until),
+        "auto_water_until": _iso(tree.auto_water_until),
+    }
+
+
+def tree_states(trees, now=None, distribution=UNSET, request=None):
+    """
+    Считает состояние всех деревьев за один проход с общим now и общим снимком раздачи.
+    Возвращает {tree.id: state}. Снимок раздачи берётся из get_active_distribution
+    (один на запрос) и только если среди деревьев есть TON.
+    """
+    now = now or timezone.now()
+    trees = list(trees)
+    if distribution is UNSET:
+        distribution = get_active_distribution(request) if any(t.type == "TON" for t in trees) else None
+    return {tree.id: tree_state(tree, now, distribution) for tree in trees}
@@ -1,60 +1,80 @@
-from datetime import timedelta
+import asyncio
 import os
-import requests
+import time
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db.models import Q, F
 from django.utils import timezone
 
 from trees.models import Tree
+from trees.reminders import GLOBAL_RATE, FakeTelegramServer, ReminderSender
 
-
-def send_telegram_message(chat_id: int, text: str) -> bool:
-    token = os.getenv("BOT_TOKEN")  # положи токен в env на сервере
-    if not token:
-        return False
-
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    resp = requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=10)
-    return resp.status_code == 200
+REMINDER_TEXT = "💧 Пора поливать дерево! Прошло 5 часов с последнего полива."
 
 
 class Command(BaseCommand):
     help = "Send watering reminder when 5 hours passed after last watering"
 
-    def handle(self, *args, **options):
-        now = timezone.now()
-        threshold = now - timedelta(hours=Tree.WATER_DURATION)
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--rate", type=float, default=GLOBAL_RATE, help="сообщений в секунду")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="слать в локальную заглушку Bot API и не отмечать деревья (замер пропускной способности)",
+        )
+        parser.add_argument(
+            "--fake-429-every", type=int, default=0,
+            help="в --dry-run отвечать 429 на каждый N-й запрос",
+        )
+
+    def handle(self, *args, **opts):
+        dry_run = opts["dry_run"]
+        token = os.getenv("BOT_TOKEN") or getattr(settings, "TELEGRAM_BOT_TOKEN", "")
+        if not token and not dry_run:
+            self.stderr.write("BOT_TOKEN is not set")
+            return
 
-        # Деревья, которые НЕ политые (вода кончилась), и прошло >= 5 часов с last_watered
+        now = timezone.now()
         qs = (
             Tree.objects.select_related("user")
-            .filter(last_watered__isnull=False, last_watered__lte=threshold)
-            .filter(
-                # автополив активен? тогда не напоминаем
-                Q(auto_water_until__isnull=True) | Q(auto_water_until__lte=now)
-            )
-            .filter(
-                # ещё не напоминали после последнего полива
-                Q(water_reminder_sent_at__isnull=True) | Q(water_reminder_sent_at__lt=F("last_watered"))
-            )
+            .filter(next_reminder_at__lte=now)
+            .order_by("next_reminder_at")
         )
 
-        sent = 0
-        for tree in qs.iterator():
+        sent = total = 0
+        started = time.monotonic()
+        chunk = []
+        for tree in qs.iterator(chunk_size=opts["chunk_size"]):
             tg_id = getattr(tree.user, "telegram_id", None)
-            if not tg_id:
+            if not tg_id or tree.is_watered(now):
                 continue
+            chunk.append((tree.id, tg_id, REMINDER_TEXT))
+            if len(chunk) >= opts["chunk_size"]:
+                sent += self.process_chunk(chunk, token, now, opts)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            sent += self.process_chunk(chunk, token, now, opts)
+            total += len(chunk)
 
-            # на всякий случай не шлём, если внезапно снова "is_watered"
-            if tree.is_watered():
-                continue
+        elapsed = time.monotonic() - started
+        rate = sent / elapsed if elapsed > 0 else 0
+        prefix = "[dry-run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Sent reminders: {sent}/{total} in {elapsed:.2f}s ({rate:.1f} msg/s)"
+        ))
 
-            text = "💧 Пора поливать дерево! Прошло 5 часов с последнего полива."
-            ok = send_telegram_message(tg_id, text)
-            if ok:
-                tree.water_reminder_sent_at = now
-                tree.save(update_fields=["water_reminder_sent_at"])
-                sent += 1
+    def process_chunk(self, chunk, token, now, opts):
+        ok_ids = asyncio.run(self.send_chunk(chunk, token, opts))
+        if ok_ids and not opts["dry_run"]:
+            # Одно UPDATE на пачку вместо save() на каждое дерево
+            Tree.objects.filter(pk__in=ok_ids).update(water_reminder_sent_at=now, next_reminder_at=None)
+        return len(ok_ids)
 
-        self.stdout.write(self.style.SUCCESS(f"Sent reminders: {sent}"))
+    async def send_chunk(self, chunk, token, opts):
+        kwargs = {"concurrency": opts["concurrency"], "rate": opts["rate"]}
+        if not opts["dry_run"]:
+            return await ReminderSender(token, **kwargs).send(chunk)
+        async with FakeTelegramServer(rate_limit_every=opts["fake_429_every"]) as fake:
+            return await ReminderSender(token or "dry-run", base_url=fake.base_url, **kwargs).send(chunk)
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:40
+
+from django.db import migrations
+
+
+def seed_participants(apps, schema_editor):
+    Tree = apps.get_model('trees', 'Tree')
+    SupplyCounter = apps.get_model('users', 'SupplyCounter')
+    count = Tree.objects.filter(type='TON').values('user_id').distinct().count()
+    SupplyCounter.objects.update_or_create(name='ton_participants', defaults={'value': count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0009_alter_tree_type'),
+        ('users', '0006_supplycounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_participants, migrations.RunPython.noop),
+    ]
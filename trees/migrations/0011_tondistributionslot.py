@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:33
+
+from decimal import Decimal, ROUND_DOWN
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_slots_for_active(apps, schema_editor):
+    TonDistribution = apps.get_model('trees', 'TonDistribution')
+    TonDistributionSlot = apps.get_model('trees', 'TonDistributionSlot')
+    count = 16
+    for dist in TonDistribution.objects.filter(is_active=True):
+        left = max(dist.total_amount - dist.distributed_amount, Decimal('0'))
+        share = (left / count).quantize(Decimal('0.00000001'), rounding=ROUND_DOWN)
+        budgets = [share] * (count - 1) + [left - share * (count - 1)]
+        TonDistributionSlot.objects.bulk_create([
+            TonDistributionSlot(distribution=dist, index=i, budget=b, remaining=b)
+            for i, b in enumerate(budgets)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0010_seed_ton_participants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TonDistributionSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('budget', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('remaining', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('distribution', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='trees.tondistribution')),
+            ],
+            options={
+                'verbose_name': 'Слот раздачи TON',
+                'verbose_name_plural': 'Слоты раздачи TON',
+                'unique_together': {('distribution', 'index')},
+            },
+        ),
+        migrations.RunPython(create_slots_for_active, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:35
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+WATER_DURATION = 5
+
+
+def backfill_water_schedule(apps, schema_editor):
+    Tree = apps.get_model('trees', 'Tree')
+    batch = []
+    for tree in Tree.objects.filter(last_watered__isnull=False).iterator(chunk_size=2000):
+        expires = tree.last_watered + timedelta(hours=WATER_DURATION)
+        if tree.auto_water_until and tree.auto_water_until > expires:
+            expires = tree.auto_water_until
+        reminded = tree.water_reminder_sent_at and tree.water_reminder_sent_at >= tree.last_watered
+        tree.water_expires_at = expires
+        tree.next_reminder_at = None if reminded else expires
+        batch.append(tree)
+        if len(batch) >= 2000:
+            Tree.objects.bulk_update(batch, ['water_expires_at', 'next_reminder_at'])
+            batch = []
+    if batch:
+        Tree.objects.bulk_update(batch, ['water_expires_at', 'next_reminder_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trees', '0011_tondistributionslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tree',
+            name='next_reminder_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tree',
+            name='water_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_water_schedule, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,16 @@
 import random
-from decimal import Decimal
-from django.db import models
+from decimal import Decimal, ROUND_DOWN
+from django.db import models, transaction
 from django.utils import timezone
 
+from users.balances import credit, debit
 from users.models import User as TelegramUser
+from . import income
+from .distribution import get_active_distribution, invalidate_active_distribution
 from django.utils.translation import gettext_lazy as _
 
+TON_QUANT = Decimal('0.00000001')
+
 
 class Tree(models.Model):
     TYPE_CHOICES = (
@@ -25,27 +30,47 @@ class Tree(models.Model):
     auto_water_until = models.DateTimeField(null=True, blank=True)
     last_collected = models.DateTimeField(null=True, blank=True)
     water_reminder_sent_at = models.DateTimeField(null=True, blank=True)
+    # Денормализация для планировщика напоминаний (см. income.water_schedule)
+    water_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    next_reminder_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Меняется при любом изменении дерева, из него строится ETag /tree/state.json.
+    # bulk_update() и queryset.update() должны выставлять его сами.
+    updated_at = models.DateTimeField(auto_now=True)
 
     BRANCH_DROP_CHANCE = 0.5
     WATER_DURATION = 5
 
-    def is_watered(self):
-        now = timezone.now()
-
-        if self.auto_water_until and now < self.auto_water_until:
-            return True
-
-        if not self.last_watered:
-            return False
-
-        expiry = self.last_watered + timezone.timedelta(hours=self.WATER_DURATION)
-        return now < expiry
-
-    def is_fertilized(self):
+    WATER_SCHEDULE_FIELDS = {"last_watered", "auto_water_until", "water_reminder_sent_at"}
+
+    def refresh_water_schedule(self):
+        self.water_expires_at, self.next_reminder_at = income.water_schedule(self)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or self.WATER_SCHEDULE_FIELDS.intersection(update_fields):
+            self.refresh_water_schedule()
+            if update_fields is not None:
+                update_fields = kwargs["update_fields"] = set(update_fields) | {"water_expires_at", "next_reminder_at"}
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"updated_at"}
+        if not (adding and self.type == "TON"):
+            super().save(*args, **kwargs)
+            return
+        from .participants import lock_ton_owner, on_ton_tree_created
+        with transaction.atomic():
+            had_ton_trees = lock_ton_owner(self.user_id)
+            super().save(*args, **kwargs)
+            on_ton_tree_created(had_ton_trees)
+
+    def is_watered(self, now=None):
+        return income.is_watered(self, now or timezone.now())
+
+    def is_fertilized(self, now=None):
         """Проверяем, не истёк ли эффект удобрения."""
         if not self.fertilized_until:
             return False
-        return timezone.now() < self.fertilized_until
+        return (now or timezone.now()) < self.fertilized_until
 
     def can_upgrade(self):
         from django.conf import settings
@@ -64,13 +89,10 @@ class Tree(models.Model):
             return False
 
         required_branches = levels[next_level]["branches"]
-        if self.user.branches_balance < required_branches:
+        # списываем ветки у пользователя условным UPDATE
+        if not debit(self.user, branches=required_branches):
             return False
 
-        # списываем ветки у пользователя
-        self.user.branches_balance -= required_branches
-        self.user.save(update_fields=["branches_balance"])
-
         # апаем дерево
         self.level = next_level
 
@@ -83,67 +105,24 @@ class Tree(models.Model):
 
         return True
 
-    def get_income_per_hour(self):
-        now = timezone.now()
-        if self.fertilized_until and now < self.fertilized_until:
-            return self.income_per_hour * 2
-        return self.income_per_hour
+    def get_income_per_hour(self, now=None):
+        return income.effective_income_per_hour(self, now or timezone.now())
 
-    def get_pending_income(self):
+    def get_pending_income(self, now=None, distribution=income.UNSET):
         """
         Считает, сколько CF или TON накопилось с последнего сбора (или полива, если не было сборов).
         CF — доход/ч, TON — 0.1*уровень за 5ч (пропорционально времени), оба учитывают удобрение.
+        Для пакетного расчёта по многим деревьям используйте trees.income.tree_states.
         """
-        from django.utils import timezone
-        now = timezone.now()
-        last_accrued = self.last_cf_accrued or self.last_watered
-        if not last_accrued:
-            return Decimal('0.0000')
-
-        # Доход начисляется, пока есть вода (ручной полив или автополив)
-        water_expiry = self.last_watered + timezone.timedelta(hours=self.WATER_DURATION) if self.last_watered else now
-        # Если автополив действует — учитываем его окончание
-        accrue_until = min(now,
-                           self.auto_water_until) if self.auto_water_until and self.auto_water_until > now else min(now,
-                                                                                                                    water_expiry)
-        seconds_since = (accrue_until - last_accrued).total_seconds()
-        hours = max(0, min(seconds_since / 3600, self.WATER_DURATION))
-
-        # CF-дерево
-        if self.type == "CF":
-            income_per_hour = self.get_income_per_hour()
-            pending_income = income_per_hour * Decimal(hours)
-        # TON-дерево
-        elif self.type == "TON":
-            mult = Decimal("2") if self.is_fertilized() else Decimal("1")
-            ton_per_hour = Decimal(self.level) * Decimal("0.01") * mult
-            pending_income = ton_per_hour * Decimal(f"{hours:.10f}")
-
-        else:
-            pending_income = Decimal('0.0000')
+        if distribution is income.UNSET:
+            distribution = get_active_distribution() if self.type == "TON" else None
+        return income.pending_income(self, now or timezone.now(), distribution)
 
-        # Если нет активной раздачи — ничего не накапливаем!
-        if self.type == "TON":
-            from .models import TonDistribution
-            active_dist = TonDistribution.objects.filter(is_active=True).last()
-            if not active_dist:
-                pending_income = Decimal('0.0000')
-            else:
-                # Нельзя собрать больше, чем осталось в пуле
-                pending_income = min(pending_income, active_dist.left_to_distribute)
-        return pending_income.quantize(Decimal('0.0000'))
-
-    def get_water_percent(self):
+    def get_water_percent(self, now=None):
         """
         Возвращает текущий процент воды (100% сразу после полива, линейно уменьшается до 0% за WATER_DURATION часов).
         """
-        if not self.last_watered:
-            return 0
-        now = timezone.now()
-        time_delta = now - self.last_watered
-        hours_passed = min(time_delta.total_seconds() / 3600, self.WATER_DURATION)
-        percent = max(0, 100 - int((hours_passed / self.WATER_DURATION) * 100))
-        return percent
+        return income.water_percent(self, now or timezone.now())
 
     def apply_shop_item(self, shop_item):
         now = timezone.now()
@@ -160,17 +139,17 @@ class Tree(models.Model):
 
         return "Неизвестный предмет"
 
-    def water(self):
-        now = timezone.now()
+    def water(self, now=None, distribution=income.UNSET):
+        now = now or timezone.now()
         amount_cf = Decimal('0')
         amount_ton = Decimal('0')
         user = self.user
+        if distribution is income.UNSET:
+            distribution = get_active_distribution() if self.type == "TON" else None
 
         # ✅ TON: запрещаем полив без активного пула
         if self.type == "TON":
-            from .models import TonDistribution
-            dist = TonDistribution.objects.filter(is_active=True).last()
-            if not dist or dist.left_to_distribute <= 0:
+            if not distribution or distribution.left_to_distribute <= 0:
                 return {
                     "ok": False,
                     "message": "⛔ Раздача TON сейчас не активна или пул закончился.",
@@ -179,23 +158,21 @@ class Tree(models.Model):
                     "amount_ton": 0.0,
                     "branches_collected": self.branches_collected,
                     "last_watered": self.last_watered.strftime("%d.%m.%Y %H:%M") if self.last_watered else "Никогда",
-                    "pending_income": float(self.get_pending_income()),
-                    "water_percent": self.get_water_percent(),
+                    "pending_income": float(income.pending_income(self, now, distribution)),
+                    "water_percent": income.water_percent(self, now),
                 }
 
         # ✅ CF: при поливе можно сразу начислить накопленное (как у тебя было)
         if self.type == "CF":
-            amount_cf = self.get_pending_income()
-            if amount_cf > 0:
-                user.cf_balance += amount_cf
-                user.save(update_fields=["cf_balance"])
+            amount_cf = max(income.pending_income(self, now, distribution), Decimal('0'))
 
         # 🌿 ветки (если хочешь — оставь только для CF)
         branch_dropped = False
         if self.type == "CF" and random.random() < self.BRANCH_DROP_CHANCE:
             branch_dropped = True
-            user.branches_balance += 1
-            user.save(update_fields=["branches_balance"])
+
+        # Доход и ветка — одним начислением (см. users.balances)
+        credit(user, cf=amount_cf, branches=int(branch_dropped))
 
         # обновляем воду
         self.last_watered = now
@@ -210,13 +187,15 @@ class Tree(models.Model):
             "amount_ton": float(amount_ton),  # тут всегда 0, TON выдаётся через collect
             "branches_collected": self.branches_collected,
             "last_watered": now.strftime("%d.%m.%Y %H:%M"),
-            "pending_income": float(self.get_pending_income()),
-            "water_percent": self.get_water_percent(),
+            "pending_income": float(income.pending_income(self, now, distribution)),
+            "water_percent": income.water_percent(self, now),
         }
 
 
 class TonDistribution(models.Model):
     total_amount = models.DecimalField(max_digits=20, decimal_places=8,verbose_name="Всего TON")
+    # Пока раздача активна, фактический остаток хранится в слотах (TonDistributionSlot);
+    # поле синхронизируется при завершении раздачи.
     distributed_amount = models.DecimalField(max_digits=20, decimal_places=8, default=0,verbose_name="Распределено TON")
     is_active = models.BooleanField(default=True,verbose_name="Активна")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -225,35 +204,136 @@ class TonDistribution(models.Model):
         verbose_name = "Раздача TON"
         verbose_name_plural = "Раздачи TON"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            self.create_slots()
+
+    def create_slots(self, count=None):
+        """Делит бюджет пула на N слотов, которые списываются независимо друг от друга."""
+        from django.conf import settings
+        count = count or getattr(settings, "TON_DISTRIBUTION_SLOTS", 16)
+        left = self.total_amount - self.distributed_amount
+        share = (left / count).quantize(TON_QUANT, rounding=ROUND_DOWN)
+        budgets = [share] * (count - 1) + [left - share * (count - 1)]
+        TonDistributionSlot.objects.bulk_create([
+            TonDistributionSlot(distribution=self, index=i, budget=b, remaining=b)
+            for i, b in enumerate(budgets)
+        ])
+        self.__dict__.pop("_left_to_distribute", None)
+
     @property
     def left_to_distribute(self):
-        return self.total_amount - self.distributed_amount
+        # Считается один раз на экземпляр (снимок из trees.distribution кэшируется вместе с ним)
+        if "_left_to_distribute" not in self.__dict__:
+            left = self.slots.aggregate(total=models.Sum("remaining"))["total"] if self.pk else None
+            if left is None:
+                left = self.total_amount - self.distributed_amount
+            # SUM по decimal в SQLite возвращает float-погрешность
+            self.__dict__["_left_to_distribute"] = Decimal(left).quantize(TON_QUANT)
+        return self.__dict__["_left_to_distribute"]
+
+    def draw(self, amount):
+        """
+        Списывает из пула до amount TON условными UPDATE по слотам и возвращает списанное.
+        Слот уменьшается только если в нём достаточно остатка, поэтому раздать больше
+        total_amount невозможно, а параллельные сборы обычно попадают в разные строки.
+        """
+        amount = Decimal(amount).quantize(TON_QUANT, rounding=ROUND_DOWN)
+        if amount <= 0 or not self.is_active:
+            return Decimal("0")
+
+        slots = list(self.slots.filter(remaining__gt=0).values_list("pk", flat=True))
+        random.shuffle(slots)
+        for pk in slots:
+            if TonDistributionSlot.objects.filter(pk=pk, remaining__gte=amount).update(
+                remaining=models.F("remaining") - amount
+            ):
+                self.__dict__.pop("_left_to_distribute", None)
+                return amount
+
+        # Ни в одном слоте нет полной суммы — собираем остатки
+        drawn = Decimal("0")
+        for pk in slots:
+            remaining = TonDistributionSlot.objects.filter(pk=pk).values_list("remaining", flat=True).first()
+            take = min(amount - drawn, remaining or Decimal("0"))
+            if take > 0 and TonDistributionSlot.objects.filter(pk=pk, remaining__gte=take).update(
+                remaining=models.F("remaining") - take
+            ):
+                drawn += take
+            if drawn >= amount:
+                break
+
+        self.__dict__.pop("_left_to_distribute", None)
+        if drawn < amount:
+            self.close_if_exhausted()
+        return drawn
+
+    def close_if_exhausted(self):
+        if self.left_to_distribute > 0:
+            return False
+        TonDistribution.objects.filter(pk=self.pk, is_active=True).update(
+            is_active=False, distributed_amount=self.total_amount
+        )
+        self.is_active = False
+        self.distributed_amount = self.total_amount
+        invalidate_active_distribution()
+        return True
 
     def accrue(self, user, tree):
         if not self.is_active:
             return Decimal('0')
         mult = Decimal("2") if tree.is_fertilized() else Decimal("1")
         max_per_water = (Decimal(tree.level) * Decimal("0.01") * Decimal(tree.WATER_DURATION) * mult)
-        left = self.left_to_distribute
-        amount = min(max_per_water, left)
+        with transaction.atomic():
+            amount = self.draw(max_per_water)
+            if amount > 0:
+                TelegramUser.objects.filter(pk=user.pk).update(ton_balance=models.F("ton_balance") + amount)
+                user.ton_balance += amount
         if amount > 0:
-            user.ton_balance += amount
-            user.save(update_fields=["ton_balance"])
-            self.distributed_amount += amount
-            self.save(update_fields=["distributed_amount"])
-            if self.distributed_amount >= self.total_amount:
-                self.is_active = False
-                self.save(update_fields=["is_active"])
+            invalidate_active_distribution()
         return amount
 
+    def finish(self):
+        """Завершает раздачу досрочно."""
+        self.__dict__.pop("_left_to_distribute", None)
+        self.is_active = False
+        self.distributed_amount = self.total_amount - self.left_to_distribute
+        self.save(update_fields=["is_active", "distributed_amount"])
+        invalidate_active_distribution()
+
     def __str__(self):
         return f"TON раздача #{self.id} — {self.total_amount} TON ({'активна' if self.is_active else 'завершена'})"
 
 
+class TonDistributionSlot(models.Model):
+    """Шард бюджета раздачи TON — снимает конкуренцию за одну строку при сборе."""
+    distribution = models.ForeignKey(TonDistribution, on_delete=models.CASCADE, related_name="slots")
+    index = models.PositiveSmallIntegerField()
+    budget = models.DecimalField(max_digits=20, decimal_places=8)
+    remaining = models.DecimalField(max_digits=20, decimal_places=8)
+
+    class Meta:
+        verbose_name = "Слот раздачи TON"
+        verbose_name_plural = "Слоты раздачи TON"
+        unique_together = ["distribution", "index"]
+
+    def __str__(self):
+        return f"#{self.distribution_id}/{self.index}: {self.remaining} из {self.budget}"
+
+
 class BurnedToken(models.Model):
     amount = models.DecimalField(max_digits=20, decimal_places=2)
     date = models.DateTimeField(auto_now_add=True)
     admin = models.ForeignKey('users.User', null=True, blank=True, on_delete=models.SET_NULL)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            from users.supply import add_cf_burned
+            add_cf_burned(self.amount)
+
     def __str__(self):
         return f"Burned {self.amount} FL ({self.date:%Y-%m-%d %H:%M})"
@@ -0,0 +1,79 @@
+# trees/participants.py
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import SupplyCounter, User
+from users.supply import TON_PARTICIPANTS, add
+
+CACHE_KEY = "trees:ton_participants"
+
+
+def _cache_ttl():
+    return getattr(settings, "TON_PARTICIPANTS_CACHE_TTL", 300)
+
+
+def count_ton_participants():
+    """Точный подсчёт по таблице деревьев (JOIN + DISTINCT) — только для пересчёта."""
+    from .models import Tree
+    return Tree.objects.filter(type="TON").values("user_id").distinct().count()
+
+
+def get_ton_participants_count():
+    """Число участников TON-раздачи из материализованного счётчика, с кэшем."""
+    count = cache.get(CACHE_KEY)
+    if count is None:
+        value = SupplyCounter.objects.filter(name=TON_PARTICIPANTS).values_list("value", flat=True).first()
+        count = int(value or 0)
+        cache.set(CACHE_KEY, count, _cache_ttl())
+    return count
+
+
+def invalidate_ton_participants():
+    cache.delete(CACHE_KEY)
+
+
+def lock_ton_owner(user_id):
+    """
+    Блокирует строку пользователя до конца транзакции и сообщает, есть ли у него
+    уже TON-деревья. Вызывать в transaction.atomic до вставки нового TON-дерева:
+    параллельные покупки одного пользователя проходят проверку по очереди, и первое
+    дерево засчитывается ровно один раз.
+    """
+    from .models import Tree
+    User.objects.select_for_update().filter(pk=user_id).values_list("pk", flat=True).first()
+    return Tree.objects.filter(user_id=user_id, type="TON").exists()
+
+
+def on_ton_tree_created(had_ton_trees):
+    """+1 участник, если это первое TON-дерево пользователя (см. lock_ton_owner)."""
+    if not had_ton_trees:
+        add(TON_PARTICIPANTS, 1)
+        invalidate_ton_participants()
+
+
+def schedule_recount():
+    """
+    Пересчёт после коммита, один на транзакцию: каскадное удаление пользователя
+    с сотней TON-деревьев вызывает post_delete на каждое, а считать нужно один раз.
+    """
+    connection = transaction.get_connection()
+    if any(func is _recount_on_commit for _sids, func, _robust in connection.run_on_commit):
+        return
+    transaction.on_commit(_recount_on_commit)
+
+
+def _recount_on_commit():
+    recount_ton_participants()
+
+
+def recount_ton_participants():
+    """
+    Перезаписывает счётчик точным значением. Используется при удалении деревьев
+    (в том числе каскадном) и смене типа дерева — это редкие операции.
+    """
+    count = count_ton_participants()
+    SupplyCounter.objects.update_or_create(name=TON_PARTICIPANTS, defaults={"value": count})
+    invalidate_ton_participants()
+    return count
@@ -0,0 +1,169 @@
+# trees/reminders.py
+"""
+Асинхронная рассылка напоминаний о поливе через Bot API.
+
+Один пул соединений httpx, ограничение параллельности семафором и token bucket
+под лимиты Telegram: ~30 сообщений/с глобально и не чаще 1 сообщения/с в один чат.
+На 429 ставим на паузу общий token bucket на retry_after из ответа — ждут все
+отправители, а не только получивший ответ, — и повторяем.
+"""
+
+import asyncio
+import json
+import time
+
+import httpx
+
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+GLOBAL_RATE = 30      # сообщений в секунду на бота
+PER_CHAT_INTERVAL = 1.0  # секунд между сообщениями в один чат
+MAX_ATTEMPTS = 3
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Не выдавать токены seconds секунд (429 от Telegram) и начать копить их заново."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    self.updated = time.monotonic()
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatThrottle:
+    """Не чаще одного сообщения в PER_CHAT_INTERVAL для каждого чата."""
+
+    def __init__(self, interval=PER_CHAT_INTERVAL):
+        self.interval = interval
+        self.next_allowed = {}
+
+    async def wait(self, chat_id):
+        now = time.monotonic()
+        at = max(now, self.next_allowed.get(chat_id, now))
+        self.next_allowed[chat_id] = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+class ReminderSender:
+    def __init__(self, token, base_url=TELEGRAM_API_URL, concurrency=20, rate=GLOBAL_RATE,
+                 chat_interval=PER_CHAT_INTERVAL, timeout=10):
+        self.url = f"{base_url.rstrip('/')}/bot{token}/sendMessage"
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatThrottle(chat_interval)
+        self.timeout = timeout
+        self.retries = 0
+
+    async def _send_one(self, client, semaphore, chat_id, text):
+        for _attempt in range(MAX_ATTEMPTS):
+            await self.chats.wait(chat_id)
+            await self.bucket.acquire()
+            async with semaphore:
+                try:
+                    resp = await client.post(self.url, json={"chat_id": chat_id, "text": text})
+                except httpx.HTTPError:
+                    return False
+            if resp.status_code == 200:
+                return True
+            if resp.status_code == 429:
+                self.retries += 1
+                try:
+                    retry_after = resp.json().get("parameters", {}).get("retry_after", 1)
+                except ValueError:
+                    retry_after = 1
+                self.bucket.pause(retry_after)
+                continue
+            # 400/403: чат недоступен или бот заблокирован — повторять бессмысленно
+            return False
+        return False
+
+    async def send(self, messages):
+        """
+        messages — список (key, chat_id, text). Возвращает список key успешно отправленных.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            results = await asyncio.gather(*(
+                self._send_one(client, semaphore, chat_id, text) for _key, chat_id, text in messages
+            ))
+        return [key for (key, _chat_id, _text), ok in zip(messages, results) if ok]
+
+
+class FakeTelegramServer:
+    """
+    Локальная заглушка Bot API для --dry-run: отвечает {"ok": true} на любой POST,
+    а каждый rate_limit_every-й запрос — 429 с retry_after, как настоящий Telegram.
+    """
+
+    def __init__(self, rate_limit_every=0, retry_after=1):
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.server = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+
+                self.requests += 1
+                if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                    status = "429 Too Many Requests"
+                    body = {"ok": False, "error_code": 429, "parameters": {"retry_after": self.retry_after}}
+                else:
+                    status = "200 OK"
+                    body = {"ok": True, "result": {}}
+                payload = json.dumps(body).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,14 @@
+# trees/signals.py
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Tree
+from .participants import schedule_recount
+
+
+@receiver(post_delete, sender=Tree)
+def ton_tree_deleted(sender, instance, **kwargs):
+    # Срабатывает и при каскадном удалении вместе с пользователем
+    if instance.type == "TON":
+        schedule_recount()
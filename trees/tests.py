@@ -1,3 +1,425 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db import close_old_connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User
+from . import bulk
+from .distribution import get_active_distribution, invalidate_active_distribution
+from .income import tree_state, tree_states
+from .models import Tree, TonDistribution
+from .participants import count_ton_participants, get_ton_participants_count
+from .reminders import MAX_ATTEMPTS, FakeTelegramServer, ReminderSender, TokenBucket
+
+
+class TreeTestMixin:
+    def setUp(self):
+        cache.clear()
+
+    def make_user(self, telegram_id=1001, **kwargs):
+        return User.objects.create(telegram_id=telegram_id, first_name="Test", **kwargs)
+
+    def login(self, user):
+        session = self.client.session
+        session["telegram_id"] = user.telegram_id
+        session.save()
+
+
+class TreeStatesTest(TreeTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.now = timezone.now()
+
+    def test_batch_matches_single_tree_methods(self):
+        TonDistribution.objects.create(total_amount=Decimal("100"))
+        cf = Tree.objects.create(user=self.user, type="CF", last_watered=self.now - timedelta(hours=2))
+        ton = Tree.objects.create(user=self.user, type="TON", level=3, last_watered=self.now - timedelta(hours=1),
+                                  fertilized_until=self.now + timedelta(hours=1))
+
+        states = tree_states([cf, ton], now=self.now)
+
+        for tree in (cf, ton):
+            self.assertEqual(states[tree.id]["pending_income"], tree.get_pending_income(now=self.now))
+            self.assertEqual(states[tree.id]["water_percent"], tree.get_water_percent(now=self.now))
+            self.assertEqual(states[tree.id]["is_watered"], tree.is_watered(now=self.now))
+        self.assertEqual(states[ton.id]["pending_income"], Decimal("0.0600"))
+        self.assertTrue(states[ton.id]["is_fertilized"])
+
+    def test_ton_without_distribution_accrues_nothing(self):
+        ton = Tree.objects.create(user=self.user, type="TON", last_watered=self.now - timedelta(hours=1))
+        self.assertEqual(tree_states([ton], now=self.now)[ton.id]["pending_income"], Decimal("0.0000"))
+
+    def test_distribution_loaded_once(self):
+        TonDistribution.objects.create(total_amount=Decimal("100"))
+        trees = [
+            Tree.objects.create(user=self.user, type="TON", last_watered=self.now - timedelta(hours=1))
+            for _ in range(5)
+        ]
+        with self.assertNumQueries(1):
+            tree_states(trees, now=self.now)
+
+
+class HomeQueriesTest(TreeTestMixin, TestCase):
+    def query_count(self, user):
+        self.login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_home_query_count_does_not_grow_with_trees(self):
+        TonDistribution.objects.create(total_amount=Decimal("100"))
+        one = self.make_user(telegram_id=1)
+        Tree.objects.create(user=one, type="CF")
+        many = self.make_user(telegram_id=2)
+        for _ in range(6):
+            Tree.objects.create(user=many, type="CF", last_watered=timezone.now())
+        Tree.objects.create(user=many, type="TON", last_watered=timezone.now())
+        get_active_distribution()
+        get_ton_participants_count()
+
+        self.assertEqual(self.query_count(one), self.query_count(many))
+
+
+class DistributionSnapshotTest(TreeTestMixin, TestCase):
+    def test_snapshot_is_cached_until_invalidated(self):
+        dist = TonDistribution.objects.create(total_amount=Decimal("10"))
+        self.assertEqual(get_active_distribution().pk, dist.pk)
+
+        with self.assertNumQueries(0):
+            get_active_distribution()
+
+        dist.finish()
+        self.assertIsNone(get_active_distribution())
+
+        TonDistribution.objects.create(total_amount=Decimal("5"))
+        self.assertIsNone(get_active_distribution())
+        invalidate_active_distribution()
+        self.assertEqual(get_active_distribution().total_amount, Decimal("5"))
+
+    def test_collect_income_updates_pool_and_invalidates(self):
+        dist = TonDistribution.objects.create(total_amount=Decimal("1"))
+        user = self.make_user()
+        tree = Tree.objects.create(user=user, type="TON", last_watered=timezone.now() - timedelta(hours=2))
+        self.login(user)
+        get_active_distribution()
+
+        response = self.client.post(reverse("collect_income", args=[tree.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TonDistribution.objects.get(pk=dist.pk).left_to_distribute, Decimal("0.98"))
+        self.assertEqual(get_active_distribution().left_to_distribute, Decimal("0.98"))
+        user.refresh_from_db()
+        self.assertEqual(user.ton_balance, Decimal("0.02"))
+
+
+class TonParticipantsTest(TreeTestMixin, TestCase):
+    def test_counter_follows_purchases_and_cascade(self):
+        first = self.make_user(telegram_id=1)
+        second = self.make_user(telegram_id=2)
+        self.assertEqual(get_ton_participants_count(), 0)
+
+        Tree.objects.create(user=first, type="TON")
+        Tree.objects.create(user=first, type="TON")
+        Tree.objects.create(user=second, type="TON")
+        Tree.objects.create(user=second, type="CF")
+        self.assertEqual(get_ton_participants_count(), 2)
+        self.assertEqual(count_ton_participants(), 2)
+
+        with self.assertNumQueries(0):
+            get_ton_participants_count()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(get_ton_participants_count(), 1)
+
+    def test_cascade_delete_recounts_once(self):
+        user = self.make_user()
+        for _ in range(20):
+            Tree.objects.create(user=user, type="TON")
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.delete()
+        self.assertEqual(len(callbacks), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            callbacks[0]()
+        self.assertEqual(len([q for q in ctx.captured_queries if "trees_tree" in q["sql"]]), 1)
+        self.assertEqual(get_ton_participants_count(), 0)
+
+    def test_buy_ton_tree_counts_participant(self):
+        user = self.make_user(ton_balance=Decimal("10"))
+        self.login(user)
+        self.client.get(reverse("shop:buy_ton_tree"))
+        self.assertEqual(get_ton_participants_count(), 1)
+
+
+class ConcurrentTonParticipantsTest(TreeTestMixin, TransactionTestCase):
+    THREADS = 8
+
+    def test_parallel_first_trees_count_once(self):
+        user = self.make_user()
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def run():
+            try:
+                barrier.wait()
+                Tree.objects.create(user=user, type="TON")
+            except Exception as e:  # noqa: BLE001 — любая ошибка валит тест
+                errors.append(e)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Tree.objects.filter(user=user).count(), self.THREADS)
+        self.assertEqual(get_ton_participants_count(), 1)
+
+
+class ConcurrentCollectAllTest(TreeTestMixin, TransactionTestCase):
+    THREADS = 2
+
+    def test_double_collect_credits_once(self):
+        user = self.make_user()
+        now = timezone.now()
+        dist = TonDistribution.objects.create(total_amount=Decimal("10"))
+        for tree_type in ("CF", "CF", "TON"):
+            Tree.objects.create(user=user, type=tree_type, last_watered=now - timedelta(hours=1),
+                                last_cf_accrued=now - timedelta(hours=2))
+        trees = list(Tree.objects.filter(user=user).order_by("id"))
+        expected = {
+            tree_type: sum(
+                (tree_state(t, now, dist)["pending_income"] for t in trees if t.type == tree_type), Decimal("0")
+            )
+            for tree_type in ("CF", "TON")
+        }
+        barrier = threading.Barrier(self.THREADS)
+        results, errors = [], []
+
+        def run():
+            # Каждый поток — «вкладка» со своей (одинаково устаревшей) копией деревьев
+            stale = [Tree.objects.get(pk=t.pk) for t in trees]
+            try:
+                barrier.wait()
+                results.append(bulk.collect_all(User.objects.get(pk=user.pk), stale, now,
+                                                TonDistribution.objects.get(pk=dist.pk)))
+            except Exception as e:  # noqa: BLE001 — любая ошибка валит тест
+                errors.append(e)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(r["collected_count"] for r in results), [0, 3])
+        user.refresh_from_db()
+        self.assertEqual(user.cf_balance, expected["CF"].quantize(Decimal("0.01")))
+        self.assertEqual(user.ton_balance, expected["TON"])
+        self.assertEqual(TonDistribution.objects.get(pk=dist.pk).left_to_distribute,
+                         Decimal("10") - expected["TON"])
+
+
+class ShardedPoolTest(TreeTestMixin, TestCase):
+    def test_budget_is_split_into_slots(self):
+        dist = TonDistribution.objects.create(total_amount=Decimal("1"))
+        self.assertEqual(dist.slots.count(), 16)
+        self.assertEqual(sum(s.remaining for s in dist.slots.all()), Decimal("1"))
+        self.assertEqual(dist.left_to_distribute, Decimal("1"))
+
+    def test_draws_never_exceed_total_and_close_pool(self):
+        dist = TonDistribution.objects.create(total_amount=Decimal("0.1"))
+        drawn = [dist.draw(Decimal("0.03")) for _ in range(5)]
+
+        self.assertEqual(sum(drawn), Decimal("0.1"))
+        self.assertEqual(drawn[-1], Decimal("0"))
+        dist.refresh_from_db()
+        self.assertFalse(dist.is_active)
+        self.assertEqual(dist.distributed_amount, Decimal("0.1"))
+
+    def test_finish_records_distributed_amount(self):
+        dist = TonDistribution.objects.create(total_amount=Decimal("2"))
+        dist.draw(Decimal("0.5"))
+        dist.finish()
+        dist.refresh_from_db()
+        self.assertFalse(dist.is_active)
+        self.assertEqual(dist.distributed_amount, Decimal("0.5"))
+
+
+class BulkEndpointsTest(TreeTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.login(self.user)
+        now = timezone.now()
+        self.dry = [
+            Tree.objects.create(user=self.user, type="CF", last_watered=now - timedelta(hours=6))
+            for _ in range(3)
+        ]
+        self.wet = Tree.objects.create(user=self.user, type="CF", last_watered=now - timedelta(hours=1))
+
+    def test_water_all_waters_only_dry_trees(self):
+        response = self.client.post(reverse("water_all"))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        statuses = {t["id"]: t["status"] for t in data["trees"]}
+        self.assertEqual(statuses[self.wet.id], "skipped")
+        self.assertTrue(all(statuses[t.id] == "watered" for t in self.dry))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.cf_balance, Decimal("15.00"))
+        for tree in self.dry:
+            tree.refresh_from_db()
+            self.assertTrue(tree.is_watered())
+
+    def test_collect_all_credits_cf_and_ton_once(self):
+        TonDistribution.objects.create(total_amount=Decimal("10"))
+        Tree.objects.create(user=self.user, type="TON", last_watered=timezone.now() - timedelta(hours=2))
+
+        response = self.client.post(reverse("collect_all"))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["collected_ton"], 0.02)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.cf_balance, Decimal(str(data["collected_cf"])).quantize(Decimal("0.01")))
+        self.assertEqual(self.user.ton_balance, Decimal("0.02"))
+        self.assertEqual(self.client.post(reverse("collect_all")).status_code, 400)
+
+    def test_home_uses_bulk_endpoints_and_state_json(self):
+        response = self.client.get(reverse("home"))
+
+        self.assertContains(response, 'data-bulk="water"')
+        self.assertContains(response, 'data-bulk="collect"')
+        self.assertContains(response, f'data-tree-pending="{self.dry[0].id}"')
+        self.assertContains(response, "js/trees.js")
+
+
+class WaterScheduleTest(TreeTestMixin, TestCase):
+    def test_schedule_follows_watering_auto_water_and_reminders(self):
+        user = self.make_user()
+        now = timezone.now()
+        tree = Tree.objects.create(user=user, type="CF")
+        self.assertIsNone(tree.next_reminder_at)
+
+        tree.water(now=now - timedelta(hours=6))
+        tree.refresh_from_db()
+        self.assertEqual(tree.water_expires_at, now - timedelta(hours=1))
+        self.assertTrue(Tree.objects.filter(pk=tree.pk, next_reminder_at__lte=now).exists())
+
+        tree.auto_water_until = now + timedelta(hours=24)
+        tree.save(update_fields=["auto_water_until"])
+        tree.refresh_from_db()
+        self.assertEqual(tree.next_reminder_at, now + timedelta(hours=24))
+
+        tree.water_reminder_sent_at = now
+        tree.save(update_fields=["water_reminder_sent_at"])
+        tree.refresh_from_db()
+        self.assertIsNone(tree.next_reminder_at)
+        self.assertEqual(tree.water_expires_at, now + timedelta(hours=24))
+
+
+class ReminderSenderTest(TreeTestMixin, TestCase):
+    def test_sender_retries_after_429(self):
+        async def run():
+            async with FakeTelegramServer(rate_limit_every=3, retry_after=0) as fake:
+                sender = ReminderSender("t", base_url=fake.base_url, rate=1000, chat_interval=0)
+                ok = await sender.send([(i, 100 + i, "hi") for i in range(6)])
+                return ok, sender.retries, fake.requests
+
+        ok, retries, requests = asyncio.run(run())
+        self.assertEqual(sorted(ok), list(range(6)))
+        self.assertGreater(retries, 0)
+        self.assertEqual(requests, 6 + retries)
+
+    def test_429_pauses_shared_bucket(self):
+        async def run():
+            async with FakeTelegramServer(rate_limit_every=1, retry_after=5) as fake:
+                sender = ReminderSender("t", base_url=fake.base_url, rate=1000, chat_interval=0)
+                sender.bucket.pause = lambda seconds: pauses.append(seconds)
+                ok = await sender.send([(1, 101, "hi")])
+                return ok, fake.requests
+
+        pauses = []
+        self.assertEqual(asyncio.run(run()), ([], MAX_ATTEMPTS))
+        self.assertEqual(pauses, [5] * MAX_ATTEMPTS)
+
+    def test_paused_bucket_blocks_acquire(self):
+        async def run():
+            bucket = TokenBucket(1000)
+            bucket.pause(0.2)
+            started = time.monotonic()
+            await asyncio.gather(bucket.acquire(), bucket.acquire())
+            return time.monotonic() - started
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.2)
+
+    def test_command_marks_sent_trees_in_bulk(self):
+        now = timezone.now()
+        trees = []
+        for i in range(3):
+            tree = Tree.objects.create(user=self.make_user(telegram_id=2000 + i), type="CF")
+            tree.water(now=now - timedelta(hours=6))
+            trees.append(tree)
+
+        # --dry-run ничего не отмечает
+        out = StringIO()
+        call_command("notify_water_due", "--dry-run", stdout=out)
+        self.assertIn("Sent reminders: 3/3", out.getvalue())
+        self.assertEqual(Tree.objects.filter(next_reminder_at__isnull=False).count(), 3)
+
+        async def fake_send(sender, messages):
+            return [key for key, _chat_id, _text in messages]
+
+        with mock.patch.dict("os.environ", {"BOT_TOKEN": "t"}), \
+                mock.patch.object(ReminderSender, "send", fake_send):
+            call_command("notify_water_due", stdout=StringIO())
+        self.assertFalse(Tree.objects.filter(next_reminder_at__isnull=False).exists())
+        self.assertEqual(Tree.objects.filter(water_reminder_sent_at__isnull=False).count(), 3)
+
+
+class TreeStateJsonTest(TreeTestMixin, TestCase):
+    def test_etag_and_not_modified(self):
+        user = self.make_user()
+        tree = Tree.objects.create(user=user, type="CF")
+        self.login(user)
+        url = reverse("tree_state_json")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(response.json()["trees"][0]["id"], tree.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Для 304 деревья не загружаются — только агрегат для ETag
+        self.assertEqual(sum("trees_tree" in q["sql"] for q in ctx.captured_queries), 1)
+
+        self.client.post(reverse("water_all"))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertIsNotNone(response.json()["trees"][0]["last_watered"])
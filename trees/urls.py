@@ -5,6 +5,9 @@ from .views import stats_by_watering_json
 urlpatterns = [
     path('', views.home, name='home'),
     path('tree/<int:tree_id>/', views.tree_detail, name='tree_detail'),
+    path('tree/state.json', views.tree_state_json, name='tree_state_json'),
+    path('tree/water_all/', views.water_all, name='water_all'),
+    path('tree/collect_all/', views.collect_all, name='collect_all'),
     path('tree/<int:tree_id>/water/', views.water_tree, name='water_tree'),
     path('tree/<int:tree_id>/upgrade/', views.upgrade_tree, name='upgrade_tree'),
 path('tree/<int:tree_id>/collect_income/', views.collect_income, name='collect_income'),
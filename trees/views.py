@@ -1,21 +1,29 @@
 # trees/views.py
+import hashlib
 from datetime import timedelta
 from decimal import Decimal
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, Max, Q
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_GET
+from django.views.decorators.http import condition, require_GET, require_POST
 
 from shop.models import ShopItem, Purchase
 from users import models
-from .models import Tree, TonDistribution, BurnedToken
+from .models import Tree, TonDistribution
 from users.models import User as TelegramUser, User
+from users.balances import credit
+from users.supply import get_cf_supply
 from .utils import apply_item_to_tree, use_purchase_for_cf_tree
+from .distribution import get_active_distribution, invalidate_active_distribution
+from . import bulk
+from .income import state_vector, tree_states
+from .participants import get_ton_participants_count
 from django.utils.translation import gettext as _
 
 
@@ -30,6 +38,10 @@ def get_current_user(request):
     tg_id = request.session.get("telegram_id")
     if not tg_id:
         return None
+    # TelegramAuthMiddleware уже загрузил пользователя (с учётом users.balances)
+    user = getattr(request, "user", None)
+    if isinstance(user, TelegramUser) and user.pk == tg_id:
+        return user
     try:
         return TelegramUser.objects.get(telegram_id=tg_id)
     except TelegramUser.DoesNotExist:
@@ -52,26 +64,24 @@ def fmt_amount(x, max_decimals=4):
 
 def home(request):
     user = get_current_user(request)
-    TOTAL_CREATED_CF = 25000000
-    all_cf_grown = User.objects.aggregate(total=Sum('cf_balance'))['total'] or 0
-    burned = BurnedToken.objects.aggregate(total=Sum('amount'))['total'] or 0
-
-    cf_left = TOTAL_CREATED_CF - all_cf_grown - burned
+    supply = get_cf_supply()
+    TOTAL_CREATED_CF = supply["total_created"]
+    all_cf_grown = supply["grown"]
+    burned = supply["burned"]
+    cf_left = supply["left"]
 
     if not user:
         return render(request, "not_authenticated.html")
 
-    cf_trees = Tree.objects.filter(user=user, type="CF")
-    if not cf_trees.exists():
-        Tree.objects.create(user=user, type="CF")
-        cf_trees = Tree.objects.filter(user=user, type="CF")
+    trees = list(Tree.objects.filter(user=user, type__in=["CF", "TON"]))
+    if not any(tree.type == "CF" for tree in trees):
+        trees.append(Tree.objects.create(user=user, type="CF"))
 
-    ton_trees = Tree.objects.filter(user=user, type="TON")
+    now = timezone.now()
+    active_distribution = get_active_distribution(request)
+    states = tree_states(trees, now=now, distribution=active_distribution)
 
-    active_distribution = TonDistribution.objects.filter(is_active=True).last()
-    participants_count = (
-        TelegramUser.objects.filter(trees__type="TON").distinct().count()
-    ) or 0
+    participants_count = get_ton_participants_count()
 
     ton_per_water = None
     ton_left = None
@@ -80,35 +90,31 @@ def home(request):
         ton_left = active_distribution.left_to_distribute
 
     cf_tree_infos = []
-    for tree in cf_trees:
-        cf_tree_infos.append({
-            "id": tree.id,
-            "level": tree.level,
-            "income_per_hour": float(tree.income_per_hour),
-            "branches_collected": tree.branches_collected,
-            "last_watered": tree.last_watered,
-            "water_percent": tree.get_water_percent(),
-            "pending_income": float(tree.get_pending_income()),
-            "is_watered": tree.is_watered(),
-            "is_fertilized": bool(tree.fertilized_until and tree.fertilized_until > timezone.now()),
-            "is_auto_watered": bool(tree.auto_water_until and tree.auto_water_until > timezone.now()),
-        })
-
     ton_tree_infos = []
-    for tree in ton_trees:
-        is_fertilized = bool(tree.fertilized_until and tree.fertilized_until > timezone.now())
-
-        base_per_hour = Decimal(tree.level) * Decimal("0.01")  # 0.01..0.05 TON/час
-        ton_per_hour = base_per_hour * (Decimal("2") if is_fertilized else Decimal("1"))
-
-        ton_tree_infos.append({
-            "id": tree.id,
-            "level": tree.level,
-            "pending_income": float(tree.get_pending_income()),
-            "is_fertilized": is_fertilized,
-            "is_auto_watered": bool(tree.auto_water_until and tree.auto_water_until > timezone.now()),
-            "ton_per_hour": float(ton_per_hour),  # ✅ показываем TON/час
-        })
+    for tree in trees:
+        state = states[tree.id]
+        if tree.type == "CF":
+            cf_tree_infos.append({
+                "id": tree.id,
+                "level": tree.level,
+                "income_per_hour": float(tree.income_per_hour),
+                "branches_collected": tree.branches_collected,
+                "last_watered": tree.last_watered,
+                "water_percent": state["water_percent"],
+                "pending_income": float(state["pending_income"]),
+                "is_watered": state["is_watered"],
+                "is_fertilized": state["is_fertilized"],
+                "is_auto_watered": state["is_auto_watered"],
+            })
+        else:
+            ton_tree_infos.append({
+                "id": tree.id,
+                "level": tree.level,
+                "pending_income": float(state["pending_income"]),
+                "is_fertilized": state["is_fertilized"],
+                "is_auto_watered": state["is_auto_watered"],
+                "ton_per_hour": float(state["income_per_hour"]),  # ✅ показываем TON/час
+            })
 
     return render(request, "home.html", {
         "user": user,
@@ -134,13 +140,16 @@ def tree_detail(request, tree_id):
 
     tree = get_object_or_404(Tree, id=tree_id, user=user)
 
-    is_watered = tree.is_watered()
-    is_fertilized = bool(tree.fertilized_until and tree.fertilized_until > now)
-    is_auto_watered = bool(tree.auto_water_until and tree.auto_water_until > now)
+    active_dist = get_active_distribution(request) if tree.type == "TON" else None
+    state = tree_states([tree], now=now, distribution=active_dist)[tree.id]
+    is_watered = state["is_watered"]
+    is_fertilized = state["is_fertilized"]
+    is_auto_watered = state["is_auto_watered"]
     can_upgrade = tree.can_upgrade()
-    TOTAL_CREATED_CF = 25_000_000
-    all_cf_grown = User.objects.aggregate(total=Sum('cf_balance'))['total'] or 0
-    cf_left = TOTAL_CREATED_CF - all_cf_grown
+    supply = get_cf_supply()
+    TOTAL_CREATED_CF = supply["total_created"]
+    all_cf_grown = supply["grown"]
+    cf_left = supply["left"]
     last_watered = tree.last_watered
     water_cooldown = timedelta(hours=5)
     fertilizer_time_left = int((tree.fertilized_until - now).total_seconds()) if is_fertilized else 0
@@ -150,9 +159,9 @@ def tree_detail(request, tree_id):
     total_income = income_per_hour + income_bonus
 
     user_cf_grown = user.cf_balance if user else 0
-    auto_water_active = bool(tree.auto_water_until and tree.auto_water_until > now)
-    fertilizer_active = bool(tree.fertilized_until and tree.fertilized_until > now)
-    pending_income = float(tree.get_pending_income())
+    auto_water_active = is_auto_watered
+    fertilizer_active = is_fertilized
+    pending_income = float(state["pending_income"])
 
     autowater_purchases = Purchase.objects.filter(
         user=user,
@@ -180,7 +189,7 @@ def tree_detail(request, tree_id):
         "fertilizer_time_left": fertilizer_time_left,
         "auto_water_time_left": auto_water_time_left,
         "can_upgrade": can_upgrade,
-        "water_percent": tree.get_water_percent(),
+        "water_percent": state["water_percent"],
         "pending_income": pending_income,
         'total_created_cf': TOTAL_CREATED_CF,
         "cf_left": cf_left,
@@ -205,13 +214,10 @@ def tree_detail(request, tree_id):
 
     # Специфично для TON дерева — добавляем TON данные
     if tree.type == "TON":
-        active_dist = TonDistribution.objects.filter(is_active=True).last()
-        participants_count = TelegramUser.objects.filter(trees__type="TON").distinct().count() or 0
-
-        is_fertilized = bool(tree.fertilized_until and tree.fertilized_until > now)
+        participants_count = get_ton_participants_count()
 
         base_per_hour = Decimal(tree.level) * Decimal("0.01")
-        ton_per_hour = base_per_hour * (Decimal("2") if is_fertilized else Decimal("1"))
+        ton_per_hour = state["income_per_hour"]
 
         ton_left = active_dist.left_to_distribute if active_dist else Decimal("0")
         ton_was = active_dist.total_amount if active_dist else None
@@ -246,8 +252,9 @@ def water_tree(request, tree_id):
         return JsonResponse({"status": "error", "message": "Требуется метод POST"}, status=400)
 
     # ✅ ВАЖНО: TON дерево можно поливать только при активной раздаче
+    now = timezone.now()
+    active_dist = get_active_distribution(request) if tree.type == "TON" else None
     if tree.type == "TON":
-        active_dist = TonDistribution.objects.filter(is_active=True).last()
         if not active_dist:
             return JsonResponse({
                 "status": "error",
@@ -261,7 +268,7 @@ def water_tree(request, tree_id):
                 "message": _("⛔ Раздача TON завершена. Дождитесь следующей акции.")
             }, status=400)
 
-    result = tree.water()
+    result = tree.water(now=now, distribution=active_dist)
     if not result.get("ok", True):
         return JsonResponse({
             "status": "error",
@@ -284,8 +291,8 @@ def water_tree(request, tree_id):
         "branches_collected": tree.branches_collected,
         "amount_cf": float(result.get("amount_cf", 0)),
         "amount_ton": float(result.get("amount_ton", 0)),
-        "water_percent": tree.get_water_percent(),
-        "pending_income": float(tree.get_pending_income()),
+        "water_percent": result.get("water_percent", 0),
+        "pending_income": result.get("pending_income", 0),
         "last_watered": last_watered_str,
     }
     return JsonResponse(response_data)
@@ -332,37 +339,39 @@ def collect_income(request, tree_id):
 
 
     now = timezone.now()
-    pending = tree.get_pending_income()
+    active_dist = get_active_distribution(request) if tree.type == "TON" else None
+    pending = tree_states([tree], now=now, distribution=active_dist)[tree.id]["pending_income"]
     if pending <= 0:
         return JsonResponse({"status": "error", "message": _("Нет накопленного дохода")}, status=400)
 
 
     if tree.type == 'CF':
-        user.cf_balance += pending
-        user.save(update_fields=["cf_balance"])
-        tree.last_cf_accrued = now
-        tree.save(update_fields=["last_cf_accrued"])
+        with transaction.atomic():
+            credit(user, cf=pending)
+            tree.last_cf_accrued = now
+            tree.save(update_fields=["last_cf_accrued"])
     elif tree.type == 'TON':
-        from trees.models import TonDistribution
-        active_dist = TonDistribution.objects.filter(is_active=True).last()
         if not active_dist or active_dist.left_to_distribute <= 0:
             return JsonResponse(
                 {"status": "error", "message": _("⛔ Раздача TON не активна или пул закончился")},
                 status=400
             )
 
-        pending = min(pending, active_dist.left_to_distribute)
-
-        user.ton_balance += pending
-        user.save(update_fields=["ton_balance"])
-
-        active_dist.distributed_amount += pending
-        if active_dist.distributed_amount >= active_dist.total_amount:
-            active_dist.is_active = False
-        active_dist.save(update_fields=["distributed_amount", "is_active"])
+        # Списываем из шардированного пула условными UPDATE — без блокировки общей строки
+        with transaction.atomic():
+            pending = active_dist.draw(pending)
+            if pending > 0:
+                credit(user, ton=pending)
 
-        tree.last_cf_accrued = now
-        tree.save(update_fields=["last_cf_accrued"])
+                tree.last_cf_accrued = now
+                tree.save(update_fields=["last_cf_accrued"])
+        if pending <= 0:
+            invalidate_active_distribution(request)
+            return JsonResponse(
+                {"status": "error", "message": _("⛔ Раздача TON не активна или пул закончился")},
+                status=400
+            )
+        invalidate_active_distribution(request)
 
     if tree.type == "CF":
         amount_str = fmt_amount(pending, 2)
@@ -380,6 +389,78 @@ def collect_income(request, tree_id):
     })
 
 
+def _user_trees_qs(user):
+    return Tree.objects.filter(user=user, type__in=["CF", "TON"])
+
+
+def _user_trees(user):
+    return list(_user_trees_qs(user).order_by("id"))
+
+
+@require_POST
+def water_all(request):
+    """AJAX: полить все деревья пользователя одним запросом."""
+    user = get_current_user(request)
+    if not user:
+        return JsonResponse({"status": "error", "message": _("Сначала авторизуйтесь")}, status=403)
+
+    trees = _user_trees(user)
+    active_dist = get_active_distribution(request) if any(t.type == "TON" for t in trees) else None
+    result = bulk.water_all(user, trees, timezone.now(), active_dist)
+
+    if not result["watered_count"]:
+        return JsonResponse({
+            "status": "error",
+            "message": _("Нет деревьев, которые нужно полить"),
+            "trees": result["trees"],
+        }, status=400)
+
+    return JsonResponse({
+        "status": "success",
+        "message": _("Полито деревьев: %(count)s") % {"count": result["watered_count"]},
+        "amount_cf": float(result["amount_cf"]),
+        "branches_dropped": result["branches_dropped"],
+        "new_balance_cf": float(user.cf_balance),
+        "trees": result["trees"],
+    })
+
+
+@csrf_exempt
+@require_POST
+def collect_all(request):
+    """AJAX: собрать доход со всех деревьев пользователя одним запросом."""
+    user = get_current_user(request)
+    if not user:
+        return JsonResponse({"status": "error", "message": _("Сначала авторизуйтесь")}, status=403)
+
+    trees = _user_trees(user)
+    active_dist = get_active_distribution(request) if any(t.type == "TON" for t in trees) else None
+    result = bulk.collect_all(user, trees, timezone.now(), active_dist)
+
+    if not result["collected_count"]:
+        return JsonResponse({
+            "status": "error",
+            "message": _("Нет накопленного дохода"),
+            "trees": result["trees"],
+        }, status=400)
+
+    if result["amount_ton"]:
+        invalidate_active_distribution(request)
+
+    return JsonResponse({
+        "status": "success",
+        "message": _("Начислено: %(cf)s FL, %(ton)s TON") % {
+            "cf": fmt_amount(result["amount_cf"], 2),
+            "ton": fmt_amount(result["amount_ton"], 4),
+        },
+        "collected_cf": float(result["amount_cf"]),
+        "collected_ton": float(result["amount_ton"]),
+        "new_balance_cf": float(user.cf_balance),
+        "new_balance_ton": float(user.ton_balance),
+        "trees": result["trees"],
+    })
+
+
 def use_shop_item(request, purchase_id):
     success, msg = use_purchase_for_cf_tree(request.user, purchase_id)
     success, message = apply_item_to_tree(request.user, purchase_id)
@@ -415,8 +496,10 @@ def start_ton_distribution(request):
     if request.method == "POST":
         total_amount = Decimal(request.POST.get("total_amount"))
         # Закрыть все предыдущие
-        TonDistribution.objects.filter(is_active=True).update(is_active=False)
+        for previous in TonDistribution.objects.filter(is_active=True):
+            previous.finish()
         dist = TonDistribution.objects.create(total_amount=total_amount, is_active=True)
+        invalidate_active_distribution(request)
         messages.success(request, _("Запущена новая раздача: %(amount)s TON.") % {"amount": total_amount})
 
     return redirect("home")
@@ -431,6 +514,53 @@ def finish_ton_distribution(request, dist_id):
         messages.success(request, _("Раздача завершена."))
     return redirect("home")
 
+def tree_state_etag(request):
+    """
+    Строгий ETag для /tree/state.json без загрузки деревьев: одно агрегирующее
+    чтение (число деревьев и максимальный updated_at) плюс остаток пула из снимка.
+    """
+    user = get_current_user(request)
+    if not user:
+        return None
+    agg = _user_trees_qs(user).aggregate(
+        count=Count("id"), ton=Count("id", filter=Q(type="TON")), changed=Max("updated_at"),
+    )
+    parts = [user.pk, agg["count"], agg["changed"] and agg["changed"].isoformat()]
+    if agg["ton"]:
+        dist = get_active_distribution(request)
+        parts += [dist.pk, str(dist.left_to_distribute)] if dist else [None]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+@require_GET
+@condition(etag_func=tree_state_etag)
+def tree_state_json(request):
+    """
+    Компактное состояние деревьев пользователя (см. income.state_vector).
+    Доход и вода тикают на клиенте; опрос с If-None-Match получает 304, пока
+    не изменились деревья или остаток пула.
+    """
+    user = get_current_user(request)
+    if not user:
+        return JsonResponse({"status": "error", "message": _("Сначала авторизуйтесь")}, status=403)
+
+    trees = _user_trees(user)
+    pool = None
+    if any(t.type == "TON" for t in trees):
+        dist = get_active_distribution(request)
+        if dist:
+            pool = {"id": dist.pk, "left_to_distribute": float(dist.left_to_distribute)}
+
+    response = JsonResponse({
+        "water_duration_hours": Tree.WATER_DURATION,
+        "fertilizer_multiplier": 2,
+        "pool": pool,
+        "trees": [state_vector(tree) for tree in trees],
+    })
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
 @require_GET
 def stats_by_watering_json(request):
     token = request.headers.get("X-API-TOKEN")
@@ -0,0 +1,17 @@
+from rest_framework.authentication import SessionAuthentication
+
+from users.models import User
+
+
+class TelegramSessionAuthentication(SessionAuthentication):
+    """
+    Пользователь из сессии Telegram: его уже положил в request.user
+    users.middleware.TelegramAuthMiddleware. CSRF проверяется как у SessionAuthentication.
+    """
+
+    def authenticate(self, request):
+        user = getattr(request._request, "user", None)
+        if not isinstance(user, User):
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
@@ -0,0 +1,207 @@
+# users/balances.py
+"""
+Начисления на балансы пользователей.
+
+По умолчанию credit() сразу делает одно UPDATE через F(). При
+settings.BALANCE_WRITE_BEHIND = True начисления пишутся в append-only таблицу
+BalanceIncrement (в той же транзакции, что и игровое действие) и периодически
+сворачиваются в User пачками командой flush_balances.
+
+Правила для режима write-behind:
+- чтение: apply_pending(user) накладывает несвёрнутую дельту на объект в памяти
+  (TelegramAuthMiddleware делает это для GET);
+- списание: только debit() — сворачивает начисления пользователя (flush_user) и
+  списывает условным UPDATE через F(), без чтения-изменения-записи баланса;
+- User.save() не пишет поля баланса, которые не менялись после загрузки, поэтому
+  сохранение профиля не затирает начисления, свёрнутые параллельным flush_balances.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Sum, Value, When
+
+from .supply import add_cf_circulating
+
+# Поле User -> поле BalanceIncrement
+FIELDS = {
+    "cf_balance": "cf",
+    "ton_balance": "ton",
+    "branches_balance": "branches",
+}
+
+FLUSH_BATCH_SIZE = 5000
+
+
+def write_behind_enabled():
+    return getattr(settings, "BALANCE_WRITE_BEHIND", False)
+
+
+def _unflushed(user):
+    if "_unflushed" not in user.__dict__:
+        user.__dict__["_unflushed"] = defaultdict(Decimal)
+    return user.__dict__["_unflushed"]
+
+
+def _apply_in_memory(user, amounts, unflushed):
+    for field, amount in amounts.items():
+        if not amount:
+            continue
+        setattr(user, field, getattr(user, field) + amount)
+        if unflushed:
+            _unflushed(user)[field] += amount
+
+
+def credit(user, cf=Decimal("0"), ton=Decimal("0"), branches=0):
+    """Начисляет пользователю суммы и обновляет объект в памяти."""
+    amounts = {"cf_balance": Decimal(cf), "ton_balance": Decimal(ton), "branches_balance": int(branches)}
+    if not any(amounts.values()):
+        return
+
+    from .models import BalanceIncrement, User
+
+    if write_behind_enabled():
+        BalanceIncrement.objects.create(user_id=user.pk, cf=cf, ton=ton, branches=branches)
+        _apply_in_memory(user, amounts, unflushed=True)
+        return
+
+    User.objects.filter(pk=user.pk).update(
+        **{field: F(field) + amount for field, amount in amounts.items() if amount}
+    )
+    if cf:
+        # queryset.update() обходит User.save() — учитываем эмиссию вручную
+        add_cf_circulating(cf)
+    _apply_loaded(user, amounts)
+    _apply_in_memory(user, amounts, unflushed=False)
+
+
+def debit(user, cf=Decimal("0"), ton=Decimal("0"), branches=0):
+    """
+    Списывает суммы одним условным UPDATE через F(). Возвращает False, если на
+    каком-то из балансов не хватает средств (тогда ничего не списано).
+    В режиме write-behind сначала сворачивает начисления пользователя.
+    """
+    amounts = {"cf_balance": Decimal(cf), "ton_balance": Decimal(ton), "branches_balance": int(branches)}
+    amounts = {field: amount for field, amount in amounts.items() if amount}
+    if not amounts:
+        return True
+
+    from .models import User
+
+    if write_behind_enabled():
+        flush_user(user)
+    updated = User.objects.filter(
+        pk=user.pk, **{f"{field}__gte": amount for field, amount in amounts.items()}
+    ).update(**{field: F(field) - amount for field, amount in amounts.items()})
+    if not updated:
+        return False
+    if cf:
+        add_cf_circulating(-Decimal(cf))
+    spent = {field: -amount for field, amount in amounts.items()}
+    _apply_loaded(user, spent)
+    _apply_in_memory(user, spent, unflushed=False)
+    return True
+
+
+def _apply_loaded(user, amounts):
+    """Сдвигает запомненные значения из БД (User.from_db) на сумму UPDATE через F()."""
+    loaded = user.__dict__.get("_loaded_balances")
+    if not loaded:
+        return
+    for field, amount in amounts.items():
+        if amount and loaded.get(field) is not None:
+            loaded[field] += amount
+
+
+def pending(user_ids):
+    """Несвёрнутые начисления: {user_id: {"cf_balance": ..., ...}} одним запросом."""
+    from .models import BalanceIncrement
+
+    rows = (
+        BalanceIncrement.objects.filter(user_id__in=list(user_ids))
+        .values("user_id")
+        .annotate(cf_balance=Sum("cf"), ton_balance=Sum("ton"), branches_balance=Sum("branches"))
+    )
+    return {
+        row.pop("user_id"): {field: row[field] or 0 for field in FIELDS}
+        for row in rows
+    }
+
+
+def apply_pending(user):
+    """Накладывает несвёрнутую дельту на объект пользователя (для отображения)."""
+    if not write_behind_enabled() or "_unflushed" in user.__dict__:
+        return user
+    delta = pending([user.pk]).get(user.pk)
+    if delta:
+        _apply_in_memory(user, delta, unflushed=True)
+    else:
+        _unflushed(user)
+    return user
+
+
+def flush(user_ids=None, batch_size=FLUSH_BATCH_SIZE):
+    """
+    Сворачивает до batch_size начислений в балансы: одно UPDATE с CASE на пачку
+    и удаление свёрнутых строк в той же транзакции. Возвращает число строк.
+    """
+    from .models import BalanceIncrement, User
+
+    with transaction.atomic():
+        qs = BalanceIncrement.objects.order_by("id")
+        if user_ids is not None:
+            qs = qs.filter(user_id__in=list(user_ids))
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+        rows = list(qs.values_list("id", "user_id", "cf", "ton", "branches")[:batch_size])
+        if not rows:
+            return 0
+
+        # Строки, которые успел свернуть параллельный flush, не применяем повторно
+        deleted, _ = BalanceIncrement.objects.filter(pk__in=[row[0] for row in rows]).delete()
+        if deleted != len(rows):
+            transaction.set_rollback(True)
+            return 0
+
+        totals = defaultdict(lambda: [Decimal("0"), Decimal("0"), 0])
+        for _pk, user_id, cf, ton, branches in rows:
+            totals[user_id][0] += cf
+            totals[user_id][1] += ton
+            totals[user_id][2] += branches
+
+        updates = {}
+        for index, (field, output) in enumerate((
+            ("cf_balance", DecimalField(max_digits=15, decimal_places=2)),
+            ("ton_balance", DecimalField(max_digits=15, decimal_places=8)),
+            ("branches_balance", IntegerField()),
+        )):
+            whens = [When(pk=user_id, then=Value(t[index])) for user_id, t in totals.items() if t[index]]
+            if whens:
+                updates[field] = F(field) + Case(*whens, default=Value(0), output_field=output)
+        if updates:
+            User.objects.filter(pk__in=list(totals)).update(**updates)
+
+        cf_total = sum((t[0] for t in totals.values()), Decimal("0"))
+        if cf_total:
+            add_cf_circulating(cf_total)
+    return len(rows)
+
+
+def flush_pending(user_ids):
+    """Сворачивает все начисления пользователей user_ids (перед списанием по id)."""
+    if not write_behind_enabled():
+        return
+    while flush(user_ids):
+        pass
+
+
+def flush_user(user):
+    """
+    Точный баланс перед проверкой: сворачивает начисления пользователя и
+    перечитывает балансы в объект.
+    """
+    flush_pending([user.pk])
+    user.refresh_from_db(fields=list(FIELDS))
+    return user
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.balances import FLUSH_BATCH_SIZE, flush
+
+
+class Command(BaseCommand):
+    help = "Сворачивает отложенные начисления (BalanceIncrement) в балансы пользователей"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=FLUSH_BATCH_SIZE)
+        parser.add_argument("--loop", action="store_true", help="Работать постоянно")
+        parser.add_argument("--interval", type=float, default=2.0, help="Пауза между проходами в --loop, сек")
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                flushed = flush(batch_size=options["batch_size"])
+                total += flushed
+                if flushed < options["batch_size"]:
+                    break
+            if total or not options["loop"]:
+                self.stdout.write(f"Flushed increments: {total}")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from users.supply import reconcile
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает глобальные счётчики (эмиссия CF, участники TON) по исходным таблицам и показывает расхождение"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только показать расхождение, не перезаписывая счётчики",
+        )
+
+    def handle(self, *args, **options):
+        apply = not options["check"]
+        report = reconcile(apply=apply)
+
+        has_drift = False
+        for name, (counter, actual, drift) in report.items():
+            has_drift = has_drift or drift != 0
+            line = f"{name}: counter={counter} actual={actual} drift={drift}"
+            self.stdout.write(self.style.WARNING(line) if drift else line)
+
+        if not has_drift:
+            self.stdout.write(self.style.SUCCESS("Counters are in sync"))
+        elif apply:
+            self.stdout.write(self.style.SUCCESS("Counters rebuilt"))
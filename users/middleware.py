@@ -3,6 +3,7 @@
 from django.conf import settings
 from django.shortcuts import redirect
 from .models import User
+from .balances import apply_pending
 
 class TelegramAuthMiddleware:
     """
@@ -62,6 +63,10 @@ class TelegramAuthMiddleware:
         try:
             user = User.objects.get(telegram_id=telegram_id)
             request.user = user
+            if request.method in ("GET", "HEAD", "OPTIONS"):
+                # Страницы показывают баланс с несвёрнутыми начислениями; списания
+                # сами сворачивают их через users.balances.debit
+                apply_pending(user)
         except User.DoesNotExist:
             # Если вдруг в сессии лежит несуществующий ID, сбрасываем сессию и снова кидаем на авторизацию
             del request.session["telegram_id"]
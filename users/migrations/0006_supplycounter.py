@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:31
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def seed_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    BurnedToken = apps.get_model('trees', 'BurnedToken')
+    SupplyCounter = apps.get_model('users', 'SupplyCounter')
+    SupplyCounter.objects.create(
+        name='cf_circulating',
+        value=User.objects.aggregate(total=Sum('cf_balance'))['total'] or 0,
+    )
+    SupplyCounter.objects.create(
+        name='cf_burned',
+        value=BurnedToken.objects.aggregate(total=Sum('amount'))['total'] or 0,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_language'),
+        ('trees', '0006_burnedtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplyCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Счётчик эмиссии',
+                'verbose_name_plural': 'Счётчики эмиссии',
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
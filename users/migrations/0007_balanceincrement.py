@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_supplycounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceIncrement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cf', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('ton', models.DecimalField(decimal_places=8, default=0, max_digits=15)),
+                ('branches', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_increments', to='users.user')),
+            ],
+            options={
+                'verbose_name': 'Начисление в очереди',
+                'verbose_name_plural': 'Начисления в очереди',
+            },
+        ),
+    ]
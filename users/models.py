@@ -67,11 +67,109 @@ class User(models.Model):
         min_cf = settings.GAME_SETTINGS.get('MIN_CF_FOR_STAKING', 300)
         return self.cf_balance >= min_cf
 
+    BALANCE_FIELDS = ("cf_balance", "ton_balance", "branches_balance")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем балансы из БД: save() пишет только изменённые и учитывает эмиссию CF
+        instance._loaded_balances = {
+            field: instance.__dict__[field] for field in cls.BALANCE_FIELDS if field in instance.__dict__
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        # Перечитанный баланс уже не содержит наложенной дельты users.balances
+        loaded = self.__dict__.setdefault("_loaded_balances", {})
+        for field in self.BALANCE_FIELDS:
+            if fields is None or field in fields:
+                loaded[field] = self.__dict__.get(field)
+        unflushed = self.__dict__.get("_unflushed")
+        if unflushed:
+            for field in list(unflushed):
+                if fields is None or field in fields:
+                    del unflushed[field]
+
+    def save(self, *args, **kwargs):
+        # Несвёрнутые начисления (users.balances) хранятся в BalanceIncrement — в строку пишем без них
+        unflushed = dict(self.__dict__.get("_unflushed") or {})
+        stored = {
+            field: self.__dict__[field] - unflushed.get(field, 0)
+            for field in self.BALANCE_FIELDS if field in self.__dict__  # отложенные (.only) не трогаем
+        }
+        adding = self._state.adding
+        loaded = {} if adding else dict(self.__dict__.get("_loaded_balances") or {})
+
+        # Неизменённые балансы не пишем: абсолютная запись значения, прочитанного до
+        # параллельного UPDATE через F() (flush_balances, credit), потеряла бы его
+        unchanged = {
+            field for field in stored
+            if loaded.get(field) is not None and stored[field] == loaded[field]
+        }
+        update_fields = kwargs.get("update_fields")
+        if unchanged and not kwargs.get("force_insert"):
+            if update_fields is None:
+                update_fields = [
+                    f.name for f in self._meta.concrete_fields if not f.primary_key and f.attname in self.__dict__
+                ]
+            kwargs["update_fields"] = update_fields = [f for f in update_fields if f not in unchanged]
+            if not update_fields:
+                return
+        written = [
+            field for field in stored
+            if field not in unchanged and (update_fields is None or field in update_fields)
+        ]
+
+        for field, amount in unflushed.items():
+            setattr(self, field, stored[field])
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            for field, amount in unflushed.items():
+                setattr(self, field, stored[field] + amount)
+
+        if "cf_balance" in written and (adding or "cf_balance" in loaded):
+            from decimal import Decimal
+            from .supply import add_cf_circulating
+            delta = Decimal(stored["cf_balance"]) - Decimal(loaded.get("cf_balance") or 0)
+            if delta:
+                add_cf_circulating(delta)
+        self.__dict__.setdefault("_loaded_balances", {}).update({field: stored[field] for field in written})
+
     def can_access_p2p(self):
         """Проверяет, имеет ли пользователь доступ к P2P-бирже"""
         # Доступ открывается после стейкинга
         return self.staking_until is not None
 
+class BalanceIncrement(models.Model):
+    """Несвёрнутое начисление на баланс (режим BALANCE_WRITE_BEHIND, см. users.balances)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_increments')
+    cf = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    ton = models.DecimalField(max_digits=15, decimal_places=8, default=0)
+    branches = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Начисление в очереди'
+        verbose_name_plural = 'Начисления в очереди'
+
+    def __str__(self):
+        return f"{self.user_id}: +{self.cf} CF, +{self.ton} TON, +{self.branches} веток"
+
+class SupplyCounter(models.Model):
+    """Глобальные счётчики эмиссии CF, обновляются атомарно через F() (см. users.supply)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Счётчик эмиссии'
+        verbose_name_plural = 'Счётчики эмиссии'
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
 class TonDepositRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=14, decimal_places=6)
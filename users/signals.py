@@ -0,0 +1,19 @@
+# users/signals.py
+
+from decimal import Decimal
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import User
+from .supply import add_cf_circulating
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Срабатывает и при QuerySet.delete(): баланс удалённого больше не «выращен».
+    # Несвёрнутые начисления (users.balances) в счётчик ещё не попали — их не вычитаем
+    unflushed = instance.__dict__.get("_unflushed") or {}
+    balance = Decimal(instance.cf_balance or 0) - unflushed.get("cf_balance", 0)
+    if balance:
+        add_cf_circulating(-balance)
@@ -0,0 +1,91 @@
+# users/supply.py
+
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+TOTAL_CREATED_CF = 25_000_000
+
+CF_CIRCULATING = "cf_circulating"  # сумма cf_balance всех пользователей («выращено»)
+CF_BURNED = "cf_burned"            # сумма BurnedToken.amount
+TON_PARTICIPANTS = "ton_participants"  # число пользователей с TON-деревом (см. trees.participants)
+
+
+def add(name, delta):
+    """Атомарно прибавляет delta к счётчику name (создаёт счётчик при первом обращении)."""
+    from .models import SupplyCounter
+
+    delta = Decimal(delta)
+    if SupplyCounter.objects.filter(name=name).update(value=F("value") + delta):
+        return
+    try:
+        with transaction.atomic():
+            SupplyCounter.objects.create(name=name, value=delta)
+    except IntegrityError:
+        # Счётчик успел создать параллельный запрос
+        SupplyCounter.objects.filter(name=name).update(value=F("value") + delta)
+
+
+def add_cf_circulating(delta):
+    """
+    Вызывается из User.save() автоматически. Код, меняющий cf_balance через
+    queryset.update(), должен вызывать эту функцию сам.
+    """
+    add(CF_CIRCULATING, delta)
+
+
+def add_cf_burned(amount):
+    add(CF_BURNED, amount)
+
+
+def get_cf_supply():
+    """«Выращено / сожжено / осталось из 25 000 000» одним запросом к таблице счётчиков."""
+    from .models import SupplyCounter
+
+    values = dict(
+        SupplyCounter.objects.filter(name__in=[CF_CIRCULATING, CF_BURNED]).values_list("name", "value")
+    )
+    grown = values.get(CF_CIRCULATING, Decimal("0"))
+    burned = values.get(CF_BURNED, Decimal("0"))
+    return {
+        "total_created": TOTAL_CREATED_CF,
+        "grown": grown,
+        "burned": burned,
+        "left": TOTAL_CREATED_CF - grown - burned,
+    }
+
+
+def compute_actual():
+    """Полный пересчёт счётчиков по исходным таблицам (дорого, только для сверки)."""
+    from trees.models import BurnedToken
+    from trees.participants import count_ton_participants
+    from .models import User
+
+    return {
+        CF_CIRCULATING: User.objects.aggregate(total=Sum("cf_balance"))["total"] or Decimal("0"),
+        CF_BURNED: BurnedToken.objects.aggregate(total=Sum("amount"))["total"] or Decimal("0"),
+        TON_PARTICIPANTS: Decimal(count_ton_participants()),
+    }
+
+
+def reconcile(apply=True):
+    """
+    Сверяет счётчики с исходными таблицами. Возвращает {name: (counter, actual, drift)}.
+    При apply=True счётчики перезаписываются фактическими значениями.
+    """
+    from .models import SupplyCounter
+
+    report = {}
+    with transaction.atomic():
+        actual = compute_actual()
+        stored = dict(SupplyCounter.objects.select_for_update().values_list("name", "value"))
+        for name, value in actual.items():
+            counter = stored.get(name, Decimal("0"))
+            report[name] = (counter, value, counter - value)
+            if apply:
+                SupplyCounter.objects.update_or_create(name=name, defaults={"value": value})
+    if apply:
+        from trees.participants import invalidate_ton_participants
+        invalidate_ton_participants()
+    return report
@@ -1,3 +1,123 @@
-from django.test import TestCase
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from trees.models import BurnedToken
+from . import balances
+from .models import BalanceIncrement, User
+from .supply import CF_CIRCULATING, get_cf_supply, reconcile
+
+
+class SupplyCounterTest(TestCase):
+    def test_counters_follow_balance_changes_and_burns(self):
+        user = User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("100"))
+        other = User.objects.create(telegram_id=2, first_name="B")
+
+        user = User.objects.get(pk=1)
+        user.cf_balance += Decimal("25.50")
+        user.save(update_fields=["cf_balance"])
+        other.cf_balance = Decimal("10")
+        other.save()
+        user.ton_balance = Decimal("3")
+        user.save(update_fields=["ton_balance"])
+        BurnedToken.objects.create(amount=Decimal("40"))
+
+        supply = get_cf_supply()
+        self.assertEqual(supply["grown"], Decimal("135.50"))
+        self.assertEqual(supply["burned"], Decimal("40"))
+        self.assertEqual(supply["left"], 25_000_000 - Decimal("175.50"))
+
+    def test_deleted_users_leave_circulation(self):
+        User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("100"))
+        User.objects.create(telegram_id=2, first_name="B", cf_balance=Decimal("30"))
+        User.objects.create(telegram_id=3, first_name="C", cf_balance=Decimal("5"))
+        User.objects.get(pk=1).delete()
+        User.objects.filter(pk__in=[2, 3]).delete()
+        self.assertEqual(get_cf_supply()["grown"], Decimal("0"))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("100"))
+        # queryset.update() обходит User.save(), счётчик расходится
+        User.objects.filter(pk=1).update(cf_balance=Decimal("70"))
+
+        report = reconcile(apply=False)
+        self.assertEqual(report[CF_CIRCULATING], (Decimal("100"), Decimal("70"), Decimal("30")))
+
+        out = StringIO()
+        call_command("reconcile_supply", stdout=out)
+        self.assertIn("drift=30", out.getvalue())
+        self.assertEqual(get_cf_supply()["grown"], Decimal("70"))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+
+@override_settings(BALANCE_WRITE_BEHIND=True)
+class WriteBehindBalanceTest(TestCase):
+    def test_credits_are_buffered_and_flushed_in_batches(self):
+        user = User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("10"))
+        other = User.objects.create(telegram_id=2, first_name="B")
+
+        balances.credit(user, cf=Decimal("5"))
+        balances.credit(user, cf=Decimal("1.50"), branches=1)
+        balances.credit(other, ton=Decimal("0.25"))
+        self.assertEqual(user.cf_balance, Decimal("16.50"))
+        self.assertEqual(User.objects.get(pk=1).cf_balance, Decimal("10"))
+
+        # Чтение видит несвёрнутую дельту
+        fresh = balances.apply_pending(User.objects.get(pk=1))
+        self.assertEqual(fresh.cf_balance, Decimal("16.50"))
+        self.assertEqual(fresh.branches_balance, 1)
+
+        # Абсолютная запись баланса не задваивает отложенные начисления
+        user.cf_balance -= Decimal("2")
+        user.save(update_fields=["cf_balance"])
+        self.assertEqual(User.objects.get(pk=1).cf_balance, Decimal("8"))
+
+        out = StringIO()
+        call_command("flush_balances", stdout=out)
+        self.assertIn("Flushed increments: 3", out.getvalue())
+        self.assertFalse(BalanceIncrement.objects.exists())
+        user.refresh_from_db()
+        self.assertEqual((user.cf_balance, user.branches_balance), (Decimal("14.50"), 1))
+        self.assertEqual(User.objects.get(pk=2).ton_balance, Decimal("0.25"))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+    def test_flush_user_gives_exact_balance(self):
+        user = User.objects.create(telegram_id=1, first_name="A")
+        balances.credit(user, cf=Decimal("3"))
+        user = balances.flush_user(User.objects.get(pk=1))
+        self.assertEqual(user.cf_balance, Decimal("3"))
+        self.assertFalse(BalanceIncrement.objects.filter(user=user).exists())
+
+    def test_save_does_not_overwrite_concurrent_flush(self):
+        User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("10"))
+        balances.credit(User.objects.get(pk=1), cf=Decimal("5"))
+        # Запрос загрузил пользователя с дельтой, а flush_balances тем временем свернул её
+        user = balances.apply_pending(User.objects.get(pk=1))
+        balances.flush()
+        user.first_name = "B"
+        user.save()
+        self.assertEqual(User.objects.get(pk=1).cf_balance, Decimal("15"))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+    def test_debit_folds_pending_and_checks_balance(self):
+        User.objects.create(telegram_id=1, first_name="A", cf_balance=Decimal("2"))
+        balances.credit(User.objects.get(pk=1), cf=Decimal("3"))
+        user = User.objects.get(pk=1)
+        self.assertTrue(balances.debit(user, cf=Decimal("4")))
+        self.assertEqual(user.cf_balance, Decimal("1"))
+        self.assertFalse(balances.debit(user, cf=Decimal("2")))
+        self.assertEqual(User.objects.get(pk=1).cf_balance, Decimal("1"))
+        self.assertEqual(reconcile(apply=False)[CF_CIRCULATING][2], 0)
+
+    def test_credit_only_post_keeps_buffer(self):
+        user = User.objects.create(telegram_id=1, first_name="A")
+        balances.credit(user, cf=Decimal("1"))
+        session = self.client.session
+        session["telegram_id"] = user.pk
+        session.save()
+        self.client.post(reverse("collect_all"))
+        self.assertTrue(BalanceIncrement.objects.filter(user=user).exists())